@@ -2,6 +2,9 @@
 # agent_tools.py – Tool Definitions for Trade Intent and Consent Parsing
 #--------------------------------------------------------------------------------------
 
+from inventory_store import resolve_item, item_key
+
+
 def parse_trade_intent(trade_state: str="no trade", item: str="null", quantity: int=0):
     """
     Parses and formats trade intent by sanitizing item name and organizing trade data.
@@ -11,10 +14,13 @@ def parse_trade_intent(trade_state: str="no trade", item: str="null", quantity:
     :return: A dictionary containing cleaned item name (singular), trade state, and quantity.
     side effects:
         - Prints a green-highlighted debug message to console for tracking.
+    Notes:
+        - Known items are replaced by their catalog name ("Bottles of Rum" -> "bottle of rum", "banan" -> "banana");
+          unknown ones are kept as a normalized key so the NPC can say it does not have them.
     """
-    item = item.lower()
-    if item.endswith('s'):
-        item = item[:-1]
+    if isinstance(item, str):
+        match = resolve_item(item)
+        item = match[1] if match else item_key(item)
     print("\033[92mFunction parse_trade_intet called!\033[0m")    
     return {"trade_state": trade_state, "item": item, "quantity": quantity}
 
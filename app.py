@@ -3,17 +3,31 @@
 #--------------------------------------------------------------------------------------
 
 from dotenv import load_dotenv
-from flask import Flask, request, send_from_directory, jsonify, send_file, url_for
+from flask import Flask, request, send_from_directory, jsonify, send_file, url_for, Response, stream_with_context, g
 from flask_cors import CORS
 import os
-from openai import OpenAI
+from providers import create_client
 from pathlib import Path
 from agent_tools import tools, parse_trade_intent, trade_consent
-from inventory_store import execute_trade, get_inventory
-from prompt_generator import build_instructions, build_prompt, build_followup_prompt, build_consent_or_reintent_prompt
-from memory_store import add_memory, store_trade_results, load_last_trade_results, get_status_flag, set_status_flag_true, set_status_flag_false
+from inventory_store import execute_basket, get_inventory, get_inventories, get_inventory_version, get_unknown_entities, inventory_etag
+from prompt_generator import build_prompt, build_followup_prompt, build_consent_or_reintent_prompt, prompt_context_loaders
+from memory_store import add_memory, store_trade_results, load_last_trade_results, close_pending_trade
+from trade_state import is_trade_pending, propose_trade, confirm_trade, cancel_trade, reset_trade
+from inventory_events import subscribe, KEEPALIVE_SECONDS
+from audio_jobs import submit_audio_job, submit_chunked_audio_job, feed_audio_job, close_audio_job, cancel_audio_job, get_audio_job, audio_job_status, iter_audio_job
+from audio_cache import audio_cache_key, get_cached_audio, store_cached_audio, audio_cache_stats
+from trade_confirmation import render_trade_confirmation
+from metrics import span, observe, record_input_tokens, start_trace, end_trace, server_timing, render_metrics
+from consent_classifier import fast_consent, record_consent_turn, consent_stats
+from response_cache import response_cache_key, get_cached_response, store_cached_response, response_cache_stats
+from db import DEFAULT_CONVERSATION_ID
 import json
+import re
+import shutil
 import subprocess
+import tempfile
+import threading
+import time
 
 
 #--------------------------------------------------------------------------------------
@@ -24,7 +38,97 @@ app = Flask(__name__, static_folder='testfrontend')
 CORS(app)
 
 load_dotenv()
-client = OpenAI(api_key=os.getenv("OPENAI_API_KEY"))
+client = create_client()
+
+# Speech output: TTS voice, ffmpeg encode settings and the file the Unreal client plays
+TTS_MODEL = "gpt-4o-mini-tts"
+TTS_VOICE = "ash"
+TTS_INSTRUCTIONS = (
+    "Speak like a grumpy old pirate with a gravelly, raspy voice, "
+    "lots of growls and exaggerated pirate slang. Sound rough, sarcastic, "
+    "and like you've been chewing salt and shouting over stormy seas for 40 years."
+)
+# No ID3/Xing headers, so sentence segments can be concatenated into one playable stream
+FFMPEG_ENCODE_ARGS = ["-acodec", "libmp3lame", "-b:a", "192k", "-ar", "44100", "-ac", "2",
+                      "-id3v2_version", "0", "-write_xing", "0"]
+UNREAL_SOUND_PATH = Path(os.getenv("UNREAL_SOUND_PATH", "C:/UnrealSounds/speech.mp3"))
+AUDIO_CHUNK_SIZE = 16384
+# Speak replies sentence by sentence (lower time-to-first-audio); "0" synthesizes the whole reply at once
+AUDIO_CHUNKED = os.getenv("NPC_AUDIO_CHUNKED", "1") == "1"
+# Trade confirmation question: "template" renders it locally, "llm" asks gpt-4o in a second call
+TRADE_CONFIRMATION_MODE = os.getenv("NPC_TRADE_CONFIRMATION", "template")
+
+# Conversation ids come from clients and end up in file names and SQL parameters
+CONVERSATION_ID_PATTERN = re.compile(r"^[A-Za-z0-9_-]{1,64}$")
+
+
+def get_conversation_id():
+    """
+    Reads the conversation (player session) id of the current request from the
+    'conversation_id' form field or query parameter, or the 'X-Conversation-Id' header.
+    :return: (str | None) The id, 'default' if the client sent none, or None if it is invalid.
+    """
+    return validate_conversation_id(
+        request.form.get("conversation_id")
+        or request.args.get("conversation_id")
+        or request.headers.get("X-Conversation-Id")
+    )
+
+
+def validate_conversation_id(conversation_id):
+    """
+    Checks a client-supplied conversation id.
+    :param conversation_id: (str | None) Raw value from the request.
+    :return: (str | None) The id, 'default' if it is empty, or None if it is invalid.
+    """
+    if not conversation_id:
+        return DEFAULT_CONVERSATION_ID
+    if not CONVERSATION_ID_PATTERN.match(conversation_id):
+        return None
+    return conversation_id
+
+
+#--------------------------------------------------------------------------------------
+# Request tracing – latency histograms per endpoint, optional 'Server-Timing' trace header
+#--------------------------------------------------------------------------------------
+
+# Clients that send this header get the stage timings of their request back
+TRACE_REQUEST_HEADER = "X-Npc-Trace"
+
+
+@app.before_request
+def begin_request_trace():
+    g.request_started = time.perf_counter()
+    start_trace()
+
+
+@app.after_request
+def finish_request_trace(response):
+    """
+    Records the request duration and, if the client asked for it, returns the stage timings
+    as 'Server-Timing' and 'X-Npc-Trace-Id' headers.
+    Notes:
+        - For streamed responses (SSE, ?stream=1) this is the time until the stream starts;
+          their stages are still recorded in the histograms.
+    """
+    endpoint = request.url_rule.rule if request.url_rule else "unmatched"
+    observe("npc_request_duration_seconds", endpoint, time.perf_counter() - g.request_started)
+    trace = end_trace()
+    if trace and TRACE_REQUEST_HEADER in request.headers:
+        trace_id, spans = trace
+        response.headers["X-Npc-Trace-Id"] = trace_id
+        if spans:
+            response.headers["Server-Timing"] = server_timing(spans)
+    return response
+
+
+@app.route('/metrics')
+def metrics():
+    """
+    Prometheus scrape endpoint.
+    :return: Stage and request latency histograms in the Prometheus text format.
+    """
+    return Response(render_metrics(), mimetype="text/plain; version=0.0.4")
 
 
 #--------------------------------------------------------------------------------------
@@ -34,20 +138,29 @@ client = OpenAI(api_key=os.getenv("OPENAI_API_KEY"))
 @app.route("/npc/chat")
 def home():
     """
-    Serve the HTML page for the NPC chat interface.
+    Serve the HTML page for the NPC chat interface and reset the trade state of the
+    requested conversation ('default' unless 'conversation_id' is given).
     :return: The 'chatwindow.html' file from the 'testfrontend' directory.
     """
-    set_status_flag_false()
+    conversation_id = get_conversation_id()
+    if conversation_id and is_trade_pending(conversation_id):
+        reset_trade(conversation_id)
+        close_pending_trade("cancelled", conversation_id=conversation_id)
     return send_from_directory('testfrontend', 'chatwindow.html')
 
 
 @app.route("/npc/chat", methods=["POST"])
 def chat():
     """
-    Process player message input and generate NPC response with text and speech.
+    Process player message input and generate NPC response text; speech is synthesized in the background.
+    Each player session sends its own 'conversation_id' (form field or 'X-Conversation-Id' header),
+    so chat history, pending trades and audio are kept apart between concurrent players.
     :return: JSON containing:
             - 'text': NPC response text.
-            - 'audio_url': URL to the generated speech audio.
+            - 'conversation_id': Conversation the reply belongs to.
+            - 'audio_job_id': Id of the background speech job.
+            - 'audio_status_url': URL reporting whether the speech audio is ready.
+            - 'audio_url': URL of the speech audio (answers 202 until the job has finished).
     """
     player_message_form = request.form.get("userprompt", "")
 
@@ -57,14 +170,114 @@ def chat():
     player_message_form = data.get("message", "")
     """
 
-    npc_response = npc_chat(player_message_form)
-    with open("npc_response.txt", "w") as f:
-        f.write(npc_response)
-    audio_path = Path("speech.mp3")
-    return jsonify({
+    conversation_id = get_conversation_id()
+    if conversation_id is None:
+        return jsonify({"error": "Invalid conversation_id."}), 400
+    if not player_message_form:
+        return jsonify({"error": "Please provide a message"}), 400
+
+    npc_response = npc_chat(player_message_form, conversation_id)
+    return jsonify(npc_reply(npc_response, conversation_id))
+
+
+@app.route("/npc/chat/stream", methods=["POST"])
+def chat_stream():
+    """
+    Streaming variant of the chat endpoint using Server-Sent Events.
+    Takes the same input as POST /npc/chat.
+    :return: 'text/event-stream' with events:
+            - 'delta': {"text": ...} for each text fragment while the model is generating.
+            - 'done': Same JSON as POST /npc/chat; its 'text' is the final reply and
+                      replaces the streamed fragments (e.g. after a trade tool call).
+            - 'error': {"error": ...} if the turn failed.
+    """
+    player_message_form = request.form.get("userprompt", "")
+    conversation_id = get_conversation_id()
+    if conversation_id is None:
+        return jsonify({"error": "Invalid conversation_id."}), 400
+    if not player_message_form:
+        return jsonify({"error": "Please provide a message"}), 400
+
+    def generate():
+        # Speech starts with the first complete sentence, while the rest is still being generated
+        job_id = submit_chunked_audio_job(npc_voice_segment, on_complete=publish_unreal_audio) if AUDIO_CHUNKED else None
+        turn = npc_chat_stream(player_message_form, conversation_id)
+        npc_response, spoken = None, []
+        try:
+            while True:
+                try:
+                    delta = next(turn)
+                except StopIteration as finished:
+                    npc_response = finished.value
+                    break
+                if delta:
+                    if job_id:
+                        feed_audio_job(job_id, delta)
+                        spoken.append(delta)
+                    yield sse_event("delta", {"text": delta})
+        except Exception as e:
+            print(f"Error while streaming NPC reply: {e}")
+            yield sse_event("error", {"error": "The NPC could not answer."})
+            return
+        finally:
+            job_id = finish_streamed_audio(job_id, spoken, npc_response)
+        yield sse_event("done", npc_reply(npc_response, conversation_id, job_id))
+
+    return Response(
+        stream_with_context(generate()),
+        mimetype="text/event-stream",
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"}
+    )
+
+
+def finish_streamed_audio(job_id, spoken, npc_response):
+    """
+    Closes the speech job fed with the streamed deltas, if they add up to the final reply.
+    After a tool call the final text replaces what was streamed (e.g. text the model wrote
+    before calling the tool), so that job is dropped and the caller speaks the final text instead.
+    :param job_id: (str | None) Chunked audio job fed during the stream.
+    :param spoken: (list) Deltas fed to the job.
+    :param npc_response: (str | None) Final NPC text, None if the turn failed.
+    :return: (str | None) The job id if its speech matches the final text, else None.
+    """
+    if job_id is None:
+        return None
+    if npc_response is not None and "".join(spoken) == npc_response:
+        close_audio_job(job_id)
+        return job_id
+    cancel_audio_job(job_id)
+    return None
+
+
+def npc_reply(npc_response, conversation_id, job_id=None):
+    """
+    Queues speech for an NPC reply and builds the response body shared by the chat endpoints.
+    :param npc_response: Final NPC text.
+    :param conversation_id: Conversation the reply belongs to.
+    :param job_id: (str, optional) Audio job already fed with the streamed reply.
+    :return: (dict) 'text', 'conversation_id', 'audio_job_id', 'audio_status_url' and 'audio_url'.
+    """
+    if job_id is None and AUDIO_CHUNKED:
+        job_id = submit_chunked_audio_job(npc_voice_segment, text=npc_response, on_complete=publish_unreal_audio)
+    elif job_id is None:
+        job_id = submit_audio_job(npc_response, npc_voice_chat)
+    return {
         "text": npc_response,
-        "audio_url": url_for('get_audio', filename=audio_path.name, _external=True)
-    })
+        "conversation_id": conversation_id,
+        "audio_job_id": job_id,
+        "audio_status_url": url_for('audio_job', job_id=job_id, _external=True),
+        "audio_url": url_for('audio_job_file', job_id=job_id, _external=True)
+    }
+
+
+def sse_event(event, data):
+    """
+    Formats one Server-Sent Event with a JSON payload.
+    :param event: (str) Event name.
+    :param data: JSON-serializable payload.
+    :return: (str) Event block terminated by a blank line.
+    """
+    return f"event: {event}\ndata: {json.dumps(data)}\n\n"
 
 
 @app.route('/api/inventory/<entity_id>', methods=['GET'])
@@ -72,9 +285,224 @@ def api_get_inventory(entity_id):
     """
     Retrieve inventory data for a specific entity.
     :param entity_id: Unique identifier of the entity.
-    :return: Inventory details as JSON.
+    :return: Inventory details as JSON, or 304 if the client's If-None-Match ETag is still current.
+            404 for an unknown entity, whatever ETag is sent.
+    """
+    if get_unknown_entities([entity_id]):
+        return jsonify({"error": "No inventory found for this entity."}), 404
+    not_modified = inventory_not_modified()
+    if not_modified is not None:
+        return not_modified
+    response = get_inventory(entity_id)
+    if isinstance(response, Response):
+        response.headers["Cache-Control"] = "no-cache"  # revalidate on every poll
+    return response
+
+
+@app.route('/api/inventory', methods=['GET'])
+def api_get_inventories():
+    """
+    Retrieve the inventories of several entities in one request: `?ids=1,2`.
+    With `&since=<version>` only rows changed after that version are returned
+    (pass the 'version' of the previous response).
+    :return: JSON with 'version', 'since' and 'inventories' (entity id -> items); 304 if nothing changed,
+            404 with 'unknown_entities' if an id is not in the 'entities' table.
+    """
+    ids = parse_entity_ids(request.args.get("ids", ""))
+    since = request.args.get("since")
+    if not ids or (since is not None and not since.isdigit()):
+        return jsonify({"error": "ids must be a comma separated list of entity ids, since a version number"}), 400
+    unknown = get_unknown_entities(ids)
+    if unknown:
+        return jsonify({"error": "Unknown entity.", "unknown_entities": unknown}), 404
+
+    not_modified = inventory_not_modified()
+    if not_modified is not None:
+        return not_modified
+    result = get_inventories(ids, since=int(since) if since is not None else None)
+    response = jsonify(result)
+    response.set_etag(inventory_etag(result["version"]))
+    response.headers["Cache-Control"] = "no-cache"
+    return response
+
+
+@app.route('/api/inventory/events', methods=['GET'])
+def api_inventory_events():
+    """
+    Streams inventory changes as Server-Sent Events, instead of polling the inventory.
+    Optional `?ids=1,2` limits the stream to these entities.
+    :return: 'text/event-stream' with events:
+            - 'trade': {"version", "entity_ids", "inventories": entity id -> changed items with new quantity, "lines"}
+            - 'item': {"version", "item", "description"} when an item is added to the catalog.
+            - 'resync': {"since", "version"} when the client fell behind and events were dropped;
+                        fetch /api/inventory?ids=...&since=<since> to catch up.
+    """
+    ids = parse_entity_ids(request.args.get("ids", ""))
+    if ids is None:
+        return jsonify({"error": "ids must be a comma separated list of entity ids"}), 400
+    subscription = subscribe(ids)
+
+    def generate():
+        try:
+            yield sse_event("ready", {"version": get_inventory_version()})
+            while True:
+                event = subscription.get(timeout=KEEPALIVE_SECONDS)
+                if subscription.closed:
+                    return
+                yield sse_event(event["type"], event) if event else ": keepalive\n\n"
+        finally:
+            subscription.close()
+
+    return Response(
+        generate(),
+        mimetype="text/event-stream",
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"}
+    )
+
+
+def parse_entity_ids(value):
+    """
+    Parses a comma separated list of entity ids from a query parameter.
+    :param value: (str) E.g. '1,2'; empty for none.
+    :return: (list | None) Ids as strings (empty list for an empty value), or None if one is not a number.
+    """
+    ids = [entity_id.strip() for entity_id in value.split(",") if entity_id.strip()]
+    return ids if all(entity_id.isdigit() for entity_id in ids) else None
+
+
+def inventory_not_modified():
+    """
+    Answers a conditional inventory request whose ETag matches the current inventory version.
+    :return: (Response | None) Empty 304 response, or None if the client needs the data.
+    """
+    etag = inventory_etag(get_inventory_version())
+    if not request.if_none_match.contains_weak(etag):
+        return None
+    response = app.response_class(status=304)
+    response.set_etag(etag)
+    response.headers["Cache-Control"] = "no-cache"
+    return response
+
+
+@app.route('/api/trade/basket', methods=['POST'])
+def api_trade_basket():
+    """
+    Executes several buy/sell lines between a player and an NPC as one all-or-nothing trade.
+    JSON body: {"lines": [{"trade_state": "buy", "item": "apple", "quantity": 2}, ...],
+    "player_id": 2, "npc_id": 1} (ids optional).
+    :return: Result of `execute_basket()` as JSON; 409 if the trade was refused, 400 for a malformed body,
+            404 if the player or NPC does not exist.
+    """
+    data = request.get_json(silent=True) or {}
+    lines = data.get("lines")
+    if not isinstance(lines, list) or not lines or not all(isinstance(line, dict) for line in lines):
+        return jsonify({"error": "lines must be a non-empty list of trade lines"}), 400
+    try:
+        player_id, npc_id = int(data.get("player_id", 2)), int(data.get("npc_id", 1))
+    except (TypeError, ValueError):
+        return jsonify({"error": "player_id and npc_id must be integers"}), 400
+
+    with span("execute_trade"):
+        result = execute_basket(lines, player_id=player_id, npc_id=npc_id)
+    if result["unknown_entities"]:
+        return jsonify({"error": "Unknown entity.", **result}), 404
+    return jsonify(result), (200 if result["ok"] else 409)
+
+
+@app.route('/api/audio/jobs/<job_id>')
+def audio_job(job_id):
+    """
+    Report the state of a background speech job.
+    :param job_id: Id returned by the chat endpoint.
+    query params:
+        - 'wait': Optional seconds to block until the job has finished (max 30).
+    :return: JSON with 'job_id', 'status', 'segments', 'segment_urls' and, once ready, 'audio_url';
+            404 for unknown jobs.
+    """
+    wait = min(request.args.get("wait", 0, type=float), 30)
+    job = get_audio_job(job_id, wait=wait)
+    if job is None:
+        return jsonify({"error": "Unknown audio job."}), 404
+
+    status = audio_job_status(job)
+    if job["status"] == "ready":
+        status["audio_url"] = url_for('audio_job_file', job_id=job_id, _external=True)
+    status["segment_urls"] = [
+        url_for('audio_job_segment', job_id=job_id, index=index, _external=True)
+        for index in range(status["segments"])
+    ]
+    return jsonify(status)
+
+
+@app.route('/api/audio/jobs/<job_id>/segments/<int:index>')
+def audio_job_segment(job_id, index):
+    """
+    Return one sentence segment of a chunked speech job, in reading order.
+    Clients can play segment 0 while later sentences are still being synthesized.
+    :param job_id: Id returned by the chat endpoint.
+    :param index: Position of the segment (0-based).
+    :return: Audio file with MIME type 'audio/mpeg', 202 if the segment is not written yet,
+            404 for unknown jobs or segments past the end of a finished job.
+    """
+    job = get_audio_job(job_id)
+    if job is None:
+        return jsonify({"error": "Unknown audio job."}), 404
+    segments = job.get("segments", [])
+    if index < len(segments):
+        return send_file(segments[index]["path"], mimetype='audio/mpeg')
+    if job["done"].is_set():
+        return jsonify({"error": "No such segment."}), 404
+    return jsonify(audio_job_status(job)), 202
+
+
+@app.route('/api/audio/jobs/<job_id>/file')
+def audio_job_file(job_id):
+    """
+    Return the speech audio of a finished job.
+    :param job_id: Id returned by the chat endpoint.
+    query params:
+        - 'stream': If '1', stream the MP3 while it is still being synthesized and encoded.
+    :return: Audio file with MIME type 'audio/mpeg', 202 while still synthesizing,
+            404 for unknown jobs or 500 if synthesis failed.
+    """
+    job = get_audio_job(job_id)
+    if job is None:
+        return jsonify({"error": "Unknown audio job."}), 404
+    if job["status"] == "failed":
+        return jsonify(audio_job_status(job)), 500
+    if job["status"] != "ready" and request.args.get("stream") == "1":
+        return Response(iter_audio_job(job), mimetype='audio/mpeg')
+    if job["status"] != "ready":
+        return jsonify(audio_job_status(job)), 202
+    return send_file(job["path"], mimetype='audio/mpeg')
+
+
+@app.route('/api/audio/cache')
+def audio_cache():
+    """
+    Report hit/miss counters and size of the speech audio cache.
+    :return: JSON with 'hits', 'misses', 'stores', 'evictions', 'entries', 'bytes' and 'max_bytes'.
+    """
+    return jsonify(audio_cache_stats())
+
+
+@app.route('/api/response-cache')
+def response_cache():
     """
-    return get_inventory(entity_id)
+    Report hit rate, saved model latency and size of the response cache.
+    :return: JSON with 'hits', 'similar_hits', 'misses', 'hit_rate', 'avg_model_ms', 'saved_ms_total',
+            'stores', 'rejected', 'evictions', 'entries' and 'max_entries'.
+    """
+    return jsonify(response_cache_stats())
+
+
+@app.route('/api/consent/stats')
+def consent_fast_path_stats():
+    """
+    Report how often trade consent was answered locally instead of by the model.
+    :return: JSON with 'turns', 'hits', 'llm_calls', 'hit_rate', 'avg_llm_ms' and 'saved_ms_total'.
+    """
+    return jsonify(consent_stats())
 
 
 # Use for TestChatWindow
@@ -93,11 +521,22 @@ def get_audio(filename):
 def sound():
     """
     Return the formatted speech audio file for Unreal Engine integration.
-    :return: Audio file from a fixed Unreal Engine directory.
+    query params:
+        - 'job': Optional audio job id; waits (up to 30s) until that job has finished and returns
+                 its audio. Use this when several players are connected.
+    :return: Audio file of the job, or the last speech written to UNREAL_SOUND_PATH.
     """
-    speech_file_path = Path("C:/UnrealSounds/speech.mp3")
+    job_id = request.args.get("job")
+    if job_id:
+        job = get_audio_job(job_id, wait=30)
+        if job is None:
+            return jsonify({"error": "Unknown audio job."}), 404
+        if job["status"] != "ready":
+            return jsonify(audio_job_status(job)), 202 if job["status"] != "failed" else 500
+        return send_file(job["path"], mimetype="audio/mpeg", download_name="npc_voice.mp3")
+
     return send_file(
-        speech_file_path,
+        UNREAL_SOUND_PATH,
         mimetype="audio/mpeg",
         as_attachment=False,
         download_name="npc_voice.mp3")
@@ -107,11 +546,13 @@ def sound():
 # Main Function – Handles NPC Conversation and Tool Responses
 #--------------------------------------------------------------------------------------
 
-def npc_chat(player_message):
+def npc_chat(player_message, conversation_id=DEFAULT_CONVERSATION_ID):
     """
     Handles NPC interaction by generating responses, invoking tools, and managing trade states.
     :param player_message: Input text from the player.
+    :param conversation_id: Conversation (player session) the message belongs to. Defaults to 'default'.
     :return: NPC's final response text, optionally processed through a follow-up or trade logic.
+            Speech is not generated here; the caller queues it as a background audio job.
     """
     print(f"PlayerMessage: {player_message}") # Debugging log
 
@@ -119,149 +560,275 @@ def npc_chat(player_message):
     if not player_message:
         return "Please provide a message", 400
 
+    turn = drive_turn(npc_turn(player_message, conversation_id), stream=False)
+    while True:
+        try:
+            next(turn)
+        except StopIteration as finished:
+            return finished.value
+
+
+def npc_chat_stream(player_message, conversation_id=DEFAULT_CONVERSATION_ID):
+    """
+    Streaming variant of `npc_chat()`: yields text deltas while the model is still generating.
+    :param player_message: Input text from the player.
+    :param conversation_id: Conversation (player session) the message belongs to. Defaults to 'default'.
+    :return: Generator of text deltas; its return value (StopIteration.value) is the final NPC text.
+    Notes:
+        - On trade turns the final text replaces what was streamed before the tool call.
+    """
+    print(f"PlayerMessage (stream): {player_message}") # Debugging log
+    return drive_turn(npc_turn(player_message, conversation_id), stream=True)
+
+
+def drive_turn(turn, stream):
+    """
+    Runs the steps of `npc_turn()` on the calling thread with the blocking OpenAI client.
+    (asgi_app.py drives the same steps with AsyncOpenAI.)
+    :param turn: Generator returned by `npc_turn()`.
+    :param stream: (bool) If True, model calls are streamed and their text deltas are yielded.
+    :return: Generator of text deltas (none when stream is False); returns the final NPC text.
+    """
+    reply = None
+    while True:
+        try:
+            step, payload = turn.send(reply)
+        except StopIteration as finished:
+            return finished.value
+
+        if step == "context":
+            with span("prompt_context"):
+                reply = {name: load() for name, load in payload.items()}
+        elif step == "model":
+            if stream:
+                reply = yield from stream_response(**payload)
+            else:
+                reply = client.responses.create(**payload)
+        elif step == "text":
+            reply = None
+            if stream:
+                yield payload
+
+
+def npc_turn(player_message, conversation_id):
+    """
+    Runs one conversation turn: model call, tool handling and trade follow-up.
+    The turn does no network I/O itself; it yields steps that a driver performs and sends back:
+        - ("context", loaders): runs the independent prompt reads, sends back a dict of their results.
+        - ("model", request_args): calls the Responses API, sends back the response.
+        - ("text", npc_text): text produced without a model call (shown to streaming clients).
+    :param player_message: Input text from the player.
+    :param conversation_id: Conversation (player session) the message belongs to.
+    :return: Generator of steps (see `drive_turn()`); returns the final NPC text.
+    """
     # Memory logging
-    add_memory(text=player_message, role="user")
-    is_trade_ongoing = get_status_flag()
-    role_instruction = build_instructions()
-
-    # Response and tool parsing setup
-    tool_calls = ""
-    results = []
-    last_tool_used = []
-    trade_state = None
-    buy_items = []
-    sell_items = []
-    consent_result = []
+    add_memory(text=player_message, role="user", conversation_id=conversation_id)
+    is_trade_ongoing = is_trade_pending(conversation_id)  # in memory, see trade_state.py
+
+    # Step 0: Plain yes/no/unsure replies to a pending trade are answered without the model
+    if is_trade_ongoing:
+        started = time.perf_counter()
+        consent = fast_consent(player_message)
+        if consent:
+            record_consent_turn(True, (time.perf_counter() - started) * 1000)
+            npc_text = resolve_trade_consent(trade_consent(consent), conversation_id)
+            yield "text", npc_text
+            return npc_text
+
+    # Step 0b: Repeated questions are answered from the response cache (no prompt, no model call)
+    cache_key = None
+    if not is_trade_ongoing:
+        with span("response_cache"):
+            cache_key = response_cache_key(player_message, conversation_id=conversation_id)
+            npc_text = get_cached_response(cache_key)
+        if npc_text is not None:
+            add_memory(text=npc_text, role="assistant", conversation_id=conversation_id)
+            yield "text", npc_text
+            return npc_text
 
     # Step 1: Generate response based on trade state
-    if not is_trade_ongoing:
-        standard_prompt = build_prompt(player_message)
-        response = client.responses.create(
-            model="gpt-4o",
-            instructions=role_instruction,
-            input=standard_prompt,
-            tools=tools,
-            tool_choice="auto"
-        )
-        add_memory(text=response.output_text, role="assistant")
-        tool_calls = response.output
-        print(f"Standard-Response-Output: {response.output}")  # Debugging
-        print(f"Standard-Response-Output-Text: {response.output_text}")  # Debugging
-
-    elif is_trade_ongoing:
-        consent_prompt = build_consent_or_reintent_prompt(player_message)
-        response = client.responses.create(
-            model="gpt-4o",
-            instructions=role_instruction,
-            input=consent_prompt,
-            tools=tools,
-            tool_choice="auto"
-        )
-        add_memory(text=response.output_text, role="assistant")
-        tool_calls = response.output
-        print(f"Standard-Response-Output: {response.output}")  # Debugging
-        print(f"Standard-Response-Output-Text: {response.output_text}")  # Debugging
+    context = yield "context", prompt_context_loaders(conversation_id, is_trade_ongoing, player_message)
+    role_instruction = context.pop("instructions")
+    with span("prompt_build"):
+        if not is_trade_ongoing:
+            prompt = build_prompt(player_message, conversation_id, **context)
+        else:
+            prompt = build_consent_or_reintent_prompt(player_message, conversation_id, **context)
+
+    request_args = dict(
+        model="gpt-4o",
+        instructions=role_instruction,
+        input=prompt,
+        tools=tools,
+        tool_choice="auto"
+    )
+    started = time.perf_counter()
+    with span("llm_response"):
+        response = yield "model", request_args
+    if is_trade_ongoing:
+        record_consent_turn(False, (time.perf_counter() - started) * 1000)
+    store_cached_response(cache_key, response, time.perf_counter() - started)  # skipped if it calls tools
+    add_memory(text=response.output_text, role="assistant", conversation_id=conversation_id)
+    print(f"Standard-Response-Output: {response.output}")  # Debugging
+    print(f"Standard-Response-Output-Text: {response.output_text}")  # Debugging
+    print(f"Input tokens: {record_input_tokens('llm_response', response)}")  # Debugging
 
     # Step 2: Handle invoked tools if available
-    if tool_calls and isinstance(tool_calls, list):
-        for tool_call in tool_calls:
-            if hasattr(tool_call, "arguments"):
-                try:
-                    args = json.loads(tool_call.arguments)
-
-                    # Trade intent parser
-                    if tool_call.name == "parse_trade_intent":
-                        set_status_flag_true()
-                        trade_state = args["trade_state"]
-                        item = args["item"]
-                        quantity = args["quantity"]
-                        result = parse_trade_intent(trade_state, item, quantity)
-                        results.append(result)
-                        store_trade_results(results)
-                        last_tool_used = "parse_trade_intent"
-
-                        if result["trade_state"] == "buy":
-                            buy_items.append(result)
-                        elif result["trade_state"] == "sell":
-                            sell_items.append(result)
-
-                        # Debugging
-                        print(f"\033[94mResults: {results}\033[0m")
-                        print(f"\033[94mBuy Items: {buy_items}\033[0m")
-                        print(f"\033[94mSell Items: {sell_items}\033[0m")
-                    
-                    # Trade consent handler
-                    elif tool_call.name == "trade_consent":
-                        consent = args["consent"]
-                        consent_result = trade_consent(consent)
-                        last_tool_used = "trade_consent"
-                        print(f"Consent Result: {consent_result}") # Debugging
-                    
-                    else:
-                        print(f"Unknown Tool: {tool_call.name}")
-
-                except Exception as e:
-                    print(f"Error processing tool arguments: {e}")
-            else:
-                print("Tool call without arguments field detected!")
+    with span("tool_dispatch"):
+        trade = handle_tool_calls(response.output, conversation_id)
 
     # Step 3: Follow-up based on last tool used
 
-    # If intent was parsed → prompt confirmation
-    if last_tool_used == "parse_trade_intent" and results:
-        followup_prompt = build_followup_prompt(buy_items, sell_items)
-        followup_response = client.responses.create(
+    # If intent was parsed → prompt confirmation (rendered locally unless switched to the LLM)
+    if trade["last_tool_used"] == "parse_trade_intent" and trade["results"] and TRADE_CONFIRMATION_MODE == "template":
+        with span("trade_confirmation"):
+            npc_text = render_trade_confirmation(trade["buy_items"], trade["sell_items"])
+        if npc_text:
+            add_memory(text=npc_text, role="assistant", conversation_id=conversation_id)
+            yield "text", npc_text
+            return npc_text
+
+    if trade["last_tool_used"] == "parse_trade_intent" and trade["results"]:
+        followup_prompt = build_followup_prompt(trade["buy_items"], trade["sell_items"], conversation_id)
+        followup_args = dict(
             model="gpt-4o",
             instructions=role_instruction,
             input=followup_prompt
         )
+        with span("llm_followup"):
+            followup_response = yield "model", followup_args
+        record_input_tokens("llm_followup", followup_response)
         npc_text = followup_response.output_text or ""
-        add_memory(text=npc_text, role="assistant")
-        npc_voice_chat(npc_text)
+        add_memory(text=npc_text, role="assistant", conversation_id=conversation_id)
         print("\033[93mFollow-up GPT Output:\033[0m", followup_response.output) # Debugging
         return npc_text
 
     # If consent was given → confirm or cancel trade
-    if last_tool_used == "trade_consent" and consent_result:
-        player_consent = consent_result["Consent"]
-        print(f"\033[93mDebugg PlayerConsent: {player_consent}\033[0m") # Debugging
-
-        if player_consent == "yes":
-            confirmations = []
-            results = load_last_trade_results(1)
-            print(f"\033[92mResultsHandling: {results}\033[0m")
-            for result in results:
-                trade_state = result["trade_state"]
-                item_name = result["item"]
-                quantity = result["quantity"]
-                message = execute_trade(trade_state, item_name, quantity)
-                confirmations.append(message)
-            npc_text_yes = "\n".join(confirmations)
-            add_memory(text=npc_text_yes, role="assistant")
-            npc_voice_chat(npc_text_yes)
-            set_status_flag_false()
-            print(f"TTS INPUT: {npc_text_yes}")
-            return npc_text_yes
-
-        elif player_consent == "no":
-            npc_text_no = "Understood. The trade has been cancelled."
-            add_memory(text=npc_text_no, role="assistant")
-            npc_voice_chat(npc_text_no)
-            set_status_flag_false()
-            return npc_text_no
-
-        elif player_consent == "unsure":
-            npc_text_unsure = "I'm not sure if you're ready to trade. Let me know when you are!"
-            add_memory(text=npc_text_unsure, role="assistant")
-            npc_voice_chat(npc_text_unsure)
-            set_status_flag_false()
-            return npc_text_unsure
+    if trade["last_tool_used"] == "trade_consent" and trade["consent_result"]:
+        npc_text = resolve_trade_consent(trade["consent_result"], conversation_id)
+        if npc_text is not None:
+            yield "text", npc_text
+            return npc_text
 
     # Step 4: Default return if no tools were triggered
-    else:
-        npc_text = response.output_text
-        npc_voice_chat(npc_text)
-        return npc_text
+    npc_text = response.output_text
+    return npc_text
+
+def handle_tool_calls(tool_calls, conversation_id):
+    """
+    Executes the tool calls of a model response and collects the parsed trade data.
+    :param tool_calls: Output items of the model response.
+    :param conversation_id: Conversation (player session) the pending trade belongs to.
+    :return: (dict) 'results', 'buy_items', 'sell_items', 'consent_result' and 'last_tool_used'.
+    """
+    trade = {"results": [], "buy_items": [], "sell_items": [], "consent_result": [], "last_tool_used": []}
+    if not tool_calls or not isinstance(tool_calls, list):
+        return trade
+
+    for tool_call in tool_calls:
+        if hasattr(tool_call, "arguments"):
+            try:
+                args = json.loads(tool_call.arguments)
+
+                # Trade intent parser
+                if tool_call.name == "parse_trade_intent":
+                    trade_state = args["trade_state"]
+                    item = args["item"]
+                    quantity = args["quantity"]
+                    result = parse_trade_intent(trade_state, item, quantity)
+                    trade["results"].append(result)
+                    trade["last_tool_used"] = "parse_trade_intent"
+
+                    if result["trade_state"] == "buy":
+                        trade["buy_items"].append(result)
+                    elif result["trade_state"] == "sell":
+                        trade["sell_items"].append(result)
+
+                    # Debugging
+                    print(f"\033[94mResults: {trade['results']}\033[0m")
+                    print(f"\033[94mBuy Items: {trade['buy_items']}\033[0m")
+                    print(f"\033[94mSell Items: {trade['sell_items']}\033[0m")
+
+                # Trade consent handler
+                elif tool_call.name == "trade_consent":
+                    consent = args["consent"]
+                    trade["consent_result"] = trade_consent(consent)
+                    trade["last_tool_used"] = "trade_consent"
+                    print(f"Consent Result: {trade['consent_result']}") # Debugging
+
+                else:
+                    print(f"Unknown Tool: {tool_call.name}")
+
+            except Exception as e:
+                print(f"Error processing tool arguments: {e}")
+        else:
+            print("Tool call without arguments field detected!")
+
+    # All lines of the turn are stored together as the open basket
+    if trade["results"]:
+        store_trade_results(trade["results"], conversation_id=conversation_id)
+        propose_trade(conversation_id)
+    return trade
+
+
+def resolve_trade_consent(consent_result, conversation_id):
+    """
+    Executes or cancels the pending trade of a conversation according to the player's consent.
+    :param consent_result: (dict) Output of `trade_consent()`.
+    :param conversation_id: Conversation (player session) the pending trade belongs to.
+    :return: (str | None) NPC text for the outcome, or None for an unknown consent value.
+    """
+    player_consent = consent_result["Consent"]
+    print(f"\033[93mDebugg PlayerConsent: {player_consent}\033[0m") # Debugging
+
+    if player_consent == "yes":
+        results = load_last_trade_results(1, conversation_id=conversation_id)
+        print(f"\033[92mResultsHandling: {results}\033[0m")
+        # All items of the deal change hands together, or none do
+        with span("execute_trade"):
+            outcome = execute_basket(results)
+        npc_text_yes = outcome["message"]
+        close_pending_trade("executed" if outcome["ok"] else "failed", conversation_id=conversation_id)
+        add_memory(text=npc_text_yes, role="assistant", conversation_id=conversation_id)
+        confirm_trade(conversation_id)
+        print(f"TTS INPUT: {npc_text_yes}")
+        return npc_text_yes
+
+    elif player_consent == "no":
+        npc_text_no = "Understood. The trade has been cancelled."
+        close_pending_trade("cancelled", conversation_id=conversation_id)
+        add_memory(text=npc_text_no, role="assistant", conversation_id=conversation_id)
+        cancel_trade(conversation_id)
+        return npc_text_no
+
+    elif player_consent == "unsure":
+        npc_text_unsure = "I'm not sure if you're ready to trade. Let me know when you are!"
+        close_pending_trade("cancelled", conversation_id=conversation_id)
+        add_memory(text=npc_text_unsure, role="assistant", conversation_id=conversation_id)
+        cancel_trade(conversation_id)
+        return npc_text_unsure
+
+    return None
+
+
+def stream_response(**request_args):
+    """
+    Calls the Responses API in streaming mode and yields text deltas as they arrive.
+    Function calls are collected from the stream and are part of the final response.
+    :param request_args: Arguments for `client.responses.create()`.
+    :return: Generator of text deltas; returns the completed response object.
+    """
+    response = None
+    for event in client.responses.create(stream=True, **request_args):
+        if event.type == "response.output_text.delta":
+            yield event.delta
+        elif event.type == "response.completed":
+            response = event.response
+        elif event.type in ("response.failed", "error"):
+            raise RuntimeError(f"Streaming response failed: {event}")
+    if response is None:
+        raise RuntimeError("Streaming response ended without completion")
+    return response
 
 
 #--------------------------------------------------------------------------------------
@@ -269,63 +836,179 @@ def npc_chat(player_message):
 # (Hardcoded for now, will be updated later to handle multiple NPC)
 #--------------------------------------------------------------------------------------
 
-def npc_voice_chat(npc_response):
+def npc_voice_chat(npc_response, output_mp3=None, unreal_copy=True):
     """
-    Generates a gravelly pirate-style voice from NPC text, saves raw output,
-    cleans it with ffmpeg, and stores final MP3 in specified location.
+    Generates a gravelly pirate-style voice from NPC text, cleans it with ffmpeg while
+    it is still being synthesized, and stores the final MP3 in the specified locations.
+    Runs on the audio job worker pool (see audio_jobs.py), not on the request thread.
     :param npc_response: The NPC's response text to be spoken.
+    :param output_mp3: (Path, optional) Target of the cleaned speech. Defaults to 'speech.mp3' in local directory.
+    :param unreal_copy: (bool, optional) Also write the Unreal Engine sound file. Defaults to True.
     side effects:
-        - Saves raw speech output as 'speech.mp3' in local directory.
-        - Converts and saves cleaned MP3 to 'C:/UnrealSounds/speech.mp3'.
+        - Writes cleaned speech to output_mp3 incrementally, so it can be streamed while encoding.
+        - Saves a copy to UNREAL_SOUND_PATH (default 'C:/UnrealSounds/speech.mp3') if its folder exists.
+        - Serves repeated lines from the audio cache, skipping both TTS and ffmpeg.
         - Prints file save confirmations.
     """
-    raw_mp3 = Path(__file__).parent / "speech.mp3"
-    final_mp3 = Path("C:/UnrealSounds/speech.mp3")
-    text_to_speech = npc_response
+    output_mp3 = Path(output_mp3) if output_mp3 else Path(__file__).parent / "speech.mp3"
+    final_mp3 = UNREAL_SOUND_PATH
+    unreal_enabled = unreal_copy and final_mp3.parent.is_dir()
+
+    cache_key = audio_cache_key(
+        npc_response,
+        model=TTS_MODEL,
+        voice=TTS_VOICE,
+        instructions=TTS_INSTRUCTIONS,
+        encode=FFMPEG_ENCODE_ARGS,
+    )
+    cached_mp3 = get_cached_audio(cache_key)
+    if cached_mp3:
+        shutil.copyfile(cached_mp3, output_mp3)
+        print(f"NPC voice served from audio cache ({cache_key[:12]})")
+        if unreal_enabled:
+            publish_unreal_audio(cached_mp3)
+        return
+
+    with open(output_mp3, "wb") as out:
+        unreal_out = open_unreal_partial() if unreal_enabled else None
+        try:
+            for chunk in stream_npc_voice(npc_response):
+                out.write(chunk)
+                out.flush()
+                if unreal_out:
+                    unreal_out.write(chunk)
+        except BaseException:
+            if unreal_out:
+                unreal_out.close()
+                Path(unreal_out.name).unlink(missing_ok=True)
+            raise
+        finally:
+            if unreal_out:
+                unreal_out.close()
+    print(f"NPC voice saved to {output_mp3}")
+    store_cached_audio(cache_key, output_mp3)
+
+    # Swap in the finished file so Unreal never reads a half-written MP3
+    if unreal_enabled:
+        os.replace(unreal_out.name, final_mp3)
+        print(f"Cleaned NPC voice saved to {final_mp3}")
+
+
+def npc_voice_segment(npc_text, output_mp3):
+    """
+    Synthesizes one sentence chunk of a reply for a chunked audio job.
+    The Unreal sound file is written once for the whole reply (see `publish_unreal_audio()`).
+    :param npc_text: Chunk of the NPC's response text.
+    :param output_mp3: (Path) Target of the cleaned speech segment.
+    """
+    npc_voice_chat(npc_text, output_mp3, unreal_copy=False)
 
-    with client.audio.speech.with_streaming_response.create(
-        model="gpt-4o-mini-tts",
-        voice="ash",
-        input=text_to_speech,
-        response_format="mp3",
-        instructions=(
-                "Speak like a grumpy old pirate with a gravelly, raspy voice, "
-                "lots of growls and exaggerated pirate slang. Sound rough, sarcastic, "
-                "and like you've been chewing salt and shouting over stormy seas for 40 years."
-        ),
-    ) as response:
-        response.stream_to_file(raw_mp3)
-    print(f"NPC voice saved to {raw_mp3}")
 
-    convert_mp3_to_clean_mp3(raw_mp3, final_mp3)
+def publish_unreal_audio(mp3_path):
+    """
+    Copies a finished reply to UNREAL_SOUND_PATH if its folder exists.
+    :param mp3_path: (Path) Complete MP3 of the reply.
+    side effects:
+        - Swaps in the file atomically so Unreal never reads a half-written MP3.
+    """
+    final_mp3 = UNREAL_SOUND_PATH
+    if not final_mp3.parent.is_dir():
+        return
+    with open_unreal_partial() as partial:
+        try:
+            with open(mp3_path, "rb") as source:
+                shutil.copyfileobj(source, partial)
+        except BaseException:
+            partial.close()
+            Path(partial.name).unlink(missing_ok=True)
+            raise
+    os.replace(partial.name, final_mp3)
     print(f"Cleaned NPC voice saved to {final_mp3}")
 
+
+def open_unreal_partial():
     """
-    return send_file(
-        speech_file_path,
-        mimetype="audio/mpeg",
-        as_attachment=False,
-        download_name="npc_voice.mp3"
-    )"""
+    Creates a partial file next to UNREAL_SOUND_PATH, unique per job, so concurrent audio jobs
+    never write into or swap in each other's half-written MP3.
+    :return: Binary file object opened for writing; `.name` is its path (for `os.replace()`).
+    """
+    return tempfile.NamedTemporaryFile(dir=UNREAL_SOUND_PATH.parent, prefix=UNREAL_SOUND_PATH.name + ".",
+                                       suffix=".part", delete=False)
+
 
-def convert_mp3_to_clean_mp3(raw_path: Path, clean_path: Path):
+def stream_npc_voice(npc_response):
+    """
+    Streams the NPC's speech as cleaned MP3 bytes. TTS chunks are piped into ffmpeg
+    as they arrive, so encoding overlaps with synthesis and no intermediate file is written.
+    :param npc_response: The NPC's response text to be spoken.
+    :return: Generator of encoded MP3 byte chunks.
     """
-    Converts a raw MP3 audio file to a cleaner version using ffmpeg,
+    with span("tts_stream"), client.audio.speech.with_streaming_response.create(
+        model=TTS_MODEL,
+        voice=TTS_VOICE,
+        input=npc_response,
+        response_format="mp3",
+        instructions=TTS_INSTRUCTIONS,
+    ) as response:
+        yield from stream_clean_mp3(response.iter_bytes(chunk_size=AUDIO_CHUNK_SIZE))
+
+
+def stream_clean_mp3(mp3_chunks):
+    """
+    Re-encodes an MP3 byte stream with ffmpeg through stdin/stdout pipes,
     optimizing bitrate and audio quality for consistent playback.
-    :param raw_path: Path to the unprocessed MP3 file.
-    :param clean_path: Path to save the cleaned MP3 file.
+    :param mp3_chunks: Iterable of raw MP3 byte chunks (e.g. the TTS response stream).
+    :return: Generator of encoded MP3 byte chunks, produced while input is still arriving.
     side effects:
-        - Runs ffmpeg subprocess to re-encode the audio file.
-    """
-    subprocess.run([
-        "ffmpeg", "-y",
-        "-i", str(raw_path),
-        "-acodec", "libmp3lame",
-        "-b:a", "192k",
-        "-ar", "44100",
-        "-ac", "2",
-        str(clean_path)
-    ])
+        - Runs an ffmpeg subprocess and a feeder thread writing to its stdin.
+    Raises:
+        - RuntimeError if ffmpeg exits with an error; errors from the input stream are re-raised.
+    """
+    with span("ffmpeg"):
+        process = subprocess.Popen([
+            "ffmpeg", "-loglevel", "error",
+            "-f", "mp3", "-i", "pipe:0",
+            *FFMPEG_ENCODE_ARGS,
+            "-f", "mp3", "pipe:1"
+        ], stdin=subprocess.PIPE, stdout=subprocess.PIPE)
+        feed_errors = []
+
+        def feed():
+            try:
+                for chunk in mp3_chunks:
+                    process.stdin.write(chunk)
+            except BrokenPipeError:
+                pass  # ffmpeg exited early, reported through its return code
+            except Exception as e:
+                feed_errors.append(e)
+            finally:
+                try:
+                    process.stdin.close()
+                except BrokenPipeError:
+                    pass
+
+        feeder = threading.Thread(target=feed, name="ffmpeg-feed", daemon=True)
+        feeder.start()
+        finished = False
+        try:
+            while True:
+                data = process.stdout.read1(AUDIO_CHUNK_SIZE)
+                if not data:
+                    break
+                yield data
+            finished = True
+        finally:
+            # Consumer stopped early or reading failed: don't leave ffmpeg and the feeder blocked
+            if not finished:
+                process.kill()
+            process.stdout.close()
+            feeder.join()
+            returncode = process.wait()
+
+    if feed_errors:
+        raise feed_errors[0]
+    if returncode != 0:
+        raise RuntimeError(f"ffmpeg exited with code {returncode}")
 
 
 #--------------------------------------------------------------------------------------
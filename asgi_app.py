@@ -0,0 +1,334 @@
+#--------------------------------------------------------------------------------------
+# asgi_app.py – Async (ASGI) server mode: chat turns on AsyncOpenAI, no thread per request
+#--------------------------------------------------------------------------------------
+#
+# Run with:
+#   uvicorn asgi_app:app --port 5000
+#
+# POST /npc/chat and POST /npc/chat/stream are served natively on the event loop: while a
+# turn waits for the model, it holds no thread, so one process can keep many player
+# conversations in flight. The short SQLite steps of a turn run on the default thread pool,
+# the independent prompt reads (instructions, history, inventory) concurrently.
+# GET /api/inventory/events is served natively too, so idle event streams hold no thread.
+# All other routes are passed on to the Flask app unchanged.
+
+import asyncio
+import json
+import time
+from urllib.parse import parse_qs
+from providers import create_client
+from uvicorn.middleware.wsgi import WSGIMiddleware
+from app import (
+    app as flask_app, npc_turn, npc_reply, finish_streamed_audio, sse_event, validate_conversation_id,
+    parse_entity_ids, npc_voice_segment, publish_unreal_audio, AUDIO_CHUNKED, TRACE_REQUEST_HEADER,
+)
+from inventory_events import subscribe, KEEPALIVE_SECONDS
+from inventory_store import get_inventory_version
+from audio_jobs import submit_chunked_audio_job, feed_audio_job
+from metrics import span, observe, start_trace, end_trace, server_timing
+from memory_writer import drain as drain_memory_writes
+from trade_state import write_snapshot as write_trade_states
+
+
+#--------------------------------------------------------------------------------------
+# Configuration
+#--------------------------------------------------------------------------------------
+
+aclient = create_client(async_client=True)
+
+MAX_BODY_BYTES = 64 * 1024  # chat requests are a short form; anything larger is rejected
+CORS_HEADER = (b"access-control-allow-origin", b"*")  # same as flask_cors defaults on the Flask routes
+
+_flask = WSGIMiddleware(flask_app)
+
+
+#--------------------------------------------------------------------------------------
+# ASGI entry point
+#--------------------------------------------------------------------------------------
+
+async def app(scope, receive, send):
+    """
+    ASGI application: native async chat endpoints, everything else via the Flask app.
+    """
+    if scope["type"] == "lifespan":
+        await lifespan(receive, send)
+        return
+    if scope["type"] != "http":
+        return
+
+    if scope["method"] == "POST" and scope["path"] in ("/npc/chat", "/npc/chat/stream"):
+        started = time.perf_counter()
+        start_trace()
+        try:
+            if scope["path"] == "/npc/chat":
+                await chat(scope, receive, send)
+            else:
+                await chat_stream(scope, receive, send)
+        finally:
+            end_trace()
+            observe("npc_request_duration_seconds", scope["path"], time.perf_counter() - started)
+    elif scope["method"] == "GET" and scope["path"] == "/api/inventory/events":
+        await inventory_events(scope, receive, send)
+    else:
+        await _flask(scope, receive, send)
+
+
+async def lifespan(receive, send):
+    while True:
+        message = await receive()
+        if message["type"] == "lifespan.startup":
+            await send({"type": "lifespan.startup.complete"})
+        elif message["type"] == "lifespan.shutdown":
+            await asyncio.to_thread(drain_memory_writes)  # queued chat_history rows
+            await asyncio.to_thread(write_trade_states)   # trade states changed since the last snapshot
+            await send({"type": "lifespan.shutdown.complete"})
+            return
+
+
+#--------------------------------------------------------------------------------------
+# Chat endpoints (same input and output as the Flask routes in app.py)
+#--------------------------------------------------------------------------------------
+
+async def chat(scope, receive, send):
+    """
+    Async variant of POST /npc/chat.
+    """
+    request = await read_chat_request(scope, receive, send)
+    if request is None:
+        return
+    player_message, conversation_id = request
+    print(f"PlayerMessage (async): {player_message}") # Debugging log
+
+    npc_response = await drive_turn_async(npc_turn(player_message, conversation_id))
+    with flask_app.test_request_context(base_url=base_url(scope)):
+        body = npc_reply(npc_response, conversation_id)
+
+    headers = []
+    trace = end_trace()
+    if trace and TRACE_REQUEST_HEADER.lower().encode() in dict(scope["headers"]):
+        trace_id, spans = trace
+        headers = [(b"x-npc-trace-id", trace_id.encode()), (b"server-timing", server_timing(spans).encode())]
+    await send_json(send, 200, body, headers)
+
+
+async def chat_stream(scope, receive, send):
+    """
+    Async variant of POST /npc/chat/stream (Server-Sent Events 'delta', 'done' and 'error').
+    """
+    request = await read_chat_request(scope, receive, send)
+    if request is None:
+        return
+    player_message, conversation_id = request
+    print(f"PlayerMessage (async stream): {player_message}") # Debugging log
+
+    await send({
+        "type": "http.response.start",
+        "status": 200,
+        "headers": [
+            (b"content-type", b"text/event-stream; charset=utf-8"),
+            (b"cache-control", b"no-cache"),
+            (b"x-accel-buffering", b"no"),
+            CORS_HEADER,
+        ],
+    })
+
+    async def send_event(event, data):
+        await send({"type": "http.response.body", "body": sse_event(event, data).encode("utf-8"), "more_body": True})
+
+    job_id = submit_chunked_audio_job(npc_voice_segment, on_complete=publish_unreal_audio) if AUDIO_CHUNKED else None
+    spoken = []
+
+    async def on_text(delta):
+        if not delta:
+            return
+        if job_id:
+            feed_audio_job(job_id, delta)
+            spoken.append(delta)
+        await send_event("delta", {"text": delta})
+
+    npc_response = None
+    try:
+        try:
+            npc_response = await drive_turn_async(npc_turn(player_message, conversation_id), on_text)
+        finally:
+            job_id = finish_streamed_audio(job_id, spoken, npc_response)
+        with flask_app.test_request_context(base_url=base_url(scope)):
+            body = npc_reply(npc_response, conversation_id, job_id)
+        await send_event("done", body)
+    except Exception as e:
+        print(f"Error while streaming NPC reply: {e}")
+        await send_event("error", {"error": "The NPC could not answer."})
+    finally:
+        await send({"type": "http.response.body", "body": b"", "more_body": False})
+
+
+async def inventory_events(scope, receive, send):
+    """
+    Async variant of GET /api/inventory/events: a long-lived stream that holds no thread while idle.
+    """
+    query = parse_qs(scope.get("query_string", b"").decode("latin-1"))
+    ids = parse_entity_ids(query.get("ids", [""])[0])
+    if ids is None:
+        await send_json(send, 400, {"error": "ids must be a comma separated list of entity ids"})
+        return
+
+    subscription = subscribe(ids)
+    disconnected = asyncio.ensure_future(wait_for_disconnect(receive))
+    try:
+        await send({
+            "type": "http.response.start",
+            "status": 200,
+            "headers": [
+                (b"content-type", b"text/event-stream; charset=utf-8"),
+                (b"cache-control", b"no-cache"),
+                (b"x-accel-buffering", b"no"),
+                CORS_HEADER,
+            ],
+        })
+        version = await asyncio.to_thread(get_inventory_version)
+        chunk = sse_event("ready", {"version": version})
+        while not disconnected.done():
+            await send({"type": "http.response.body", "body": chunk.encode("utf-8"), "more_body": True})
+            next_event = asyncio.ensure_future(subscription.get_async(KEEPALIVE_SECONDS))
+            await asyncio.wait((next_event, disconnected), return_when=asyncio.FIRST_COMPLETED)
+            if not next_event.done():
+                next_event.cancel()
+                break
+            event = next_event.result()
+            if subscription.closed:
+                break
+            chunk = sse_event(event["type"], event) if event else ": keepalive\n\n"
+    finally:
+        subscription.close()
+        disconnected.cancel()
+
+
+async def wait_for_disconnect(receive):
+    while (await receive())["type"] != "http.disconnect":
+        pass
+
+
+#--------------------------------------------------------------------------------------
+# Async turn driver
+#--------------------------------------------------------------------------------------
+
+async def drive_turn_async(turn, on_text=None):
+    """
+    Runs the steps of `npc_turn()` (see `drive_turn()` in app.py) on the event loop.
+    Model calls are awaited on AsyncOpenAI; the turn's own code and the prompt reads run
+    on worker threads only for their (short) SQLite work.
+    :param turn: Generator returned by `npc_turn()`.
+    :param on_text: (async callable, optional) Receives text deltas; if given, model calls are streamed.
+    :return: (str) Final NPC text.
+    """
+    reply = None
+    while True:
+        finished, step = await asyncio.to_thread(_advance, turn, reply)
+        if finished:
+            return step
+        kind, payload = step
+
+        if kind == "context":
+            with span("prompt_context"):
+                results = await asyncio.gather(*(asyncio.to_thread(load) for load in payload.values()))
+            reply = dict(zip(payload.keys(), results))
+        elif kind == "model":
+            if on_text:
+                reply = await stream_response_async(on_text, **payload)
+            else:
+                reply = await aclient.responses.create(**payload)
+        elif kind == "text":
+            reply = None
+            if on_text:
+                await on_text(payload)
+
+
+def _advance(turn, reply):
+    """
+    Resumes the turn with the result of its last step. StopIteration cannot cross an
+    asyncio future, so the end of the turn is returned as (True, final_text).
+    """
+    try:
+        return False, turn.send(reply)
+    except StopIteration as finished:
+        return True, finished.value
+
+
+async def stream_response_async(on_text, **request_args):
+    """
+    Async counterpart of `stream_response()` in app.py.
+    :param on_text: (async callable) Receives each text delta.
+    :param request_args: Arguments for `aclient.responses.create()`.
+    :return: The completed response object.
+    """
+    response = None
+    async for event in await aclient.responses.create(stream=True, **request_args):
+        if event.type == "response.output_text.delta":
+            await on_text(event.delta)
+        elif event.type == "response.completed":
+            response = event.response
+        elif event.type in ("response.failed", "error"):
+            raise RuntimeError(f"Streaming response failed: {event}")
+    if response is None:
+        raise RuntimeError("Streaming response ended without completion")
+    return response
+
+
+#--------------------------------------------------------------------------------------
+# Request / response helpers
+#--------------------------------------------------------------------------------------
+
+async def read_chat_request(scope, receive, send):
+    """
+    Reads 'userprompt' and 'conversation_id' like the Flask routes do (form field, query
+    parameter or 'X-Conversation-Id' header) and answers 400/413 for invalid requests.
+    :return: (tuple | None) (player_message, conversation_id), or None if an error was sent.
+    """
+    body = b""
+    more_body = True
+    while more_body:
+        message = await receive()
+        body += message.get("body", b"")
+        more_body = message.get("more_body", False)
+        if len(body) > MAX_BODY_BYTES:
+            await send_json(send, 413, {"error": "Request too large."})
+            return None
+
+    headers = {name.decode("latin-1").lower(): value.decode("latin-1") for name, value in scope["headers"]}
+    form = {}
+    if headers.get("content-type", "").startswith("application/x-www-form-urlencoded"):
+        form = parse_qs(body.decode("utf-8", "replace"))
+    query = parse_qs(scope.get("query_string", b"").decode("latin-1"))
+
+    conversation_id = validate_conversation_id(
+        form.get("conversation_id", [None])[0]
+        or query.get("conversation_id", [None])[0]
+        or headers.get("x-conversation-id")
+    )
+    player_message = form.get("userprompt", [""])[0]
+    if conversation_id is None:
+        await send_json(send, 400, {"error": "Invalid conversation_id."})
+        return None
+    if not player_message:
+        await send_json(send, 400, {"error": "Please provide a message"})
+        return None
+    return player_message, conversation_id
+
+
+async def send_json(send, status, data, headers=()):
+    body = json.dumps(data).encode("utf-8")
+    await send({
+        "type": "http.response.start",
+        "status": status,
+        "headers": [(b"content-type", b"application/json"), (b"content-length", str(len(body)).encode()), CORS_HEADER, *headers],
+    })
+    await send({"type": "http.response.body", "body": body})
+
+
+def base_url(scope):
+    """
+    Rebuilds the external base URL of the request, for the absolute audio URLs in replies.
+    """
+    headers = dict(scope["headers"])
+    host = headers.get(b"host", b"localhost").decode("latin-1")
+    return f"{scope.get('scheme', 'http')}://{host}{scope.get('root_path', '')}"
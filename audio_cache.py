@@ -0,0 +1,124 @@
+#--------------------------------------------------------------------------------------
+# audio_cache.py – Content-addressed disk cache for synthesized NPC speech
+#--------------------------------------------------------------------------------------
+
+import hashlib
+import json
+import os
+import shutil
+import threading
+from collections import OrderedDict
+from pathlib import Path
+
+
+#--------------------------------------------------------------------------------------
+# Configuration
+#--------------------------------------------------------------------------------------
+
+AUDIO_CACHE_DIR = Path(__file__).parent / "audio_cache"
+AUDIO_CACHE_MAX_BYTES = int(os.getenv("NPC_AUDIO_CACHE_MB", "200")) * 1024 * 1024
+
+_index = None  # OrderedDict key -> file size, least recently used first
+_stats = {"hits": 0, "misses": 0, "stores": 0, "evictions": 0}
+_lock = threading.Lock()
+
+
+#--------------------------------------------------------------------------------------
+# Cache keys and lookups
+#--------------------------------------------------------------------------------------
+
+def audio_cache_key(text, **settings):
+    """
+    Builds the cache key for a spoken line: a hash over the text and every setting
+    that changes the resulting audio (model, voice, instructions, encoder arguments).
+    :param text: (str) Text to be spoken.
+    :param settings: Synthesis and encoding settings; values must be JSON-serializable.
+    :return: (str) Hex digest used as the cache file name.
+    """
+    payload = json.dumps({"text": text, "settings": settings}, sort_keys=True, ensure_ascii=False)
+    return hashlib.sha256(payload.encode("utf-8")).hexdigest()
+
+
+def get_cached_audio(key):
+    """
+    Looks up a cached MP3 and marks it as recently used.
+    :param key: (str) Key from `audio_cache_key()`.
+    :return: (Path | None) Path of the cached file, or None on a miss.
+    """
+    with _lock:
+        index = _load_index()
+        path = _cache_path(key)
+        if key in index and path.exists():
+            index.move_to_end(key)
+            _stats["hits"] += 1
+            os.utime(path)  # keeps LRU order across restarts
+            return path
+
+        index.pop(key, None)
+        _stats["misses"] += 1
+        return None
+
+
+def store_cached_audio(key, source_path):
+    """
+    Copies a finished MP3 into the cache and evicts least recently used files above the size limit.
+    :param key: (str) Key from `audio_cache_key()`.
+    :param source_path: (Path) Completely written MP3 file.
+    :return: None
+    """
+    path = _cache_path(key)
+    partial_path = path.with_name(path.name + ".part")
+    AUDIO_CACHE_DIR.mkdir(exist_ok=True)
+    shutil.copyfile(source_path, partial_path)
+    os.replace(partial_path, path)
+
+    with _lock:
+        index = _load_index()
+        index[key] = path.stat().st_size
+        index.move_to_end(key)
+        _stats["stores"] += 1
+        _evict(index)
+
+
+def audio_cache_stats():
+    """
+    Returns hit/miss counters and the current size of the audio cache.
+    :return: (dict) Counters plus 'entries', 'bytes' and 'max_bytes'.
+    """
+    with _lock:
+        index = _load_index()
+        return {**_stats, "entries": len(index), "bytes": sum(index.values()), "max_bytes": AUDIO_CACHE_MAX_BYTES}
+
+
+#--------------------------------------------------------------------------------------
+# Internal helpers (callers hold _lock)
+#--------------------------------------------------------------------------------------
+
+def _cache_path(key):
+    return AUDIO_CACHE_DIR / f"{key}.mp3"
+
+
+def _load_index():
+    """
+    Builds the LRU index from the cache folder on first use, oldest files first.
+    """
+    global _index
+    if _index is None:
+        files = sorted(AUDIO_CACHE_DIR.glob("*.mp3"), key=lambda p: p.stat().st_mtime) if AUDIO_CACHE_DIR.exists() else []
+        _index = OrderedDict((p.stem, p.stat().st_size) for p in files)
+    return _index
+
+
+def _evict(index):
+    """
+    Deletes least recently used entries until the cache fits into AUDIO_CACHE_MAX_BYTES.
+    """
+    total = sum(index.values())
+    while total > AUDIO_CACHE_MAX_BYTES and len(index) > 1:
+        key, size = index.popitem(last=False)
+        total -= size
+        _stats["evictions"] += 1
+        try:
+            _cache_path(key).unlink(missing_ok=True)
+        except OSError as e:
+            print(f"Could not delete cached audio {key}: {e}")
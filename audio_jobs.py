@@ -0,0 +1,375 @@
+#--------------------------------------------------------------------------------------
+# audio_jobs.py – Background speech synthesis so chat text can be returned immediately
+#--------------------------------------------------------------------------------------
+
+import json
+import os
+import queue
+import re
+import threading
+import time
+import uuid
+from concurrent.futures import ThreadPoolExecutor
+from pathlib import Path
+from speech_chunker import SentenceChunker
+
+
+#--------------------------------------------------------------------------------------
+# Configuration
+#--------------------------------------------------------------------------------------
+
+AUDIO_DIR = Path(__file__).parent / "audio"
+AUDIO_WORKERS = int(os.getenv("NPC_AUDIO_WORKERS", "4"))
+AUDIO_SEGMENT_WORKERS = int(os.getenv("NPC_AUDIO_SEGMENT_WORKERS", "8"))
+AUDIO_FEED_TIMEOUT = 120  # seconds a chunked job waits for more text before giving up
+MAX_FINISHED_JOBS = 200  # finished jobs (and their files) kept for playback
+
+_executor = ThreadPoolExecutor(max_workers=AUDIO_WORKERS, thread_name_prefix="tts")
+_segment_executor = ThreadPoolExecutor(max_workers=AUDIO_SEGMENT_WORKERS, thread_name_prefix="tts-segment")
+JOB_ID_PATTERN = re.compile(r"^[0-9a-f]{32}$")
+
+_jobs = {}  # job_id -> job dict, in submission order
+_jobs_lock = threading.Lock()
+
+
+#--------------------------------------------------------------------------------------
+# Submit and query audio jobs
+#--------------------------------------------------------------------------------------
+
+def submit_audio_job(text, synthesize):
+    """
+    Queues speech synthesis for an NPC reply on the worker pool and returns at once.
+    :param text: (str) NPC response text to be spoken.
+    :param synthesize: (callable) Function `synthesize(text, output_path)` that writes the final MP3.
+    :return: (str) Job id used to poll status and fetch the audio file.
+    """
+    job = _create_job()
+    _executor.submit(_run_job, job, text, synthesize)
+    return job["id"]
+
+
+def _create_job():
+    """
+    Registers a new pending job and creates its (empty) audio file.
+    """
+    AUDIO_DIR.mkdir(exist_ok=True)
+    job_id = uuid.uuid4().hex
+    job = {
+        "id": job_id,
+        "status": "pending",
+        "path": AUDIO_DIR / f"{job_id}.mp3",
+        "error": None,
+        "created": time.time(),
+        "finished": None,
+        "done": threading.Event(),
+        "segments": [],
+    }
+    with _jobs_lock:
+        _jobs[job_id] = job
+    job["path"].touch()  # visible to other server processes right away
+    _prune_finished_jobs()
+    return job
+
+
+def _run_job(job, text, synthesize):
+    """
+    Worker body: runs the synthesizer and records the outcome on the job.
+    """
+    job["status"] = "running"
+    try:
+        synthesize(text, job["path"])
+        job["status"] = "ready"
+    except Exception as e:
+        job["status"] = "failed"
+        job["error"] = str(e)
+        print(f"Audio job {job['id']} failed: {e}")
+    finally:
+        job["finished"] = time.time()
+        _write_status_file(job)
+        job["done"].set()
+
+
+#--------------------------------------------------------------------------------------
+# Chunked audio jobs – each sentence is synthesized as soon as it is complete
+#--------------------------------------------------------------------------------------
+
+def submit_chunked_audio_job(synthesize, text=None, on_complete=None):
+    """
+    Starts a job that speaks the reply sentence by sentence. Chunks are synthesized in parallel
+    on the segment pool and appended to the job file in order, so playback can start after
+    the first sentence instead of after the whole reply.
+    :param synthesize: (callable) Function `synthesize(text, output_path)` that writes one MP3 segment.
+    :param text: (str, optional) Complete reply. If omitted, feed text with `feed_audio_job()`
+                 and finish with `close_audio_job()`.
+    :param on_complete: (callable, optional) Called with the path of the concatenated MP3 once all segments are written.
+    :return: (str) Job id used to poll status and fetch the audio file or its segments.
+    """
+    job = _create_job()
+    job["chunker"] = SentenceChunker()
+    job["pending"] = queue.Queue()
+    job["synthesize"] = synthesize
+    job["segment_count"] = 0
+    job["segment_paths"] = []  # every segment file queued, also skipped ones, for pruning
+    job["feed_lock"] = threading.Lock()
+    _executor.submit(_run_chunked_job, job, on_complete)
+
+    if text is not None:
+        feed_audio_job(job["id"], text)
+        close_audio_job(job["id"])
+    return job["id"]
+
+
+def feed_audio_job(job_id, delta):
+    """
+    Adds streamed reply text to a chunked job; completed sentences start synthesizing right away.
+    :param job_id: (str) Id returned by `submit_chunked_audio_job()`.
+    :param delta: (str) Next piece of the reply text.
+    :return: None
+    """
+    job = _get_chunked_job(job_id)
+    if job is None:
+        return
+    with job["feed_lock"]:
+        for chunk in job["chunker"].feed(delta):
+            _queue_segment(job, chunk)
+
+
+def close_audio_job(job_id):
+    """
+    Marks the reply text of a chunked job as complete and queues the remaining text.
+    :param job_id: (str) Id returned by `submit_chunked_audio_job()`.
+    :return: None
+    """
+    job = _get_chunked_job(job_id)
+    if job is None:
+        return
+    with job["feed_lock"]:
+        if job.get("closed"):
+            return
+        for chunk in job["chunker"].flush():
+            _queue_segment(job, chunk)
+        job["closed"] = True
+        job["pending"].put(None)
+
+
+def cancel_audio_job(job_id):
+    """
+    Drops a chunked job whose text turned out not to be the final reply: segments that are
+    not written yet are skipped and their files deleted, and `on_complete` is not called.
+    :param job_id: (str) Id returned by `submit_chunked_audio_job()`.
+    :return: None
+    Notes:
+        - Does nothing if the job is unknown or was already pruned.
+    """
+    job = _get_chunked_job(job_id)
+    if job is None:
+        return
+    job["cancelled"] = True
+    close_audio_job(job_id)
+
+
+def _get_chunked_job(job_id):
+    with _jobs_lock:
+        return _jobs.get(job_id)
+
+
+def _queue_segment(job, text):
+    """
+    Starts synthesis of one chunk and queues it for ordered writing.
+    """
+    if job["done"].is_set():
+        return  # the worker failed and no longer writes segments
+    index = job["segment_count"]
+    job["segment_count"] += 1
+    path = AUDIO_DIR / f"{job['id']}_{index}.mp3"
+    job["segment_paths"].append(path)
+    future = _segment_executor.submit(job["synthesize"], text, path)
+    job["pending"].put((index, text, path, future))
+
+
+def _discard_segment(future, path):
+    """
+    Cancels a segment that will not be written to the job file and deletes its file,
+    once its synthesis has finished if it is already running.
+    """
+    future.cancel()
+    future.add_done_callback(lambda _: path.unlink(missing_ok=True))
+
+
+def _run_chunked_job(job, on_complete):
+    """
+    Worker body: appends finished segments to the job file in reading order.
+    """
+    job["status"] = "running"
+    try:
+        with open(job["path"], "ab") as out:
+            while True:
+                try:
+                    item = job["pending"].get(timeout=AUDIO_FEED_TIMEOUT)
+                except queue.Empty:
+                    raise TimeoutError("No more text was fed to the audio job")
+                if item is None:
+                    break
+                index, text, path, future = item
+                if job.get("cancelled"):
+                    _discard_segment(future, path)
+                    continue
+                future.result()
+                out.write(path.read_bytes())
+                out.flush()
+                job["segments"].append({"index": index, "text": text, "path": path})
+        if job.get("cancelled"):
+            job["status"] = "cancelled"
+            return
+        if on_complete:
+            on_complete(job["path"])
+        job["status"] = "ready"
+    except Exception as e:
+        job["status"] = "failed"
+        job["error"] = str(e)
+        print(f"Audio job {job['id']} failed: {e}")
+        _discard_pending_segments(job)
+    finally:
+        job["finished"] = time.time()
+        _write_status_file(job)
+        job["done"].set()
+
+
+def _discard_pending_segments(job):
+    """
+    Discards the segments still queued for a failed job.
+    """
+    while True:
+        try:
+            item = job["pending"].get_nowait()
+        except queue.Empty:
+            return
+        if item is not None:
+            _discard_segment(item[3], item[2])
+
+
+def _status_path(job_id):
+    return AUDIO_DIR / f"{job_id}.json"
+
+
+def _write_status_file(job):
+    """
+    Records the outcome next to the audio file, so other server processes can answer for this job.
+    """
+    try:
+        with open(_status_path(job["id"]), "w") as f:
+            json.dump({"status": job["status"], "error": job["error"]}, f)
+    except OSError as e:
+        print(f"Could not write status of audio job {job['id']}: {e}")
+
+
+def _load_foreign_job(job_id):
+    """
+    Rebuilds a job submitted by another server process from the files in AUDIO_DIR.
+    :return: (dict | None) Job dict, or None if no such job exists.
+    """
+    if not JOB_ID_PATTERN.match(job_id):
+        return None
+    path = AUDIO_DIR / f"{job_id}.mp3"
+    status_path = _status_path(job_id)
+    if not path.exists():
+        return None
+
+    job = {"id": job_id, "status": "running", "path": path, "error": None,
+           "created": None, "finished": None, "done": threading.Event()}
+    try:
+        with open(status_path) as f:
+            job.update(json.load(f))
+        job["done"].set()
+    except (OSError, ValueError):
+        pass  # still being written by the other process
+    return job
+
+
+def get_audio_job(job_id, wait=0):
+    """
+    Looks up an audio job, optionally blocking until it has finished.
+    :param job_id: (str) Id returned by `submit_audio_job()`.
+    :param wait: (float, optional) Seconds to wait for completion. Defaults to 0 (no waiting).
+    :return: (dict | None) Job dict, or None if the id is unknown or was pruned.
+    Notes:
+        - Jobs submitted by other server processes are found through their files in AUDIO_DIR.
+    """
+    with _jobs_lock:
+        job = _jobs.get(job_id)
+    if job is None:
+        return _wait_for_foreign_job(job_id, wait)
+    if wait > 0:
+        job["done"].wait(timeout=wait)
+    return job
+
+
+def _wait_for_foreign_job(job_id, wait, poll_interval=0.1):
+    """
+    Polls the files of a job owned by another process until it has finished or `wait` ran out.
+    """
+    deadline = time.time() + wait
+    job = _load_foreign_job(job_id)
+    while job is not None and not job["done"].is_set() and time.time() < deadline:
+        time.sleep(poll_interval)
+        job = _load_foreign_job(job_id)
+    return job
+
+
+def audio_job_status(job):
+    """
+    Returns the JSON-serializable public view of a job.
+    :param job: (dict) Job dict from `get_audio_job()`.
+    :return: (dict) Job id, status ('pending', 'running', 'ready', 'failed' or 'cancelled'), number of
+            segments written so far and error, if any.
+    """
+    status = {"job_id": job["id"], "status": job["status"], "segments": len(job.get("segments", []))}
+    if job["error"]:
+        status["error"] = job["error"]
+    return status
+
+
+def iter_audio_job(job, chunk_size=16384, poll_interval=0.05):
+    """
+    Yields the job's MP3 bytes while the synthesizer is still writing them,
+    so playback can start before encoding has finished.
+    :param job: (dict) Job dict from `get_audio_job()`.
+    :param chunk_size: (int, optional) Maximum bytes per yielded chunk.
+    :param poll_interval: (float, optional) Seconds to wait for more data before checking again.
+    :return: Generator of MP3 byte chunks; ends when the job has finished.
+    """
+    while not job["path"].exists():
+        if job["done"].wait(timeout=poll_interval) and not job["path"].exists():
+            return
+
+    with open(job["path"], "rb") as f:
+        while True:
+            # Check before reading, so data written right before completion is not lost
+            finished = job["done"].is_set()
+            data = f.read(chunk_size)
+            if data:
+                yield data
+            elif finished:
+                return
+            else:
+                job["done"].wait(timeout=poll_interval)
+
+
+def _prune_finished_jobs():
+    """
+    Drops the oldest finished jobs and deletes their files once MAX_FINISHED_JOBS is exceeded.
+    """
+    with _jobs_lock:
+        finished = [job for job in _jobs.values() if job["done"].is_set()]
+        expired = finished[:max(len(finished) - MAX_FINISHED_JOBS, 0)]
+        for job in expired:
+            del _jobs[job["id"]]
+
+    for job in expired:
+        try:
+            job["path"].unlink(missing_ok=True)
+            _status_path(job["id"]).unlink(missing_ok=True)
+            for path in job.get("segment_paths", []):
+                path.unlink(missing_ok=True)
+        except OSError as e:
+            print(f"Could not delete audio file {job['path']}: {e}")
@@ -0,0 +1,144 @@
+#--------------------------------------------------------------------------------------
+# bench_async.py – Concurrent conversations per process: threaded (Flask) vs. async (ASGI) turns
+#--------------------------------------------------------------------------------------
+#
+# Usage (from the project root):
+#   python benchmarks/bench_async.py [--latency-ms 300] [--threads 32]
+#   NPC_RESPONSE_CACHE=1 python benchmarks/bench_async.py    # cache hits instead of model calls
+#
+# Runs chat turns in-process against a temporary copy of the database. The model is replaced
+# by a fake that answers after a fixed latency, so the numbers show how each mode copes with
+# waiting on the network, not how fast OpenAI is. Speech synthesis is not part of the turn.
+# 'threads' is the worker pool of the threaded mode, like the thread count of a WSGI server.
+# All conversations start together; a turn's latency runs from when it was issued (start of
+# the run, or the end of the conversation's previous turn), so waiting for a free thread counts.
+# Every turn asks the same question, so the response cache (response_cache.py) is turned off
+# unless NPC_RESPONSE_CACHE is set: otherwise almost every turn would be a cache hit.
+
+import argparse
+import asyncio
+import io
+import os
+import shutil
+import sys
+import tempfile
+import time
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import redirect_stdout
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+os.environ.setdefault("OPENAI_API_KEY", "offline-benchmark")
+os.environ.setdefault("NPC_RESPONSE_CACHE", "0")  # measure model calls, not cache hits
+
+import app
+import asgi_app
+import memory_writer
+import trade_state
+from db import close_connections
+
+CONVERSATIONS = (8, 32, 128, 512)
+TURNS_PER_CONVERSATION = 3
+
+
+class FakeResponse:
+    output_text = "Arr, that be a fine question, matey."
+    output = []
+
+
+def fake_models(latency):
+    """
+    Replaces the blocking and the async client with fakes that answer after `latency` seconds.
+    """
+    def create(**request_args):
+        time.sleep(latency)
+        return FakeResponse()
+
+    async def create_async(**request_args):
+        await asyncio.sleep(latency)
+        return FakeResponse()
+
+    app.client.responses.create = create
+    asgi_app.aclient.responses.create = create_async
+
+
+def run_threaded(conversations, threads):
+    issued = time.perf_counter()
+
+    def conversation(index):
+        samples = []
+        start = issued
+        for _ in range(TURNS_PER_CONVERSATION):
+            app.npc_chat("What do ye sell?", f"bench-{index}")
+            end = time.perf_counter()
+            samples.append(end - start)
+            start = end
+        return samples
+
+    with ThreadPoolExecutor(max_workers=threads) as pool:
+        return [s for samples in pool.map(conversation, range(conversations)) for s in samples]
+
+
+def run_async(conversations):
+    async def conversation(index, issued):
+        samples = []
+        start = issued
+        for _ in range(TURNS_PER_CONVERSATION):
+            await asgi_app.drive_turn_async(app.npc_turn("What do ye sell?", f"bench-{index}"))
+            end = time.perf_counter()
+            samples.append(end - start)
+            start = end
+        return samples
+
+    async def main():
+        issued = time.perf_counter()
+        results = await asyncio.gather(*(conversation(i, issued) for i in range(conversations)))
+        return [s for samples in results for s in samples]
+
+    return asyncio.run(main())
+
+
+def report(label, conversations, samples, elapsed, budget):
+    samples = sorted(samples)
+    p50 = samples[len(samples) // 2] * 1000
+    p95 = samples[int(len(samples) * 0.95)] * 1000
+    ok = "yes" if p95 <= budget * 1000 else "no"
+    print(f"{label:<10}{conversations:>8}{len(samples) / elapsed:>12.1f}{p50:>10.0f}{p95:>10.0f}{ok:>8}")
+    return p95 <= budget * 1000
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Concurrent conversations per process: threaded vs. async turns")
+    parser.add_argument("--latency-ms", type=float, default=300, help="Fake model latency per call")
+    parser.add_argument("--threads", type=int, default=32, help="Worker threads of the threaded mode")
+    args = parser.parse_args()
+    latency = args.latency_ms / 1000
+    threads = args.threads
+    budget = latency * 2  # a turn "keeps up" while p95 stays within twice the model latency
+
+    with tempfile.TemporaryDirectory() as tmp:
+        os.makedirs(os.path.join(tmp, "inventory"))
+        shutil.copyfile(os.path.join(ROOT, "inventory", "inventory.sqlite3"), os.path.join(tmp, "inventory", "inventory.sqlite3"))
+        os.chdir(tmp)  # DB_PATH is relative, so all turns write to the copy
+        fake_models(latency)
+
+        cache = "on" if os.environ["NPC_RESPONSE_CACHE"] != "0" else "off"
+        print(f"model latency {latency * 1000:.0f} ms, {threads} threads, response cache {cache}, budget p95 <= {budget * 1000:.0f} ms")
+        print(f"{'mode':<10}{'convs':>8}{'turns/s':>12}{'p50 ms':>10}{'p95 ms':>10}{'keeps':>8}")
+        sustained = {"threaded": 0, "async": 0}
+        for conversations in CONVERSATIONS:
+            for label in ("threaded", "async"):
+                start = time.perf_counter()
+                with redirect_stdout(io.StringIO()):  # turns print debug lines
+                    if label == "threaded":
+                        samples = run_threaded(conversations, threads)
+                    else:
+                        samples = run_async(conversations)
+                if report(label, conversations, samples, time.perf_counter() - start, budget):
+                    sustained[label] = conversations
+
+        print(f"sustained concurrent conversations: threaded {sustained['threaded']}, async {sustained['async']}")
+
+        memory_writer.flush(timeout=30)  # queued chat rows, before the temporary files go away
+        trade_state.write_snapshot()
+        close_connections()
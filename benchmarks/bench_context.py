@@ -0,0 +1,116 @@
+#--------------------------------------------------------------------------------------
+# bench_context.py – Prompt history size and build time: indent=2 JSON dump vs. compact context
+#--------------------------------------------------------------------------------------
+#
+# Usage (from the project root):
+#   python benchmarks/bench_context.py [messages]
+#
+# Fills a conversation in a temporary copy of inventory/inventory.sqlite3 with a long,
+# synthetic player/NPC dialogue, then compares the history blocks the prompts used to embed
+# (format_chat_history_as_json with 50 and 6 messages) with build_chat_context at the budgets
+# of prompt_generator.py. Tokens are estimated at 4 characters per token.
+
+import io
+import json
+import os
+import random
+import shutil
+import statistics
+import sys
+import tempfile
+import time
+from contextlib import redirect_stdout
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+os.environ.setdefault("OPENAI_API_KEY", "offline-benchmark")
+os.environ.setdefault("NPC_SUMMARIES", "0")  # no background summary calls while measuring
+os.environ.setdefault("NPC_LLM_PROVIDER", "fake")
+
+import memory_store
+import memory_writer
+from chat_context import build_chat_context, estimate_tokens
+from db import close_connections
+from prompt_generator import PROMPT_HISTORY_TOKENS, CONSENT_HISTORY_TOKENS
+
+SOURCE_DB = "inventory/inventory.sqlite3"
+CONVERSATION_ID = "bench-context"
+RUNS = 200
+
+PLAYER_LINES = (
+    "Ahoy, what do ye sell today?",
+    "I want to buy {n} apples and maybe a rope if the price is right.",
+    "That's too expensive, I only have a few coins left after the storm last night.",
+    "Tell me about the island to the north, I heard rumours of a sunken galleon full of gold.",
+    "yes",
+    "Fine, I'll sell you {n} fish from my morning catch.",
+)
+NPC_LINES = (
+    "Arr, welcome aboard, matey. Me wares be fine and me prices fair. What can I do for ye?",
+    "Ye want {n} apples? That'll cost ye a pretty penny, but they be the crispest this side of Tortuga.",
+    "The north island? Only fools and dead men sail there, and I've been both in me time, heh.",
+    "Are ye sure about that trade, matey? Let's make a deal!",
+)
+
+
+def fill_conversation(db_path, messages):
+    """
+    Writes alternating player/NPC messages into a conversation.
+    """
+    rng = random.Random(42)
+    with redirect_stdout(io.StringIO()):  # add_memory prints debug lines
+        for i in range(messages):
+            lines, role = (PLAYER_LINES, "user") if i % 2 == 0 else (NPC_LINES, "assistant")
+            text = rng.choice(lines).format(n=rng.randint(1, 9))
+            memory_store.add_memory(text, role, conversation_id=CONVERSATION_ID, db_path=db_path)
+    memory_writer.flush()
+
+
+def json_history(limit, db_path):
+    """
+    History block as the prompts built it before: format_chat_history_as_json(limit).
+    """
+    chat_messages = memory_store.get_recent_chat_messages(limit, CONVERSATION_ID, db_path=db_path)
+    chat_data = [
+        {"role": "system", "content": "You are a helpful assistant. Here's a summary of the recent conversation."},
+        *chat_messages
+    ]
+    return json.dumps(chat_data, indent=2)
+
+
+def count_messages(block):
+    return len(json.loads(block)) - 1 if block.startswith("[") else block.count("\n") + 1
+
+
+def measure(build):
+    samples = []
+    for _ in range(RUNS):
+        start = time.perf_counter()
+        block = build()
+        samples.append((time.perf_counter() - start) * 1000)
+    samples.sort()
+    return block, statistics.mean(samples), samples[int(len(samples) * 0.95)]
+
+
+if __name__ == "__main__":
+    messages = int(sys.argv[1]) if len(sys.argv) > 1 else 400
+
+    with tempfile.TemporaryDirectory() as tmp:
+        db_path = os.path.join(tmp, "inventory.sqlite3")
+        shutil.copyfile(SOURCE_DB, db_path)
+        fill_conversation(db_path, messages)
+
+        variants = (
+            ("main prompt, JSON (50 messages)", lambda: json_history(50, db_path)),
+            (f"main prompt, compact ({PROMPT_HISTORY_TOKENS} tokens)",
+             lambda: build_chat_context(CONVERSATION_ID, PROMPT_HISTORY_TOKENS, db_path=db_path)),
+            ("consent prompt, JSON (6 messages)", lambda: json_history(6, db_path)),
+            (f"consent prompt, compact ({CONSENT_HISTORY_TOKENS} tokens)",
+             lambda: build_chat_context(CONVERSATION_ID, CONSENT_HISTORY_TOKENS, db_path=db_path)),
+        )
+
+        print(f"{messages} messages in the conversation, {RUNS} builds per variant")
+        print(f"{'variant':<38}{'messages':>10}{'tokens':>8}{'mean ms':>10}{'p95 ms':>9}")
+        for name, build in variants:
+            block, mean, p95 = measure(build)
+            print(f"{name:<38}{count_messages(block):>10}{estimate_tokens(block):>8}{mean:>10.3f}{p95:>9.3f}")
+        close_connections()
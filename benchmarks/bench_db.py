@@ -0,0 +1,137 @@
+#--------------------------------------------------------------------------------------
+# bench_db.py – Per-turn SQLite overhead: connect-per-call vs. shared WAL connection
+#--------------------------------------------------------------------------------------
+#
+# Usage (from the project root):
+#   python benchmarks/bench_db.py [turns]
+#
+# Both variants run against temporary copies of inventory/inventory.sqlite3,
+# so the shipped database is never modified.
+
+import io
+import os
+import shutil
+import sqlite3
+import statistics
+import sys
+import tempfile
+import time
+from contextlib import redirect_stdout
+from datetime import datetime
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+os.environ.setdefault("OPENAI_API_KEY", "offline-benchmark")
+os.environ.setdefault("NPC_SUMMARIES", "0")  # no background summary calls while measuring
+
+import inventory_store
+import memory_store
+import memory_writer
+import trade_state
+from db import close_connections
+
+SOURCE_DB = "inventory/inventory.sqlite3"
+
+
+def prepare_copy(directory, name):
+    """
+    Copies the inventory database and adds the status_flag table the chat loop expects.
+    :param directory: (str) Target directory.
+    :param name: (str) File name of the copy.
+    :return: (str) Path to the copied database.
+    """
+    path = os.path.join(directory, name)
+    shutil.copyfile(SOURCE_DB, path)
+    conn = sqlite3.connect(path)
+    conn.execute("CREATE TABLE IF NOT EXISTS status_flag (id INTEGER PRIMARY KEY, is_active INTEGER)")
+    conn.execute("INSERT OR IGNORE INTO status_flag (id, is_active) VALUES (1, 0)")
+    conn.commit()
+    conn.close()
+    return path
+
+
+#--------------------------------------------------------------------------------------
+# Baseline: one connection and one commit per helper call (previous behaviour)
+#--------------------------------------------------------------------------------------
+
+def legacy(db_path, sql, params=(), write=False):
+    conn = sqlite3.connect(db_path)
+    cursor = conn.cursor()
+    cursor.execute(sql, params)
+    rows = None if write else cursor.fetchall()
+    if write:
+        conn.commit()
+    conn.close()
+    return rows
+
+
+def legacy_turn(db_path):
+    now = str(datetime.now())
+    inventory_sql = """
+        SELECT i.name, inv.quantity, IFNULL(p.price, 0)
+        FROM inventory inv
+        JOIN entities e ON inv.entity_id = e.id
+        JOIN items i ON inv.item_id = i.id
+        LEFT JOIN prices p ON p.item_id = i.id
+        WHERE e.id = ?"""
+    history_sql = """
+        SELECT role, text FROM (
+            SELECT role, text, timestamp FROM chat_history
+            WHERE role IN ('user', 'assistant') AND TRIM(text) <> ''
+            ORDER BY timestamp DESC LIMIT ?
+        ) AS sub ORDER BY timestamp ASC"""
+
+    legacy(db_path, "INSERT INTO chat_history (timestamp, role, text) VALUES (?, ?, ?)", (now, "user", "I want 2 apples"), True)
+    legacy(db_path, "SELECT is_active FROM status_flag WHERE id = 1")
+    legacy(db_path, "SELECT name FROM entities WHERE id = ?", (1,))
+    legacy(db_path, "SELECT role FROM entities WHERE id = ?", (1,))
+    legacy(db_path, history_sql, (50,))
+    legacy(db_path, inventory_sql, (1,))
+    legacy(db_path, "INSERT INTO chat_history (timestamp, role, text) VALUES (?, ?, ?)", (now, "assistant", "Aye"), True)
+    legacy(db_path, "UPDATE status_flag SET is_active = 1 WHERE id = 1", (), True)
+    legacy(db_path, "INSERT INTO chat_history (timestamp, entity_id, role, text) VALUES (?, ?, ?, ?)",
+           (now, 1, "system", '[{"trade_state": "buy", "item": "apple", "quantity": 1}]'), True)
+    legacy(db_path, history_sql, (6,))
+    legacy(db_path, inventory_sql, (2,))
+
+
+def shared_turn(db_path):
+    memory_store.add_memory("I want 2 apples", "user", db_path=db_path)
+    memory_store.get_status_flag(db_path=db_path)
+    inventory_store.get_entity_name(1, db_path=db_path)
+    inventory_store.get_entity_role(1, db_path=db_path)
+    memory_store.get_recent_chat_messages(50, db_path=db_path)
+    inventory_store.get_all_items(1, db_path=db_path)
+    memory_store.add_memory("Aye", "assistant", db_path=db_path)
+    memory_store.set_status_flag_true(db_path=db_path)
+    memory_store.store_trade_results([{"trade_state": "buy", "item": "apple", "quantity": 1}], db_path=db_path)
+    memory_store.get_recent_chat_messages(6, db_path=db_path)
+    inventory_store.get_all_items(2, db_path=db_path)
+
+
+def measure(turn, db_path, turns):
+    samples = []
+    for _ in range(turns):
+        start = time.perf_counter()
+        with redirect_stdout(io.StringIO()):  # helpers print debug lines
+            turn(db_path)
+        samples.append((time.perf_counter() - start) * 1000)
+    samples.sort()
+    return statistics.mean(samples), samples[len(samples) // 2], samples[int(len(samples) * 0.95)]
+
+
+if __name__ == "__main__":
+    turns = int(sys.argv[1]) if len(sys.argv) > 1 else 200
+    with tempfile.TemporaryDirectory() as tmp:
+        legacy_db = prepare_copy(tmp, "legacy.sqlite3")
+        shared_db = prepare_copy(tmp, "shared.sqlite3")
+
+        print(f"{'variant':<28}{'mean ms':>10}{'p50 ms':>10}{'p95 ms':>10}")
+        for label, turn, path in (
+            ("connect-per-call (DELETE)", legacy_turn, legacy_db),
+            ("shared connection (WAL)", shared_turn, shared_db),
+        ):
+            mean, p50, p95 = measure(turn, path, turns)
+            print(f"{label:<28}{mean:>10.3f}{p50:>10.3f}{p95:>10.3f}")
+        memory_writer.flush(timeout=30)  # queued chat rows, before the temporary files go away
+        trade_state.write_snapshot()
+        close_connections()
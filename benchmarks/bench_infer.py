@@ -0,0 +1,85 @@
+#--------------------------------------------------------------------------------------
+# bench_infer.py – infer_trade_items: one regex per item and call vs. the compiled item matcher
+#--------------------------------------------------------------------------------------
+#
+# Usage (from the project root):
+#   python benchmarks/bench_infer.py [catalog sizes ...]
+#
+# Adds generated items ("rusty iron anchor", ...) to temporary copies of
+# inventory/inventory.sqlite3 and measures how long one player message takes to scan.
+# The per-item variant is the previous implementation (with its regex escaping fixed).
+
+import os
+import re
+import shutil
+import statistics
+import sys
+import tempfile
+import time
+from itertools import product
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+os.environ.setdefault("OPENAI_API_KEY", "offline-benchmark")
+
+from db import close_connections, transaction
+from inventory_store import bump_inventory_version, bump_catalog_version
+from prompt_generator import get_item_matcher, infer_trade_items
+
+SOURCE_DB = "inventory/inventory.sqlite3"
+ADJECTIVES = ("rusty", "golden", "salty", "cursed", "tiny", "heavy", "silver", "old", "fine", "black")
+MATERIALS = ("iron", "oak", "brass", "silk", "bone", "copper", "glass", "leather", "coral", "tin")
+NOUNS = ("anchor", "compass", "lantern", "sabre", "barrel", "chest", "hook", "map", "flag", "rope",
+         "bell", "cup", "knife", "ring", "coin", "boot", "hat", "belt", "spoon", "key")
+MESSAGES = ("I want to buy 3 apples and two rusty iron anchors", "Do ye have a golden silk flag?",
+            "give me half a dozen bananas", "I'll sell all my old tin spoons", "Just looking around, matey")
+RUNS = 20
+
+
+def per_item_regex(inventory, message):
+    inferred = {}
+    line = message.lower()
+    for item in inventory:
+        match = re.search(rf"(\d+)\s+{re.escape(item)}", line)
+        if match:
+            inferred[item] = min(int(match.group(1)), inventory[item])
+    if not inferred:
+        for item in inventory:
+            if item in line and inventory[item] > 0:
+                inferred[item] = inventory[item]
+    return inferred
+
+
+def timed(run):
+    samples = []
+    for _ in range(RUNS):
+        for message in MESSAGES:
+            start = time.perf_counter()
+            run(message)
+            samples.append((time.perf_counter() - start) * 1000)
+    samples.sort()
+    return statistics.mean(samples), samples[int(len(samples) * 0.95)]
+
+
+if __name__ == "__main__":
+    sizes = [int(arg) for arg in sys.argv[1:]] or [100, 1000, 2000]
+    names = [" ".join(words) for words in product(ADJECTIVES, MATERIALS, NOUNS)]
+
+    print(f"{'items':>6}  {'variant':<20}{'mean ms':>10}{'p95 ms':>10}")
+    with tempfile.TemporaryDirectory() as tmp:
+        for size in sizes:
+            db_path = os.path.join(tmp, f"{size}.sqlite3")
+            shutil.copyfile(SOURCE_DB, db_path)
+            with transaction(db_path) as conn:
+                conn.executemany("INSERT INTO items (name) VALUES (?)", [(name,) for name in names[:size]])
+                bump_inventory_version(conn)
+                bump_catalog_version(conn)
+            inventory = {name: 10 for name in ["apple", "banana", "bottle of rum", *names[:size]]}
+
+            start = time.perf_counter()
+            get_item_matcher(db_path)
+            print(f"{size:>6}  {'build matcher':<20}{(time.perf_counter() - start) * 1000:>10.1f}")
+            for variant, run in (("per-item regex", lambda m: per_item_regex(inventory, m)),
+                                 ("compiled matcher", lambda m: infer_trade_items(inventory, m, db_path=db_path))):
+                mean, p95 = timed(run)
+                print(f"{size:>6}  {variant:<20}{mean:>10.3f}{p95:>10.3f}")
+        close_connections()
@@ -0,0 +1,98 @@
+#--------------------------------------------------------------------------------------
+# bench_memory.py – Semantic memory index: build rate, query latency, approximate vs. exact search
+#--------------------------------------------------------------------------------------
+#
+# Usage (from the project root):
+#   python benchmarks/bench_memory.py [messages]
+#
+# Writes synthetic messages of many conversations into a temporary copy of
+# inventory/inventory.sqlite3, indexes them with vector_memory.py and measures:
+#   - a per-conversation recall query (what build_prompt does every turn)
+#   - a query over all NPC replies, exact and with the approximate (inverted-file) index,
+#     plus the share of exact top-3 results the approximate search also finds
+
+import os
+import random
+import shutil
+import statistics
+import sys
+import tempfile
+import time
+from datetime import datetime
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+os.environ.setdefault("OPENAI_API_KEY", "offline-benchmark")
+os.environ.setdefault("NPC_SUMMARIES", "0")
+
+import vector_memory
+from db import close_connections, transaction
+
+SOURCE_DB = "inventory/inventory.sqlite3"
+CONVERSATIONS = 2000
+QUERIES = 200
+
+SUBJECTS = ("rope", "compass", "sail", "barrel of rum", "lantern", "map", "parrot", "cannon", "anchor",
+            "apples", "fish", "spyglass", "treasure chest", "hammock", "bandana", "musket", "oar", "net")
+PLAYER_TEMPLATES = ("Do you have a {s} for me?", "I want to buy {n} {s}", "How much is the {s}?",
+                    "I lost my {s} near the reef", "Tell me a story about a {s}", "Will you sell me your {s}?")
+NPC_TEMPLATES = ("Aye, a fine {s} for {n} gold.", "That {s} be the best on the seven seas.",
+                 "No {s} left, matey, come back tomorrow.", "A {s}? Ye drive a hard bargain.")
+
+
+def fill_history(db_path, messages):
+    rng = random.Random(7)
+    rows = []
+    for i in range(messages):
+        templates, role = (PLAYER_TEMPLATES, "user") if i % 2 == 0 else (NPC_TEMPLATES, "assistant")
+        text = rng.choice(templates).format(s=rng.choice(SUBJECTS), n=rng.randint(1, 20))
+        rows.append((str(datetime.now()), f"bench-{rng.randrange(CONVERSATIONS)}", role, text))
+    with transaction(db_path) as conn:
+        conn.executemany("INSERT INTO chat_history (timestamp, conversation_id, role, text) VALUES (?, ?, ?, ?)", rows)
+
+
+def timed(queries, search):
+    samples, results = [], []
+    for query in queries:
+        start = time.perf_counter()
+        results.append(search(query))
+        samples.append((time.perf_counter() - start) * 1000)
+    samples.sort()
+    return results, statistics.mean(samples), samples[int(len(samples) * 0.95)]
+
+
+if __name__ == "__main__":
+    messages = int(sys.argv[1]) if len(sys.argv) > 1 else 100000
+    rng = random.Random(11)
+    queries = [f"{rng.choice(('where is my', 'I need a', 'price of the'))} {rng.choice(SUBJECTS)}" for _ in range(QUERIES)]
+
+    with tempfile.TemporaryDirectory() as tmp:
+        db_path = os.path.join(tmp, "inventory.sqlite3")
+        shutil.copyfile(SOURCE_DB, db_path)
+        fill_history(db_path, messages)
+
+        vector_memory.ANN_MIN_ROWS = float("inf")  # exact index first
+        index = vector_memory.VectorIndex(db_path)
+        start = time.perf_counter()
+        added = index.sync()
+        build = time.perf_counter() - start
+        print(f"indexed {added} messages in {build:.1f} s ({added / build:.0f}/s), "
+              f"{os.path.getsize(index.vector_path) / 2**20:.0f} MB of vectors")
+
+        print(f"{'query':<40}{'mean ms':>10}{'p95 ms':>9}")
+        _, mean, p95 = timed(queries, lambda q: index.search(q, 3, role="user", conversation_id="bench-1", skip_recent=6))
+        print(f"{'one conversation (prompt recall)':<40}{mean:>10.3f}{p95:>9.3f}")
+        exact, mean, p95 = timed(queries, lambda q: index.search(q, 3, role="assistant"))
+        print(f"{'all NPC replies, exact':<40}{mean:>10.3f}{p95:>9.3f}")
+
+        vector_memory.ANN_MIN_ROWS = 1000
+        start = time.perf_counter()
+        index._train_ann()
+        # The server trains in a background thread and searches exactly until the lists are swapped in
+        print(f"approximate index trained in {time.perf_counter() - start:.1f} s ({len(index.ann[0])} lists, off the request path)")
+        approx, mean, p95 = timed(queries, lambda q: index.search(q, 3, role="assistant"))
+        print(f"{'all NPC replies, approximate':<40}{mean:>10.3f}{p95:>9.3f}")
+
+        # Synthetic texts repeat, so compare scores: a result is found if its score reaches the exact one
+        found = sum(sum(1 for (_, a), (_, e) in zip(ar, er) if a >= e - 1e-6) for ar, er in zip(approx, exact))
+        print(f"approximate recall@3: {found / sum(len(r) for r in exact):.1%}")
+        close_connections()
@@ -0,0 +1,63 @@
+#--------------------------------------------------------------------------------------
+# bench_trades.py – Multi-item trades: one execute_trade per line vs. one execute_basket
+#--------------------------------------------------------------------------------------
+#
+# Usage (from the project root):
+#   python benchmarks/bench_trades.py [lines per trade] [trades]
+#
+# Each trade sells and buys back apples, bananas and rum, so the stock stays the same and
+# every line succeeds. Both variants run on temporary copies of inventory/inventory.sqlite3.
+
+import os
+import shutil
+import statistics
+import sys
+import tempfile
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+os.environ.setdefault("OPENAI_API_KEY", "offline-benchmark")
+
+from inventory_store import execute_trade, execute_basket
+from db import close_connections
+
+SOURCE_DB = "inventory/inventory.sqlite3"
+ITEMS = ("apple", "banana", "bottle of rum")
+
+
+def basket(size):
+    lines = []
+    for i in range(size):
+        trade_state = "sell" if i % 2 == 0 else "buy"
+        lines.append({"trade_state": trade_state, "item": ITEMS[i // 2 % len(ITEMS)], "quantity": 1})
+    return lines
+
+
+def per_line(lines, db_path):
+    for line in lines:
+        execute_trade(line["trade_state"], line["item"], line["quantity"], db_path=db_path)
+
+
+def whole_basket(lines, db_path):
+    assert execute_basket(lines, db_path=db_path)["ok"]
+
+
+if __name__ == "__main__":
+    size = int(sys.argv[1]) if len(sys.argv) > 1 else 6
+    trades = int(sys.argv[2]) if len(sys.argv) > 2 else 500
+    lines = basket(size)
+
+    print(f"{trades} trades x {size} lines")
+    print(f"{'variant':<28}{'mean ms':>10}{'p95 ms':>10}")
+    with tempfile.TemporaryDirectory() as tmp:
+        for name, run in (("execute_trade per line", per_line), ("execute_basket", whole_basket)):
+            db_path = os.path.join(tmp, f"{run.__name__}.sqlite3")
+            shutil.copyfile(SOURCE_DB, db_path)
+            samples = []
+            for _ in range(trades):
+                start = time.perf_counter()
+                run(lines, db_path)
+                samples.append((time.perf_counter() - start) * 1000)
+            samples.sort()
+            print(f"{name:<28}{statistics.mean(samples):>10.3f}{samples[int(len(samples) * 0.95)]:>10.3f}")
+        close_connections()
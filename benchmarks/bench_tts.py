@@ -0,0 +1,67 @@
+#--------------------------------------------------------------------------------------
+# bench_tts.py – Time-to-first-audio: whole-reply vs. sentence-chunked speech synthesis
+#--------------------------------------------------------------------------------------
+#
+# Usage (from the project root, needs OPENAI_API_KEY and ffmpeg):
+#   python benchmarks/bench_tts.py [rounds]
+#
+# Calls the real TTS endpoint. The audio cache is bypassed so every round synthesizes.
+
+import io
+import os
+import statistics
+import sys
+import time
+from contextlib import redirect_stdout
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import app
+from audio_jobs import submit_audio_job, submit_chunked_audio_job, get_audio_job, iter_audio_job
+
+REPLY = (
+    "Arr, ye've come to the right place, matey! "
+    "I've got rope strong enough to hold a kraken, and rum that'll put hair on yer chest. "
+    "The apples be fresh from the last port, though the parrot took a bite or two. "
+    "Name yer price and let's see if we can strike a deal before the tide turns."
+)
+
+
+def whole_job():
+    return submit_audio_job(REPLY, app.npc_voice_chat)
+
+
+def chunked_job():
+    return submit_chunked_audio_job(app.npc_voice_segment, text=REPLY)
+
+
+def measure(submit, rounds):
+    """
+    Runs one job per round and records when its first MP3 bytes and its last byte were available.
+    :return: (tuple) Lists of time-to-first-audio and total times in ms.
+    """
+    first, total = [], []
+    for _ in range(rounds):
+        start = time.perf_counter()
+        with redirect_stdout(io.StringIO()):  # synthesizer prints save confirmations
+            job = get_audio_job(submit())
+            chunks = iter_audio_job(job)
+            next(chunks, None)
+            first.append((time.perf_counter() - start) * 1000)
+            for _ in chunks:
+                pass
+        total.append((time.perf_counter() - start) * 1000)
+        if job["status"] != "ready":
+            raise RuntimeError(f"Audio job failed: {job['error']}")
+    return first, total
+
+
+if __name__ == "__main__":
+    rounds = int(sys.argv[1]) if len(sys.argv) > 1 else 5
+    app.get_cached_audio = lambda key: None
+    app.UNREAL_SOUND_PATH = app.Path(os.devnull) / "speech.mp3"  # never publish to Unreal
+
+    print(f"{'variant':<22}{'first audio ms':>16}{'total ms':>12}")
+    for label, submit in (("whole reply", whole_job), ("sentence chunks", chunked_job)):
+        first, total = measure(submit, rounds)
+        print(f"{label:<22}{statistics.median(first):>16.0f}{statistics.median(total):>12.0f}")
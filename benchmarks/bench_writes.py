@@ -0,0 +1,79 @@
+#--------------------------------------------------------------------------------------
+# bench_writes.py – chat_history writes under concurrent players: commit per message vs. write-behind
+#--------------------------------------------------------------------------------------
+#
+# Usage (from the project root):
+#   python benchmarks/bench_writes.py [players] [messages per player]
+#
+# Every player thread calls add_memory in a loop, like the chat turns do. Both variants
+# write to temporary copies of inventory/inventory.sqlite3; the write-behind run includes
+# the final flush, so both numbers count committed rows.
+
+import io
+import os
+import shutil
+import statistics
+import sys
+import tempfile
+import threading
+import time
+from contextlib import redirect_stdout
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+os.environ.setdefault("OPENAI_API_KEY", "offline-benchmark")
+os.environ.setdefault("NPC_SUMMARIES", "0")
+os.environ.setdefault("NPC_SEMANTIC_MEMORY", "0")
+
+import memory_store
+import memory_writer
+from db import get_connection
+
+SOURCE_DB = "inventory/inventory.sqlite3"
+
+
+def run(db_path, players, messages):
+    """
+    :return: (tuple) Committed rows per second, p50 and p95 add_memory latency in ms.
+    """
+    latencies, lock = [], threading.Lock()
+
+    def player(index):
+        samples = []
+        for i in range(messages):
+            start = time.perf_counter()
+            memory_store.add_memory(f"message {i}", "user" if i % 2 == 0 else "assistant",
+                                    conversation_id=f"bench-{index}", db_path=db_path)
+            samples.append((time.perf_counter() - start) * 1000)
+        with lock:
+            latencies.extend(samples)
+
+    threads = [threading.Thread(target=player, args=(i,)) for i in range(players)]
+    with redirect_stdout(io.StringIO()):  # add_memory prints a line per message
+        start = time.perf_counter()
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        memory_writer.flush(timeout=60)
+        elapsed = time.perf_counter() - start
+
+    stored = get_connection(db_path).execute(
+        "SELECT COUNT(*) FROM chat_history WHERE conversation_id LIKE 'bench-%'").fetchone()[0]
+    assert stored == players * messages, f"{stored} rows stored, expected {players * messages}"
+    latencies.sort()
+    return stored / elapsed, statistics.median(latencies), latencies[int(len(latencies) * 0.95)]
+
+
+if __name__ == "__main__":
+    players = int(sys.argv[1]) if len(sys.argv) > 1 else 32
+    messages = int(sys.argv[2]) if len(sys.argv) > 2 else 200
+
+    print(f"{players} players x {messages} messages")
+    print(f"{'variant':<28}{'rows/s':>10}{'p50 ms':>10}{'p95 ms':>10}")
+    with tempfile.TemporaryDirectory() as tmp:
+        for name, write_behind in (("commit per message", False), ("write-behind, group commit", True)):
+            db_path = os.path.join(tmp, f"{write_behind}.sqlite3")
+            shutil.copyfile(SOURCE_DB, db_path)
+            memory_writer.WRITE_BEHIND = write_behind
+            rate, p50, p95 = run(db_path, players, messages)
+            print(f"{name:<28}{rate:>10.0f}{p50:>10.3f}{p95:>10.3f}")
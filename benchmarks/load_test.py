@@ -0,0 +1,182 @@
+#--------------------------------------------------------------------------------------
+# load_test.py – End-to-end load test for /npc/chat and /api/inventory/<id>
+#--------------------------------------------------------------------------------------
+#
+# Usage (from the project root):
+#   python benchmarks/load_test.py                          # in-process Flask server, offline fake model
+#   python benchmarks/load_test.py --server asgi -c 64      # in-process uvicorn server (async mode)
+#   python benchmarks/load_test.py --url http://host:5000   # an already running server
+#   NPC_RESPONSE_CACHE=1 python benchmarks/load_test.py     # with the response cache (repeated questions hit it)
+#
+# In-process servers use NPC_LLM_PROVIDER=fake (see fake_openai.py) and a temporary copy of
+# the database, so the test needs no network and never touches inventory/inventory.sqlite3.
+# Each client is one player conversation: it greets, buys, confirms and checks inventory
+# in a loop. The exit code is 1 if the error rate or p95 exceeds the given limits (for CI).
+# Every client repeats the same script, so in-process servers run without the response cache
+# unless NPC_RESPONSE_CACHE is set; otherwise most chat turns would skip the model.
+
+import argparse
+import json
+import logging
+import os
+import shutil
+import socket
+import sys
+import tempfile
+import threading
+import time
+import urllib.error
+import urllib.parse
+import urllib.request
+from collections import defaultdict
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+# Script of one conversation: (endpoint label, chat message or None for an inventory request)
+CONVERSATION = (
+    ("chat", "Ahoy, what do ye sell?"),
+    ("chat", "I want to buy 2 apples"),
+    ("chat", "yes"),
+    ("inventory", None),
+    ("chat", "Tell me about the sea"),
+    ("inventory", None),
+)
+
+
+#--------------------------------------------------------------------------------------
+# In-process servers
+#--------------------------------------------------------------------------------------
+
+def free_port():
+    with socket.socket() as sock:
+        sock.bind(("127.0.0.1", 0))
+        return sock.getsockname()[1]
+
+
+def start_server(kind, latency_ms, workdir):
+    """
+    Starts the app on a free local port in a background thread, with the fake provider.
+    :param kind: (str) 'flask' (threaded WSGI server) or 'asgi' (uvicorn).
+    :param latency_ms: (float) Fake model latency per call.
+    :param workdir: (str) Directory holding the temporary database copy.
+    :return: (str) Base URL of the server.
+    """
+    os.environ["NPC_LLM_PROVIDER"] = "fake"
+    os.environ["NPC_FAKE_LATENCY_MS"] = str(latency_ms)
+    os.environ.setdefault("NPC_RESPONSE_CACHE", "0")  # measure model calls, not cache hits
+    os.makedirs(os.path.join(workdir, "inventory"))
+    shutil.copyfile(os.path.join(ROOT, "inventory", "inventory.sqlite3"), os.path.join(workdir, "inventory", "inventory.sqlite3"))
+    os.chdir(workdir)  # DB_PATH is relative, so the server writes to the copy
+    sys.stdout = open(os.devnull, "w")  # the server prints debug lines for every turn
+
+    port = free_port()
+    if kind == "asgi":
+        import uvicorn
+        import asgi_app
+        server = uvicorn.Server(uvicorn.Config(asgi_app.app, host="127.0.0.1", port=port, log_level="warning"))
+        threading.Thread(target=server.run, daemon=True).start()
+        while not server.started:
+            time.sleep(0.05)
+    else:
+        from werkzeug.serving import make_server
+        import app
+        logging.getLogger("werkzeug").setLevel(logging.ERROR)  # no access log line per request
+        server = make_server("127.0.0.1", port, app.app, threaded=True)
+        threading.Thread(target=server.serve_forever, daemon=True).start()
+    return f"http://127.0.0.1:{port}"
+
+
+#--------------------------------------------------------------------------------------
+# Load generation
+#--------------------------------------------------------------------------------------
+
+def run_client(base_url, index, deadline, results, lock):
+    """
+    Plays one conversation in a loop until the deadline and records (label, seconds, ok) per request.
+    """
+    conversation_id = f"load-{index}-{int(time.time())}"
+    step = 0
+    while time.time() < deadline:
+        label, message = CONVERSATION[step % len(CONVERSATION)]
+        step += 1
+        if label == "chat":
+            data = urllib.parse.urlencode({"userprompt": message, "conversation_id": conversation_id}).encode()
+            request = urllib.request.Request(f"{base_url}/npc/chat", data=data)
+        else:
+            request = urllib.request.Request(f"{base_url}/api/inventory/2")
+
+        start = time.perf_counter()
+        try:
+            with urllib.request.urlopen(request, timeout=60) as response:
+                json.loads(response.read())
+                ok = response.status == 200
+        except (urllib.error.URLError, OSError, ValueError):
+            ok = False
+        elapsed = time.perf_counter() - start
+        with lock:
+            results.append((label, elapsed, ok))
+
+
+def percentile(sorted_samples, fraction):
+    return sorted_samples[min(int(len(sorted_samples) * fraction), len(sorted_samples) - 1)]
+
+
+def report(results, duration):
+    """
+    Prints throughput and latency percentiles per endpoint.
+    :return: (tuple) Overall error rate and p95 latency in ms.
+    """
+    by_label = defaultdict(list)
+    errors = defaultdict(int)
+    for label, elapsed, ok in results:
+        by_label[label].append(elapsed)
+        by_label["all"].append(elapsed)
+        if not ok:
+            errors[label] += 1
+            errors["all"] += 1
+
+    print(f"{'endpoint':<12}{'requests':>10}{'errors':>8}{'req/s':>10}{'p50 ms':>10}{'p95 ms':>10}{'p99 ms':>10}", file=sys.__stdout__)
+    for label in ("chat", "inventory", "all"):
+        samples = sorted(by_label[label])
+        if not samples:
+            continue
+        p50, p95, p99 = (percentile(samples, f) * 1000 for f in (0.50, 0.95, 0.99))
+        print(f"{label:<12}{len(samples):>10}{errors[label]:>8}{len(samples) / duration:>10.1f}"
+              f"{p50:>10.0f}{p95:>10.0f}{p99:>10.0f}", file=sys.__stdout__)
+
+    samples = sorted(by_label["all"])
+    if not samples:
+        return 1.0, float("inf")
+    return errors["all"] / len(samples), percentile(samples, 0.95) * 1000
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Load test for /npc/chat and /api/inventory/<id>")
+    parser.add_argument("--url", help="Test a running server instead of starting one in-process")
+    parser.add_argument("--server", choices=("flask", "asgi"), default="flask", help="In-process server type")
+    parser.add_argument("-c", "--concurrency", type=int, default=16, help="Concurrent player conversations")
+    parser.add_argument("-d", "--duration", type=float, default=20, help="Seconds of load")
+    parser.add_argument("--latency-ms", type=float, default=300, help="Fake model latency (in-process only)")
+    parser.add_argument("--max-error-rate", type=float, default=0.01, help="Fail if more requests fail")
+    parser.add_argument("--max-p95-ms", type=float, default=None, help="Fail if overall p95 is higher")
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as tmp:
+        base_url = args.url or start_server(args.server, args.latency_ms, tmp)
+        target = base_url if args.url else f"{args.server} server, fake model {args.latency_ms:.0f} ms"
+        print(f"{target}: {args.concurrency} conversations for {args.duration:.0f} s", file=sys.__stdout__)
+
+        results, lock = [], threading.Lock()
+        deadline = time.time() + args.duration
+        clients = [threading.Thread(target=run_client, args=(base_url, i, deadline, results, lock))
+                   for i in range(args.concurrency)]
+        start = time.perf_counter()
+        for client in clients:
+            client.start()
+        for client in clients:
+            client.join()
+        error_rate, p95 = report(results, time.perf_counter() - start)
+
+    failed = error_rate > args.max_error_rate or (args.max_p95_ms is not None and p95 > args.max_p95_ms)
+    sys.exit(1 if failed else 0)
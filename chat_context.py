@@ -0,0 +1,134 @@
+#--------------------------------------------------------------------------------------
+# chat_context.py – Compact, token-budgeted chat history for prompts (cached per conversation)
+#--------------------------------------------------------------------------------------
+
+import threading
+from collections import OrderedDict
+from db import DB_PATH, DEFAULT_CONVERSATION_ID, get_connection
+from memory_writer import pending_rows
+
+
+#--------------------------------------------------------------------------------------
+# Configuration
+#--------------------------------------------------------------------------------------
+
+CHARS_PER_TOKEN = 4       # rough average for English text with the gpt-4o tokenizer
+MAX_TURN_TOKENS = 120     # longer messages are cut, so one monologue cannot fill the budget
+CACHED_TURNS = 200        # rendered lines kept per conversation (more than any budget uses)
+CACHED_CONVERSATIONS = 1000
+
+SPEAKERS = {"user": "Player", "assistant": "You"}
+NO_MESSAGES = "(no messages yet)"
+
+_cache = OrderedDict()  # (db_path, conversation_id) -> {"last_id", "lines", "lock"}, least recently used first
+_cache_lock = threading.Lock()
+
+
+#--------------------------------------------------------------------------------------
+# Token estimate and rendering
+#--------------------------------------------------------------------------------------
+
+def estimate_tokens(text):
+    """
+    Estimates the number of model tokens of a text without a tokenizer.
+    :param text: (str) Any text.
+    :return: (int) Approximate token count.
+    """
+    return (len(text) + CHARS_PER_TOKEN - 1) // CHARS_PER_TOKEN
+
+
+def render_turn(role, text):
+    """
+    Renders one chat message as a single compact line, e.g. 'Player: I want 2 apples'.
+    :param role: (str) 'user' or 'assistant'.
+    :param text: (str) Message text.
+    :return: (str) The line, shortened to about MAX_TURN_TOKENS.
+    """
+    text = " ".join(text.split())
+    max_chars = MAX_TURN_TOKENS * CHARS_PER_TOKEN
+    if len(text) > max_chars:
+        text = text[:max_chars].rsplit(" ", 1)[0] + " …"
+    return f"{SPEAKERS.get(role, role)}: {text}"
+
+
+#--------------------------------------------------------------------------------------
+# Build the history block of a prompt
+#--------------------------------------------------------------------------------------
+
+def build_chat_context(conversation_id=DEFAULT_CONVERSATION_ID, budget_tokens=1500, db_path=DB_PATH, after_id=0):
+    """
+    Returns the newest messages of a conversation that fit into a token budget,
+    one line per message in chronological order.
+    :param conversation_id: (str, optional) Conversation to read. Defaults to 'default'.
+    :param budget_tokens: (int, optional) Maximum estimated tokens of the block. Defaults to 1500.
+    :param db_path: (str, optional) Path to SQLite database file. Defaults to 'inventory/inventory.sqlite3'.
+    :param after_id: (int, optional) Only use messages with a higher chat_history id, e.g. those
+            not covered by a summary yet. Defaults to 0 (all messages).
+    :return: (str) History block, or NO_MESSAGES if there is nothing to show.
+    Notes:
+        - Rendered lines are cached per conversation; each call only reads messages added since
+          the last one (also those written by other server processes).
+        - Messages still queued in the memory writer are included.
+    """
+    lines = _cached_lines(conversation_id, db_path)
+
+    selected = []
+    used = 0
+    for row_id, line in reversed(lines):
+        if row_id <= after_id:
+            break
+        cost = estimate_tokens(line) + 1  # + newline
+        if used + cost > budget_tokens:
+            break
+        selected.append(line)
+        used += cost
+
+    if not selected:
+        return NO_MESSAGES
+    selected.reverse()
+    return "\n".join(selected)
+
+
+def _cached_lines(conversation_id, db_path):
+    """
+    Returns (id, rendered line) pairs of a conversation, reading only messages newer than the cached ones.
+    Queued messages follow the stored ones; those not inserted yet get id infinity.
+    """
+    pending = pending_rows(conversation_id, db_path)  # before the query, see memory_writer.py
+    key = (db_path, conversation_id)
+    with _cache_lock:
+        entry = _cache.get(key)
+        if entry is None:
+            entry = _cache[key] = {"last_id": 0, "lines": [], "lock": threading.Lock()}
+        _cache.move_to_end(key)
+        while len(_cache) > CACHED_CONVERSATIONS:
+            _cache.popitem(last=False)
+
+    with entry["lock"]:
+        cursor = get_connection(db_path).cursor()
+        if entry["last_id"] == 0:
+            # First read: only the newest messages are ever needed
+            cursor.execute("""
+                SELECT id, role, text FROM (
+                    SELECT id, role, text FROM chat_history
+                    WHERE conversation_id = ? AND role IN ('user', 'assistant') AND TRIM(text) <> ''
+                    ORDER BY id DESC LIMIT ?
+                ) ORDER BY id ASC
+            """, (conversation_id, CACHED_TURNS))
+        else:
+            cursor.execute("""
+                SELECT id, role, text FROM chat_history
+                WHERE conversation_id = ? AND id > ? AND role IN ('user', 'assistant') AND TRIM(text) <> ''
+                ORDER BY id ASC
+            """, (conversation_id, entry["last_id"]))
+
+        for row_id, role, text in cursor.fetchall():
+            entry["lines"].append((row_id, render_turn(role, text)))
+            entry["last_id"] = row_id
+        del entry["lines"][:-CACHED_TURNS]
+        lines = list(entry["lines"])
+
+    stored_ids = {row_id for row_id, _ in lines[-len(pending):]} if pending else set()
+    lines += [(row["id"] or float("inf"), render_turn(row["role"], row["text"])) for row in pending
+              if row["id"] not in stored_ids and row["role"] in ("user", "assistant") and row["text"].strip()]
+    return lines
@@ -0,0 +1,199 @@
+#--------------------------------------------------------------------------------------
+# chat_summaries.py – Background rolling summaries of long conversations (SQLite chat_summaries)
+#--------------------------------------------------------------------------------------
+#
+# Older messages of a conversation are summarized off the request path, one chunk at a time:
+#   level 0: summary of one chunk of SUMMARY_CHUNK_MESSAGES messages (first_id..last_id)
+#   level 1: rolling summary of everything up to a chunk, folded from the previous rolling
+#            summary and the new chunk summary
+# Prompts then use the latest rolling summary plus the raw messages after it, so their size
+# no longer grows with the length of the conversation.
+
+import os
+import queue
+import threading
+from datetime import datetime
+from providers import create_client
+from chat_context import NO_MESSAGES, build_chat_context, estimate_tokens, render_turn
+from db import DB_PATH, DEFAULT_CONVERSATION_ID, get_connection, transaction
+from metrics import span, record_input_tokens
+
+
+#--------------------------------------------------------------------------------------
+# Configuration
+#--------------------------------------------------------------------------------------
+
+SUMMARIES_ENABLED = os.getenv("NPC_SUMMARIES", "1") != "0"
+SUMMARY_MODEL = os.getenv("NPC_SUMMARY_MODEL", "gpt-4o")
+SUMMARY_CHUNK_MESSAGES = int(os.getenv("NPC_SUMMARY_CHUNK", "10"))
+# Newest messages that are never summarized, so prompts always see the latest turns verbatim
+RAW_MESSAGES_KEPT = int(os.getenv("NPC_SUMMARY_KEEP_RAW", "12"))
+
+CHUNK_LEVEL = 0
+ROLLING_LEVEL = 1
+
+CHUNK_INSTRUCTIONS = """
+    Summarize the following part of a conversation in a role-playing game. 'Player' is the player,
+    'You' is the merchant NPC. Keep names, items, quantities, prices, agreed trades and promises.
+    Write at most 60 words in the third person.
+""".strip()
+ROLLING_INSTRUCTIONS = """
+    Summarize the conversation between a player and a merchant NPC of a role-playing game.
+    You get the summary so far and a summary of what happened next. Merge them into one summary,
+    keeping what still matters later: names, items, quantities, prices, agreed trades and promises.
+    Write at most 120 words in the third person.
+""".strip()
+
+client = create_client()
+
+_queue = queue.Queue()  # (conversation_id, db_path) waiting for the worker
+_scheduled = set()      # entries in _queue or being worked on, so each is queued once
+_scheduled_lock = threading.Lock()
+_worker = None
+
+
+#--------------------------------------------------------------------------------------
+# Schedule summaries (called after a message is stored)
+#--------------------------------------------------------------------------------------
+
+def schedule_summaries(conversation_id=DEFAULT_CONVERSATION_ID, db_path=DB_PATH):
+    """
+    Asks the background worker to summarize the conversation's unsummarized chunks, if any.
+    Returns at once; the model calls never run on the caller's thread.
+    :param conversation_id: (str, optional) Conversation to check. Defaults to 'default'.
+    :param db_path: (str, optional) Path to SQLite database file. Defaults to 'inventory/inventory.sqlite3'.
+    :return: (bool) True if queued, False if disabled or already queued.
+    Notes:
+        - The worker is a daemon thread: summaries still missing at shutdown are made after the
+          next message of the conversation, since progress is read back from chat_summaries.
+    """
+    global _worker
+    if not SUMMARIES_ENABLED:
+        return False
+
+    key = (conversation_id, db_path)
+    with _scheduled_lock:
+        if key in _scheduled:
+            return False
+        _scheduled.add(key)
+        if _worker is None:
+            _worker = threading.Thread(target=_work, name="chat-summaries", daemon=True)
+            _worker.start()
+    _queue.put(key)
+    return True
+
+
+def _work():
+    """
+    Worker loop: summarizes one queued conversation at a time.
+    """
+    while True:
+        conversation_id, db_path = key = _queue.get()
+        with _scheduled_lock:
+            _scheduled.discard(key)  # messages stored from now on queue the conversation again
+        try:
+            summarize_pending(conversation_id, db_path)
+        except Exception as e:
+            print(f"Chat summary failed for conversation {conversation_id}: {e}")  # Debugging
+
+
+#--------------------------------------------------------------------------------------
+# Summarize unsummarized chunks
+#--------------------------------------------------------------------------------------
+
+def summarize_pending(conversation_id=DEFAULT_CONVERSATION_ID, db_path=DB_PATH):
+    """
+    Summarizes every complete chunk of messages that is not covered by the rolling summary yet
+    and older than the RAW_MESSAGES_KEPT newest messages.
+    :param conversation_id: (str, optional) Conversation to summarize. Defaults to 'default'.
+    :param db_path: (str, optional) Path to SQLite database file. Defaults to 'inventory/inventory.sqlite3'.
+    :return: (int) Number of chunks summarized.
+    side effects:
+        - Two model calls per chunk (one for the first chunk of a conversation), two rows in chat_summaries.
+    """
+    summarized = 0
+    while True:
+        rolling, first_id, covered_id = get_rolling_summary(conversation_id, db_path)
+        cursor = get_connection(db_path).cursor()
+        cursor.execute("""
+            SELECT id, role, text FROM chat_history
+            WHERE conversation_id = ? AND id > ? AND role IN ('user', 'assistant') AND TRIM(text) <> ''
+            ORDER BY id ASC LIMIT ?
+        """, (conversation_id, covered_id, SUMMARY_CHUNK_MESSAGES + RAW_MESSAGES_KEPT))
+        rows = cursor.fetchall()
+        if len(rows) < SUMMARY_CHUNK_MESSAGES + RAW_MESSAGES_KEPT:
+            return summarized
+
+        chunk = rows[:SUMMARY_CHUNK_MESSAGES]
+        chunk_first_id, chunk_last_id = chunk[0][0], chunk[-1][0]
+        chunk_summary = _summarize(CHUNK_INSTRUCTIONS, "\n".join(render_turn(role, text) for _, role, text in chunk))
+        if rolling:
+            rolling = _summarize(ROLLING_INSTRUCTIONS, f"Summary so far:\n{rolling}\n\nWhat happened next:\n{chunk_summary}")
+        else:
+            rolling, first_id = chunk_summary, chunk_first_id
+
+        created = str(datetime.now())
+        with transaction(db_path) as conn:
+            # OR IGNORE: another server process may have summarized the same chunk meanwhile
+            conn.executemany("""
+                INSERT OR IGNORE INTO chat_summaries (conversation_id, level, first_id, last_id, summary, created)
+                VALUES (?, ?, ?, ?, ?, ?)
+            """, [
+                (conversation_id, CHUNK_LEVEL, chunk_first_id, chunk_last_id, chunk_summary, created),
+                (conversation_id, ROLLING_LEVEL, first_id, chunk_last_id, rolling, created),
+            ])
+        summarized += 1
+        print(f"Chat summary: conversation {conversation_id} summarized up to message {chunk_last_id}")  # Debugging
+
+
+def _summarize(instructions, text):
+    """
+    One summarization call to the model.
+    """
+    with span("summarize"):
+        response = client.responses.create(model=SUMMARY_MODEL, instructions=instructions, input=text)
+    record_input_tokens("summarize", response)
+    summary = (response.output_text or "").strip()
+    if not summary:
+        raise RuntimeError("Empty summary from model")
+    return summary
+
+
+#--------------------------------------------------------------------------------------
+# Read summaries for prompts
+#--------------------------------------------------------------------------------------
+
+def get_rolling_summary(conversation_id=DEFAULT_CONVERSATION_ID, db_path=DB_PATH):
+    """
+    Returns the newest rolling summary of a conversation.
+    :param conversation_id: (str, optional) Conversation to read. Defaults to 'default'.
+    :param db_path: (str, optional) Path to SQLite database file. Defaults to 'inventory/inventory.sqlite3'.
+    :return: (tuple) (summary, first_id, last_id) of the covered messages, or (None, None, 0).
+    """
+    cursor = get_connection(db_path).cursor()
+    cursor.execute("""
+        SELECT summary, first_id, last_id FROM chat_summaries
+        WHERE conversation_id = ? AND level = ?
+        ORDER BY last_id DESC LIMIT 1
+    """, (conversation_id, ROLLING_LEVEL))
+    row = cursor.fetchone()
+    return tuple(row) if row else (None, None, 0)
+
+
+def build_conversation_context(conversation_id=DEFAULT_CONVERSATION_ID, budget_tokens=1500, db_path=DB_PATH):
+    """
+    Returns the history block of a prompt: the rolling summary of older messages followed by
+    the newest raw messages that it does not cover, within one token budget.
+    :param conversation_id: (str, optional) Conversation to read. Defaults to 'default'.
+    :param budget_tokens: (int, optional) Maximum estimated tokens of the block. Defaults to 1500.
+    :param db_path: (str, optional) Path to SQLite database file. Defaults to 'inventory/inventory.sqlite3'.
+    :return: (str) History block, same format as `build_chat_context()` when there is no summary yet.
+    """
+    summary, _, covered_id = get_rolling_summary(conversation_id, db_path)
+    if summary is None:
+        return build_chat_context(conversation_id, budget_tokens, db_path)
+
+    summary_line = f"Earlier in this conversation: {summary}"
+    recent = build_chat_context(conversation_id, budget_tokens - estimate_tokens(summary_line) - 1, db_path,
+                                after_id=covered_id)
+    return summary_line if recent == NO_MESSAGES else f"{summary_line}\n{recent}"
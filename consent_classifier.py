@@ -0,0 +1,166 @@
+#--------------------------------------------------------------------------------------
+# consent_classifier.py – Local yes/no/unsure detection for pending trades (skips the LLM)
+#--------------------------------------------------------------------------------------
+
+import os
+import re
+import threading
+
+
+#--------------------------------------------------------------------------------------
+# Configuration
+#--------------------------------------------------------------------------------------
+
+# Classifications below this confidence fall through to the LLM consent prompt
+CONSENT_CONFIDENCE_THRESHOLD = float(os.getenv("NPC_CONSENT_THRESHOLD", "0.85"))
+
+# Whole-message phrases (after normalization) per consent value
+CONSENT_PHRASES = {
+    "yes": {
+        "yes", "yeah", "yea", "yep", "yup", "aye", "aye aye", "sure", "ok", "okay", "k", "deal",
+        "its a deal", "it is a deal", "do it", "lets do it", "lets do this", "go ahead", "go for it",
+        "sounds good", "alright", "all right", "of course", "absolutely", "definitely", "agreed",
+        "i agree", "confirm", "confirmed", "i confirm", "yes please", "why not", "fine", "perfect",
+        "great", "done", "sold", "i accept", "accept", "i do", "correct", "right", "that is right",
+        "thats right", "yes i am", "yes i am sure", "im sure", "i am sure", "sure thing", "make it so",
+    },
+    "no": {
+        "no", "nope", "nah", "no thanks", "no thank you", "not today", "never mind", "nevermind",
+        "cancel", "cancel it", "cancel that", "cancel the trade", "forget it", "forget about it",
+        "i changed my mind", "changed my mind", "no deal", "pass", "ill pass", "i will pass",
+        "not now", "not interested", "im not interested", "i dont want it", "i dont want that",
+        "dont", "no way", "absolutely not", "definitely not", "stop", "nay", "not anymore",
+    },
+    "unsure": {
+        "maybe", "maybe later", "not sure", "im not sure", "i am not sure", "i dont know", "dunno",
+        "idk", "hmm", "hm", "let me think", "let me think about it", "i need to think",
+        "i have to think about it", "perhaps", "possibly", "i guess", "not yet",
+    },
+}
+
+# Words that do not change the meaning of a consent reply ("yes please matey!")
+FILLER_WORDS = {
+    "please", "thanks", "thank", "you", "matey", "mate", "captain", "cap", "sir", "friend",
+    "pirate", "then", "oh", "well", "so", "just", "lol", "haha", "man", "buddy",
+}
+
+# Messages mentioning amounts or trade terms may change the trade; leave those to the LLM
+TRADE_WORDS = re.compile(
+    r"\d|\b(buy|sell|more|less|fewer|instead|another|other|price|cost|how much|how many|"
+    r"gold|coins?|cheaper|discount|but|only|except|also|and)\b"
+)
+
+_NON_WORD = re.compile(r"[^a-z0-9' ]+")
+_REPEATED = re.compile(r"(.)\1{2,}")
+
+_stats = {"turns": 0, "hits": 0, "llm_calls": 0, "llm_ms_total": 0.0, "saved_ms_total": 0.0}
+_stats_lock = threading.Lock()
+
+
+#--------------------------------------------------------------------------------------
+# Classification
+#--------------------------------------------------------------------------------------
+
+def normalize_message(text):
+    """
+    Lowercases a message and strips punctuation, apostrophes and stretched letters ("yesss!" -> "yes").
+    :param text: (str) Raw player message.
+    :return: (str) Normalized message.
+    """
+    text = text.lower().replace("’", "'")
+    text = _NON_WORD.sub(" ", text)
+    text = _REPEATED.sub(r"\1", text).replace("'", "")
+    return " ".join(text.split())
+
+
+def classify_consent(player_message):
+    """
+    Decides locally whether a player message answers a pending trade offer.
+    :param player_message: (str) Latest message of the player.
+    :return: (tuple) (consent, confidence) – consent is 'yes', 'no', 'unsure' or None if no phrase matched;
+            confidence is between 0 and 1.
+    Notes:
+        - An exact phrase match scores 1.0, a match after removing filler words 0.9.
+        - A message that only starts with a phrase ("yes, but only 3") scores 0.5 and falls through.
+        - Messages with numbers or trade terms score 0, since they may change the trade.
+    """
+    text = normalize_message(player_message)
+    if not text or TRADE_WORDS.search(text):
+        return None, 0.0
+
+    for consent, phrases in CONSENT_PHRASES.items():
+        if text in phrases:
+            return consent, 1.0
+
+    words = [word for word in text.split() if word not in FILLER_WORDS]
+    stripped = " ".join(words)
+    for consent, phrases in CONSENT_PHRASES.items():
+        if stripped in phrases:
+            return consent, 0.9
+
+    for consent, phrases in CONSENT_PHRASES.items():
+        if any(text.startswith(phrase + " ") for phrase in phrases):
+            return consent, 0.5
+    return None, 0.0
+
+
+def fast_consent(player_message, threshold=CONSENT_CONFIDENCE_THRESHOLD):
+    """
+    Returns the consent value if the local classifier is confident enough to skip the LLM.
+    :param player_message: (str) Latest message of the player.
+    :param threshold: (float, optional) Minimum confidence. Defaults to CONSENT_CONFIDENCE_THRESHOLD.
+    :return: (str | None) 'yes', 'no', 'unsure', or None to fall through to the LLM.
+    """
+    consent, confidence = classify_consent(player_message)
+    return consent if consent and confidence >= threshold else None
+
+
+#--------------------------------------------------------------------------------------
+# Hit rate and saved latency
+#--------------------------------------------------------------------------------------
+
+def record_consent_turn(hit, elapsed_ms):
+    """
+    Records one turn with a pending trade and prints its fast-path outcome.
+    :param hit: (bool) True if the local classifier answered, False if the LLM was called.
+    :param elapsed_ms: (float) Duration of the classifier (hit) or the LLM call (miss).
+    :return: (dict) Statistics after this turn, see `consent_stats()`.
+    Notes:
+        - Saved latency of a hit is estimated from the average of the LLM consent calls seen so far.
+    """
+    with _stats_lock:
+        _stats["turns"] += 1
+        if hit:
+            _stats["hits"] += 1
+            if _stats["llm_calls"]:
+                _stats["saved_ms_total"] += _stats["llm_ms_total"] / _stats["llm_calls"] - elapsed_ms
+        else:
+            _stats["llm_calls"] += 1
+            _stats["llm_ms_total"] += elapsed_ms
+        stats = _snapshot()
+
+    outcome = "hit" if hit else "miss"
+    print(f"\033[96mConsent fast path: {outcome} ({elapsed_ms:.1f} ms), hit rate {stats['hit_rate']:.0%}, "
+          f"saved ~{stats['saved_ms_total']:.0f} ms so far\033[0m")  # Debugging
+    return stats
+
+
+def consent_stats():
+    """
+    Returns the fast-path counters of this process.
+    :return: (dict) 'turns', 'hits', 'llm_calls', 'hit_rate', 'avg_llm_ms' and 'saved_ms_total'.
+    """
+    with _stats_lock:
+        return _snapshot()
+
+
+def _snapshot():
+    turns, llm_calls = _stats["turns"], _stats["llm_calls"]
+    return {
+        "turns": turns,
+        "hits": _stats["hits"],
+        "llm_calls": llm_calls,
+        "hit_rate": _stats["hits"] / turns if turns else 0.0,
+        "avg_llm_ms": _stats["llm_ms_total"] / llm_calls if llm_calls else 0.0,
+        "saved_ms_total": _stats["saved_ms_total"],
+    }
@@ -0,0 +1,228 @@
+#--------------------------------------------------------------------------------------
+# db.py – Shared SQLite connection layer (per-thread connections, WAL, tuned pragmas)
+#--------------------------------------------------------------------------------------
+
+import sqlite3
+import threading
+from contextlib import contextmanager
+
+
+#--------------------------------------------------------------------------------------
+# Configuration
+#--------------------------------------------------------------------------------------
+
+DB_PATH = "inventory/inventory.sqlite3"
+
+# Conversation used when a client does not send its own id (and for rows written before sessions existed)
+DEFAULT_CONVERSATION_ID = "default"
+
+# Applied once to every new connection.
+# WAL lets readers run while execute_trade writes; NORMAL is durable in WAL mode
+# except for the last transactions on power loss, which is fine for a game server.
+PRAGMAS = (
+    "PRAGMA journal_mode = WAL",
+    "PRAGMA synchronous = NORMAL",
+    "PRAGMA cache_size = -8000",      # ~8 MB page cache per connection
+    "PRAGMA temp_store = MEMORY",
+    "PRAGMA busy_timeout = 5000",
+    "PRAGMA foreign_keys = ON",
+)
+
+# Size of sqlite3's per-connection prepared statement cache (default is 128)
+STATEMENT_CACHE_SIZE = 256
+
+# Server-owned tables that are not part of the shipped database file.
+# Created on the first connection to each database.
+SCHEMA = (
+    """
+    CREATE TABLE IF NOT EXISTS inventory_version (
+        id INTEGER PRIMARY KEY CHECK (id = 1),
+        version INTEGER NOT NULL,
+        catalog_version INTEGER NOT NULL DEFAULT 0
+    )
+    """,
+    "INSERT OR IGNORE INTO inventory_version (id, version) VALUES (1, 0)",
+    """
+    CREATE TABLE IF NOT EXISTS trade_status (
+        conversation_id TEXT PRIMARY KEY,
+        is_active INTEGER NOT NULL DEFAULT 0,
+        state TEXT,
+        expires_at REAL
+    )
+    """,
+    # Other names players use for items (see resolve_item() in inventory_store.py), stored as lookup keys
+    """
+    CREATE TABLE IF NOT EXISTS item_aliases (
+        alias TEXT PRIMARY KEY,
+        item_id INTEGER NOT NULL REFERENCES items (id) ON DELETE CASCADE
+    )
+    """,
+    """
+    INSERT OR IGNORE INTO item_aliases (alias, item_id)
+    SELECT alias, id FROM items, (SELECT 'rum' AS alias UNION ALL SELECT 'rum bottle') WHERE name = 'bottle of rum'
+    """,
+    # Trades proposed to the player and waiting for consent (see store_trade_results() in memory_store.py).
+    # status: 'open' until the player answers, then 'executed', 'failed', 'cancelled' or 'replaced'
+    """
+    CREATE TABLE IF NOT EXISTS pending_trades (
+        id INTEGER PRIMARY KEY,
+        conversation_id TEXT NOT NULL,
+        entity_id INTEGER NOT NULL,
+        status TEXT NOT NULL DEFAULT 'open',
+        created TEXT NOT NULL,
+        expires_at REAL NOT NULL,
+        resolved TEXT
+    )
+    """,
+    """
+    CREATE TABLE IF NOT EXISTS pending_trade_lines (
+        trade_id INTEGER NOT NULL REFERENCES pending_trades (id) ON DELETE CASCADE,
+        line_no INTEGER NOT NULL,
+        trade_state TEXT NOT NULL,
+        item TEXT,
+        quantity INTEGER NOT NULL,
+        PRIMARY KEY (trade_id, line_no)
+    ) WITHOUT ROWID
+    """,
+    # At most one open basket per conversation and NPC; also the index of the "current basket" lookup
+    """
+    CREATE UNIQUE INDEX IF NOT EXISTS idx_pending_trades_open
+    ON pending_trades (conversation_id, entity_id) WHERE status = 'open'
+    """,
+    # Background summaries of chat_history (see chat_summaries.py): level 0 covers one chunk
+    # of messages, level 1 is the rolling summary of everything from first_id to last_id
+    """
+    CREATE TABLE IF NOT EXISTS chat_summaries (
+        id INTEGER PRIMARY KEY,
+        conversation_id TEXT NOT NULL,
+        level INTEGER NOT NULL,
+        first_id INTEGER NOT NULL,
+        last_id INTEGER NOT NULL,
+        summary TEXT NOT NULL,
+        created TEXT NOT NULL,
+        UNIQUE (conversation_id, level, last_id)
+    )
+    """,
+)
+
+# Columns added to tables of the shipped database: (table, column, type, backfill statement)
+COLUMNS = (
+    ("chat_history", "conversation_id", "TEXT",
+     f"UPDATE chat_history SET conversation_id = '{DEFAULT_CONVERSATION_ID}' WHERE conversation_id IS NULL"),
+    # Inventory version that last changed the row, for delta queries (see get_inventories())
+    ("inventory", "version", "INTEGER", "UPDATE inventory SET version = 0"),
+    # Changes only with items and aliases, so trades do not invalidate the item catalog
+    ("inventory_version", "catalog_version", "INTEGER NOT NULL DEFAULT 0", "UPDATE inventory_version SET catalog_version = 0"),
+    # Snapshot of the in-memory trade state machine (trade_state.py); old flags count as fresh proposals
+    ("trade_status", "state", "TEXT",
+     "UPDATE trade_status SET state = CASE WHEN is_active THEN 'proposed' ELSE 'idle' END"),
+    ("trade_status", "expires_at", "REAL",
+     "UPDATE trade_status SET expires_at = CAST(strftime('%s', 'now') AS REAL) + 600 WHERE is_active"),
+)
+
+# Indexes, created after the columns they cover
+INDEXES = (
+    "CREATE INDEX IF NOT EXISTS idx_chat_history_conversation ON chat_history (conversation_id, id)",
+)
+
+_local = threading.local()
+_schema_ready = set()
+_schema_lock = threading.Lock()
+
+
+#--------------------------------------------------------------------------------------
+# Connection handling
+#--------------------------------------------------------------------------------------
+
+def get_connection(db_path=DB_PATH):
+    """
+    Returns the persistent connection of the calling thread for the given database,
+    opening and configuring it on first use.
+    :param db_path: (str, optional) Path to SQLite database file. Defaults to 'inventory/inventory.sqlite3'.
+    :return: sqlite3.Connection in autocommit mode; use `transaction()` for writes.
+    Notes:
+        - Connections are kept per thread and per path, so repeated calls within a request
+          reuse the same connection and its prepared statement cache.
+    """
+    connections = getattr(_local, "connections", None)
+    if connections is None:
+        connections = _local.connections = {}
+
+    conn = connections.get(db_path)
+    if conn is None:
+        conn = sqlite3.connect(
+            db_path,
+            isolation_level=None,
+            cached_statements=STATEMENT_CACHE_SIZE,
+            check_same_thread=True,
+        )
+        for pragma in PRAGMAS:
+            conn.execute(pragma)
+        ensure_schema(conn, db_path)
+        connections[db_path] = conn
+    return conn
+
+
+def ensure_schema(conn, db_path=DB_PATH):
+    """
+    Creates the server-owned tables listed in SCHEMA, adds missing COLUMNS and
+    creates INDEXES, once per database and process.
+    :param conn: (sqlite3.Connection) Connection to run the statements on.
+    :param db_path: (str, optional) Path used to remember that the schema is in place.
+    :return: None
+    """
+    with _schema_lock:
+        if db_path in _schema_ready:
+            return
+        conn.execute("BEGIN IMMEDIATE")
+        try:
+            for statement in SCHEMA:
+                conn.execute(statement)
+            for table, column, column_type, backfill in COLUMNS:
+                existing = {row[1] for row in conn.execute(f"PRAGMA table_info({table})")}
+                if existing and column not in existing:
+                    conn.execute(f"ALTER TABLE {table} ADD COLUMN {column} {column_type}")
+                    conn.execute(backfill)
+            for statement in INDEXES:
+                conn.execute(statement)
+        except BaseException:
+            conn.rollback()
+            raise
+        conn.commit()
+        _schema_ready.add(db_path)
+
+
+@contextmanager
+def transaction(db_path=DB_PATH):
+    """
+    Runs the enclosed statements in a single write transaction on the thread's connection.
+    The write lock is taken up front (BEGIN IMMEDIATE) so read-then-update sequences
+    cannot interleave with other writers. Commits on success, rolls back on error.
+    :param db_path: (str, optional) Path to SQLite database file. Defaults to 'inventory/inventory.sqlite3'.
+    :return: Context manager yielding the sqlite3.Connection.
+    """
+    conn = get_connection(db_path)
+    if conn.in_transaction:
+        # Nested use joins the outer transaction
+        yield conn
+        return
+
+    conn.execute("BEGIN IMMEDIATE")
+    try:
+        yield conn
+    except BaseException:
+        conn.rollback()
+        raise
+    else:
+        conn.commit()
+
+
+def close_connections():
+    """
+    Closes all connections opened by the calling thread.
+    :return: None
+    """
+    connections = getattr(_local, "connections", None) or {}
+    for conn in connections.values():
+        conn.close()
+    connections.clear()
@@ -0,0 +1,185 @@
+#--------------------------------------------------------------------------------------
+# fake_openai.py – Offline stand-in for the OpenAI client (scripted replies, synthetic MP3)
+#--------------------------------------------------------------------------------------
+#
+# Implements the part of the OpenAI client this server uses:
+#   client.responses.create(...)                                (plain and stream=True)
+#   client.audio.speech.with_streaming_response.create(...)     (iter_bytes)
+# Select it with NPC_LLM_PROVIDER=fake (see providers.py). Nothing leaves the machine.
+
+import asyncio
+import json
+import os
+import re
+import time
+from contextlib import contextmanager
+
+
+#--------------------------------------------------------------------------------------
+# Configuration
+#--------------------------------------------------------------------------------------
+
+FAKE_MODEL_LATENCY = float(os.getenv("NPC_FAKE_LATENCY_MS", "300")) / 1000
+FAKE_TTS_LATENCY = float(os.getenv("NPC_FAKE_TTS_LATENCY_MS", "200")) / 1000
+
+# One silent MPEG-1 Layer III frame: 128 kbit/s, 44.1 kHz, stereo, 417 bytes, ~26 ms of audio
+MP3_FRAME = bytes.fromhex("fffb9064") + bytes(413)
+MP3_FRAMES_PER_CHAR = 3  # roughly the speaking rate of the real TTS voice
+
+PLAYER_LINE = re.compile(r'(?:Player says|Now the player says): "(.*)"', re.S)
+TRADE_REQUEST = re.compile(r"\b(buy|sell)\s+(\d+)\s+([a-z][a-z ]*?)s?\b(?:[.!?,]|$)", re.I)
+CONSENT_WORDS = {
+    "yes": re.compile(r"^\s*(yes|yeah|aye|sure|ok|okay|deal)\b", re.I),
+    "no": re.compile(r"^\s*(no|nope|nah|cancel)\b", re.I),
+}
+
+
+#--------------------------------------------------------------------------------------
+# Response objects (attribute names match the OpenAI SDK)
+#--------------------------------------------------------------------------------------
+
+class FakeOutput:
+    def __init__(self, type="message", name=None, arguments=None):
+        self.type = type
+        if name:
+            self.name = name
+            self.arguments = json.dumps(arguments)
+            self.call_id = f"call_{name}"
+
+
+class FakeResponse:
+    def __init__(self, output_text="", tool_calls=()):
+        self.output_text = output_text
+        self.output = [FakeOutput("function_call", name, arguments) for name, arguments in tool_calls] \
+            or [FakeOutput()]
+
+
+class FakeEvent:
+    def __init__(self, type, **fields):
+        self.type = type
+        self.__dict__.update(fields)
+
+
+#--------------------------------------------------------------------------------------
+# Default script: answers like the real model would for the prompts in prompt_generator.py
+#--------------------------------------------------------------------------------------
+
+def scripted_response(request_args):
+    """
+    Picks a reply for a `responses.create()` call from the prompt it was given.
+    :param request_args: (dict) Arguments of the call ('input', 'tools', ...).
+    :return: (FakeResponse) Text and/or tool calls.
+    Notes:
+        - "buy/sell <n> <item>" triggers 'parse_trade_intent', a yes/no reply to the consent
+          prompt triggers 'trade_consent', a call without tools (trade follow-up) asks to confirm.
+        - Summarization calls (chat_summaries.py) get a short summary of the given text.
+    """
+    if str(request_args.get("instructions", "")).startswith("Summarize"):
+        words = " ".join(str(request_args.get("input", "")).split()[-40:])
+        return FakeResponse(f"The player and the merchant talked. Latest: {words}")
+
+    prompt = request_args.get("input")
+    prompt = prompt if isinstance(prompt, str) else json.dumps(prompt)
+    match = PLAYER_LINE.search(prompt)
+    player_line = match.group(1) if match else ""
+
+    if not request_args.get("tools"):
+        return FakeResponse("Are ye sure about that trade, matey? Let's make a deal!")
+
+    if "Now the player says" in prompt:
+        for consent, pattern in CONSENT_WORDS.items():
+            if pattern.search(player_line):
+                return FakeResponse("", [("trade_consent", {"consent": consent})])
+
+    trade = TRADE_REQUEST.search(player_line)
+    if trade:
+        trade_state, quantity, item = trade.groups()
+        return FakeResponse("", [("parse_trade_intent", {
+            "trade_state": trade_state.lower(), "item": item.lower(), "quantity": int(quantity)})])
+
+    return FakeResponse("Arr, welcome aboard, matey. Me wares be fine and me prices fair. What can I do for ye?")
+
+
+#--------------------------------------------------------------------------------------
+# Clients
+#--------------------------------------------------------------------------------------
+
+class FakeOpenAI:
+    """
+    Blocking fake client.
+    :param responder: (callable, optional) `responder(request_args)` -> FakeResponse. Defaults to `scripted_response()`.
+    :param latency: (float, optional) Seconds per model call (until the first token when streaming).
+    :param tts_latency: (float, optional) Seconds until the first audio bytes.
+    """
+
+    def __init__(self, responder=scripted_response, latency=FAKE_MODEL_LATENCY, tts_latency=FAKE_TTS_LATENCY, **kwargs):
+        self.responder = responder
+        self.latency = latency
+        self.tts_latency = tts_latency
+        self.responses = _Namespace(create=self._create)
+        self.audio = _Namespace(speech=_Namespace(with_streaming_response=_Namespace(create=self._speech)))
+
+    def _create(self, stream=False, **request_args):
+        time.sleep(self.latency)
+        response = _with_usage(self.responder(request_args), request_args)
+        return _stream_events(response) if stream else response
+
+    @contextmanager
+    def _speech(self, input="", **kwargs):
+        time.sleep(self.tts_latency)
+        yield _FakeSpeech(input)
+
+
+class FakeAsyncOpenAI(FakeOpenAI):
+    """
+    Async fake client with the same script and latencies as `FakeOpenAI`.
+    """
+
+    async def _create(self, stream=False, **request_args):
+        await asyncio.sleep(self.latency)
+        response = _with_usage(self.responder(request_args), request_args)
+        return _async_stream_events(response) if stream else response
+
+
+class _Namespace:
+    def __init__(self, **attributes):
+        self.__dict__.update(attributes)
+
+
+class _FakeSpeech:
+    def __init__(self, text):
+        self.text = text
+
+    def iter_bytes(self, chunk_size=16384):
+        audio = synthetic_mp3(self.text)
+        for start in range(0, len(audio), chunk_size):
+            yield audio[start:start + chunk_size]
+
+
+def _with_usage(response, request_args):
+    """
+    Attaches token usage like the API reports it, estimated at about 4 characters per token.
+    """
+    prompt = json.dumps([request_args.get("instructions"), request_args.get("input"), request_args.get("tools")])
+    response.usage = _Namespace(input_tokens=len(prompt) // 4, output_tokens=len(response.output_text) // 4)
+    return response
+
+
+def synthetic_mp3(text):
+    """
+    Returns silent MP3 audio whose length grows with the text, like real speech would.
+    :param text: (str) Text that would be spoken.
+    :return: (bytes) Valid MPEG audio frames.
+    """
+    return MP3_FRAME * max(len(text) * MP3_FRAMES_PER_CHAR, 1)
+
+
+def _stream_events(response):
+    for word in re.findall(r"\S+\s*", response.output_text):
+        yield FakeEvent("response.output_text.delta", delta=word)
+    yield FakeEvent("response.completed", response=response)
+
+
+async def _async_stream_events(response):
+    for event in _stream_events(response):
+        yield event
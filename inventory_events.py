@@ -0,0 +1,161 @@
+#--------------------------------------------------------------------------------------
+# inventory_events.py – In-process event bus for inventory changes (fanned out over SSE)
+#--------------------------------------------------------------------------------------
+#
+# execute_basket() and insert_item() publish an event after their commit; every open
+# GET /api/inventory/events stream holds a Subscription that receives the events of the
+# entities it asked for. Publishing never blocks on a slow client: each subscription
+# queues at most EVENT_QUEUE_SIZE events, and when a client falls behind its queue is
+# replaced by one 'resync' event telling it to fetch /api/inventory?since=<version>.
+# Events of other server processes are not seen; clients of those processes get them there.
+
+import asyncio
+import os
+import threading
+from collections import deque
+
+
+#--------------------------------------------------------------------------------------
+# Configuration
+#--------------------------------------------------------------------------------------
+
+EVENT_QUEUE_SIZE = int(os.getenv("NPC_EVENT_QUEUE", "100"))
+KEEPALIVE_SECONDS = 15  # comment line sent on idle streams, so proxies keep them open and gone clients are noticed
+
+_subscriptions = set()
+_subscriptions_lock = threading.Lock()
+
+
+#--------------------------------------------------------------------------------------
+# Subscriptions
+#--------------------------------------------------------------------------------------
+
+class Subscription:
+    """
+    Bounded event queue of one client, readable from threads (`get`) and event loops (`get_async`).
+    :param entity_ids: (set | None) Entity ids (str) to receive events for; None for all.
+    :param max_events: (int, optional) Events queued before the client has to resync.
+    """
+
+    def __init__(self, entity_ids=None, max_events=EVENT_QUEUE_SIZE):
+        self.entity_ids = entity_ids
+        self.max_events = max_events
+        self.events = deque()
+        self.dropped = 0  # events replaced by a resync because the client fell behind
+        self.closed = False
+        self._changed = threading.Condition()
+        self._waiters = []  # (loop, asyncio.Event) of async readers
+
+    def wants(self, event):
+        """
+        :return: (bool) True if the event concerns one of the subscribed entities.
+        """
+        return (self.entity_ids is None or not event.get("entity_ids")
+                or not self.entity_ids.isdisjoint(event["entity_ids"]))
+
+    def push(self, event):
+        """
+        Queues an event without ever blocking; a full queue collapses into one 'resync' event.
+        """
+        with self._changed:
+            if len(self.events) >= self.max_events:
+                self.dropped += len(self.events)
+                # The client has seen everything before the oldest queued event
+                oldest = self.events[0]
+                since = oldest["since"] if oldest["type"] == "resync" else oldest["version"] - 1
+                self.events.clear()
+                self.events.append({"type": "resync", "since": since, "version": event.get("version")})
+            else:
+                self.events.append(event)
+            self._changed.notify_all()
+            waiters, self._waiters = self._waiters, []
+        for loop, ready in waiters:
+            loop.call_soon_threadsafe(ready.set)
+
+    def get(self, timeout=None):
+        """
+        Waits for the next event on the calling thread.
+        :param timeout: (float, optional) Seconds to wait at most.
+        :return: (dict | None) The event, or None after the timeout or once the subscription is closed.
+        """
+        with self._changed:
+            self._changed.wait_for(lambda: self.events or self.closed, timeout)
+            return self.events.popleft() if self.events and not self.closed else None
+
+    async def get_async(self, timeout=None):
+        """
+        Waits for the next event on the running event loop, without holding a thread.
+        :param timeout: (float, optional) Seconds to wait at most.
+        :return: (dict | None) The event, or None after the timeout or once the subscription is closed.
+        """
+        ready = asyncio.Event()
+        with self._changed:
+            if self.events or self.closed:
+                return self.events.popleft() if self.events and not self.closed else None
+            self._waiters.append((asyncio.get_running_loop(), ready))
+        try:
+            await asyncio.wait_for(ready.wait(), timeout)
+        except asyncio.TimeoutError:
+            return None
+        with self._changed:
+            return self.events.popleft() if self.events and not self.closed else None
+
+    def close(self):
+        """
+        Stops the subscription and wakes up a waiting reader.
+        """
+        unsubscribe(self)
+        with self._changed:
+            self.closed = True
+            self._changed.notify_all()
+            waiters, self._waiters = self._waiters, []
+        for loop, ready in waiters:
+            loop.call_soon_threadsafe(ready.set)
+
+
+def subscribe(entity_ids=None, max_events=EVENT_QUEUE_SIZE):
+    """
+    Opens a subscription to inventory events.
+    :param entity_ids: (list, optional) Entity ids to receive events for; None for all entities.
+    :param max_events: (int, optional) Events queued before the client has to resync.
+    :return: (Subscription) Call `close()` when the client is gone.
+    """
+    subscription = Subscription({str(entity_id) for entity_id in entity_ids} if entity_ids else None, max_events)
+    with _subscriptions_lock:
+        _subscriptions.add(subscription)
+    return subscription
+
+
+def unsubscribe(subscription):
+    with _subscriptions_lock:
+        _subscriptions.discard(subscription)
+
+
+def subscriber_count():
+    """
+    :return: (int) Number of open subscriptions.
+    """
+    return len(_subscriptions)
+
+
+#--------------------------------------------------------------------------------------
+# Publishing
+#--------------------------------------------------------------------------------------
+
+def publish(event):
+    """
+    Hands an event to every subscription that wants it. Call it after the change is committed.
+    :param event: (dict) Event with 'type', 'version' and optionally 'entity_ids' (list of str);
+            events without entity ids go to every subscription.
+    :return: (int) Number of subscriptions the event was queued for.
+    """
+    if not _subscriptions:
+        return 0
+    with _subscriptions_lock:
+        subscriptions = list(_subscriptions)
+    delivered = 0
+    for subscription in subscriptions:
+        if subscription.wants(event):
+            subscription.push(event)
+            delivered += 1
+    return delivered
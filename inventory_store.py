@@ -4,25 +4,112 @@
 
 import sqlite3
 import json
+import threading
 from datetime import datetime
-from flask import jsonify
+from flask import jsonify, Response
+from db import DB_PATH, get_connection, transaction
+from inventory_events import publish as publish_event
 
 
 #--------------------------------------------------------------------------------------
-# Get all inventory items for a specific entity
+# Versioned inventory cache
+# Every write to items/inventory bumps inventory_version inside its transaction.
+# The committed version is published to this process afterwards, so cached rows
+# stay valid until the inventory actually changes. Commits from other connections
+# (other threads or server processes) are noticed through PRAGMA data_version.
+# Item and alias changes also bump catalog_version, which trades leave alone.
 #--------------------------------------------------------------------------------------
 
-def get_all_items(entity_id, db_path="inventory/inventory.sqlite3"):
+_inventory_versions = {}  # db_path -> latest committed inventory version
+_catalog_versions = {}    # db_path -> latest committed catalog version
+_inventory_cache = {}     # (db_path, entity_id) -> {"version", "rows", "items", "text"}
+_cache_lock = threading.Lock()
+_seen_data_versions = threading.local()  # per-thread: db_path -> data_version of its connection
+
+
+def get_inventory_version(db_path=DB_PATH):
     """
-    Retrieves all inventory items for a specific entity from a SQLite database
-    and returns a formatted string listing item names, quantities, and prices.
-    :param entity_id: The unique identifier of the entity whose inventory should be fetched.
-    :param db_path:  File path to the SQLite database containing inventory data.
-    :return:  A human-readable summary of the entity's inventory,
-             or a message indicating an empty or missing inventory.
+    Returns the current inventory version. The version row is only re-read when another
+    connection has committed since the last check; otherwise no table is touched.
+    :param db_path: (str, optional) File path to the SQLite database. Defaults to 'inventory/inventory.sqlite3'.
+    :return: (int) Version counter that increases with every inventory or item change.
+    """
+    conn = get_connection(db_path)
+    seen = getattr(_seen_data_versions, "versions", None)
+    if seen is None:
+        seen = _seen_data_versions.versions = {}
+
+    data_version = conn.execute("PRAGMA data_version").fetchone()[0]
+    if seen.get(db_path) != data_version or db_path not in _catalog_versions:
+        row = conn.execute("SELECT version, catalog_version FROM inventory_version WHERE id = 1").fetchone()
+        version, catalog_version = row or (0, 0)
+        _publish_inventory_version(db_path, version)
+        _publish_catalog_version(db_path, catalog_version)
+        seen[db_path] = data_version
+    return _inventory_versions[db_path]
+
+
+def get_catalog_version(db_path=DB_PATH):
+    """
+    Returns the current catalog version, checked together with the inventory version.
+    :param db_path: (str, optional) File path to the SQLite database. Defaults to 'inventory/inventory.sqlite3'.
+    :return: (int) Version counter that increases with every item or alias change, but not with trades.
+    """
+    get_inventory_version(db_path)
+    return _catalog_versions[db_path]
+
+
+def bump_inventory_version(conn):
+    """
+    Increments the inventory version. Must be called inside the transaction that changes the data.
+    :param conn: (sqlite3.Connection) Connection with an open write transaction.
+    :return: (int) The new version, to be published with `_publish_inventory_version()` after commit.
     """
-    conn = sqlite3.connect(db_path)
-    cursor = conn.cursor()
+    conn.execute("UPDATE inventory_version SET version = version + 1 WHERE id = 1")
+    return conn.execute("SELECT version FROM inventory_version WHERE id = 1").fetchone()[0]
+
+
+def bump_catalog_version(conn):
+    """
+    Increments the catalog version. Must be called inside the transaction that changes items or aliases.
+    :param conn: (sqlite3.Connection) Connection with an open write transaction.
+    :return: (int) The new version, to be published with `_publish_catalog_version()` after commit.
+    """
+    conn.execute("UPDATE inventory_version SET catalog_version = catalog_version + 1 WHERE id = 1")
+    return conn.execute("SELECT catalog_version FROM inventory_version WHERE id = 1").fetchone()[0]
+
+
+def _publish_inventory_version(db_path, version):
+    """
+    Makes a committed version visible to readers. Older versions never overwrite newer ones.
+    """
+    with _cache_lock:
+        if version > _inventory_versions.get(db_path, -1):
+            _inventory_versions[db_path] = version
+
+
+def _publish_catalog_version(db_path, version):
+    with _cache_lock:
+        if version > _catalog_versions.get(db_path, -1):
+            _catalog_versions[db_path] = version
+
+
+def _load_inventory(entity_id, db_path=DB_PATH):
+    """
+    Returns the cached inventory entry of an entity, re-running the JOIN only if the version changed.
+    :param entity_id: Unique identifier of the entity (int or str).
+    :param db_path: (str, optional) File path to the SQLite database. Defaults to 'inventory/inventory.sqlite3'.
+    :return: (dict) Entry with 'version', raw 'rows', JSON-ready 'items' and rendered prompt 'text'.
+    """
+    # Read the version before querying: if a trade commits in between,
+    # the entry is stored under the old version and reloaded on the next call.
+    version = get_inventory_version(db_path)
+    key = (db_path, str(entity_id))
+    entry = _inventory_cache.get(key)
+    if entry is not None and entry["version"] == version:
+        return entry
+
+    cursor = get_connection(db_path).cursor()
 
     # SQL: Entity, Item-Name, Quantity, Price
     cursor.execute("""
@@ -38,24 +125,61 @@ def get_all_items(entity_id, db_path="inventory/inventory.sqlite3"):
     """, (entity_id,))
 
     rows = cursor.fetchall()
-    conn.close()
 
-    if not rows:
-        return f"{entity_id} has no inventory or no items."
+    if rows:
+        output = [f"{entity_id} has these items in inventory:"]
+        for item_name, quantity, price in rows:
+            output.append(f"- {quantity} {item_name} at ${price:.2f} each")
+        text = "\n".join(output)
+    else:
+        text = f"{entity_id} has no inventory or no items."
 
-    # Formatted Output
-    output = [f"{entity_id} has these items in inventory:"]
-    for item_name, quantity, price in rows:
-        output.append(f"- {quantity} {item_name} at ${price:.2f} each")
+    entry = {
+        "version": version,
+        "rows": rows,
+        "items": [{"name": item_name, "quantity": quantity, "price": round(price, 2)}
+                  for item_name, quantity, price in rows],
+        "text": text,
+    }
+    # Unknown ids are not cached, so arbitrary API polls cannot grow the cache
+    if rows:
+        _inventory_cache[key] = entry
+    return entry
 
-    return "\n".join(output)
+
+#--------------------------------------------------------------------------------------
+# Get all inventory items for a specific entity
+#--------------------------------------------------------------------------------------
+
+def get_all_items(entity_id, db_path=DB_PATH):
+    """
+    Retrieves all inventory items for a specific entity from a SQLite database
+    and returns a formatted string listing item names, quantities, and prices.
+    :param entity_id: The unique identifier of the entity whose inventory should be fetched.
+    :param db_path:  File path to the SQLite database containing inventory data.
+    :return:  A human-readable summary of the entity's inventory,
+             or a message indicating an empty or missing inventory.
+    Notes:
+        - Served from the versioned inventory cache; SQLite is only queried after a change.
+    """
+    return _load_inventory(entity_id, db_path)["text"]
+
+
+def get_inventory_items(entity_id, db_path=DB_PATH):
+    """
+    Returns the inventory of an entity as a list of dicts, from the versioned inventory cache.
+    :param entity_id: The unique identifier of the entity whose inventory should be fetched.
+    :param db_path: (str, optional) File path to the SQLite database. Defaults to 'inventory/inventory.sqlite3'.
+    :return: (list) Dicts with 'name', 'quantity' and 'price'; empty for unknown entities.
+    """
+    return _load_inventory(entity_id, db_path)["items"]
 
 
 #--------------------------------------------------------------------------------------
 # Insert a new item into the database
 #--------------------------------------------------------------------------------------
 
-def insert_item(name, description="", db_path="inventory/inventory.sqlite3"):
+def insert_item(name, description="", db_path=DB_PATH):
     """
     Inserts a new item into the 'items' table of the SQLite inventory database.
     :param name: (str) Name of the item to be added.
@@ -63,41 +187,176 @@ def insert_item(name, description="", db_path="inventory/inventory.sqlite3"):
     :param db_path: (str, optional) File path to the SQLite database. Defaults to 'inventory/inventory.sqlite3'.
     :return: Success message if insert succeeds, or error message if item already exists.
     """
-    conn = sqlite3.connect(db_path)
-    cursor = conn.cursor()
-
     try:
-        cursor.execute("""
-            INSERT INTO items (name, description)
-            VALUES (?, ?)
-        """, (name, description))
-        conn.commit()
+        with transaction(db_path) as conn:
+            conn.execute("""
+                INSERT INTO items (name, description)
+                VALUES (?, ?)
+            """, (name, description))
+            version = bump_inventory_version(conn)
+            catalog_version = bump_catalog_version(conn)
+        _publish_inventory_version(db_path, version)
+        _publish_catalog_version(db_path, catalog_version)
+        publish_event({"type": "item", "version": version, "item": name, "description": description})
         return f"Item '{name}' wurde erfolgreich hinzugefügt."
     except sqlite3.IntegrityError:
         return f"Fehler: Item mit dem Namen '{name}' existiert bereits."
-    finally:
-        conn.close()
+
+
+#--------------------------------------------------------------------------------------
+# Item catalog: resolves what players (and the model) call an item to the item in the DB.
+# Names and aliases are reduced to a lookup key (lowercase, no articles or punctuation,
+# every word singular), so "Bottles of Rum" and "bottle of rum" hit the same dict entry.
+# Near misses ("banan", "aple") are found through a delete index: every key is stored
+# once per one-letter deletion, so a typo costs len(word) dict lookups instead of a scan.
+# The catalog is rebuilt when the catalog version changes (insert_item and add_item_alias bump it).
+#--------------------------------------------------------------------------------------
+
+_catalogs = {}  # db_path -> {"version", "items", "keys", "deletes"}
+FUZZY_MIN_LENGTH = 4  # shorter names must match exactly ("rum" must not become "gum")
+LEADING_WORDS = ("a", "an", "the", "some", "my", "your", "ye", "yer")
+
+
+def _singular(word):
+    """
+    Reduces an English word to a singular form with a few suffix rules. Irregular plurals
+    need an alias. The result only has to be consistent, not always a real word.
+    """
+    if len(word) <= 3 or word.endswith(("ss", "us", "is")):
+        return word
+    if word.endswith("ies"):
+        return word[:-3] + "y"
+    if word.endswith(("sses", "shes", "ches", "xes", "zes")):
+        return word[:-2]
+    if word.endswith("s"):
+        return word[:-1]
+    return word
+
+
+def item_key(name, singular=True):
+    """
+    Returns the lookup key of an item name or alias.
+    :param name: (str) Item name as written by a player, the model or the database.
+    :param singular: (bool, optional) Reduce every word to its singular form. Defaults to True.
+    :return: (str) Lowercase key without leading articles and punctuation.
+    """
+    words = "".join(c if c.isalnum() else " " for c in str(name).lower()).split()
+    while len(words) > 1 and words[0] in LEADING_WORDS:
+        words.pop(0)
+    return " ".join(_singular(word) if singular else word for word in words)
+
+
+def _deletes(key):
+    return {key[:i] + key[i + 1:] for i in range(len(key))}
+
+
+def get_item_catalog(db_path=DB_PATH):
+    """
+    Returns the item catalog of a database, rebuilding it after items or aliases changed.
+    :param db_path: (str, optional) File path to the SQLite database. Defaults to 'inventory/inventory.sqlite3'.
+    :return: (dict) 'version', 'items' (id -> name), 'keys' (lookup key -> id)
+            and 'deletes' (key with one letter removed -> set of keys).
+    """
+    version = get_catalog_version(db_path)
+    catalog = _catalogs.get(db_path)
+    if catalog is not None and catalog["version"] == version:
+        return catalog
+
+    conn = get_connection(db_path)
+    items = dict(conn.execute("SELECT id, name FROM items").fetchall())
+    keys = {}
+    for alias, item_id in conn.execute("SELECT alias, item_id FROM item_aliases").fetchall():
+        if item_id in items:
+            keys[item_key(alias)] = item_id
+    for item_id, name in items.items():
+        # Item names win over aliases; "+s"/"+es" covers plurals _singular() does not undo (shoes, tomatoes)
+        for form in (name, name + "s", name + "es"):
+            keys.setdefault(item_key(form), item_id)
+        keys[item_key(name)] = item_id
+
+    deletes = {}
+    for key in keys:
+        if len(key) >= FUZZY_MIN_LENGTH:
+            for deleted in _deletes(key):
+                deletes.setdefault(deleted, set()).add(key)
+
+    catalog = {"version": version, "items": items, "keys": keys, "deletes": deletes}
+    _catalogs[db_path] = catalog
+    return catalog
+
+
+def resolve_item(name, db_path=DB_PATH):
+    """
+    Finds the catalog item a name refers to: exact, plural, alias or one typo away.
+    :param name: (str) Item name as written by a player or the model.
+    :param db_path: (str, optional) File path to the SQLite database. Defaults to 'inventory/inventory.sqlite3'.
+    :return: (tuple | None) (item id, item name as stored), or None if nothing (or more than one item) is close.
+    """
+    if not name:
+        return None
+    catalog = get_item_catalog(db_path)
+    key = item_key(name)
+    item_id = catalog["keys"].get(key)
+
+    if item_id is None:
+        # One insertion, deletion, substitution or swap of neighbouring letters. The unsingularized
+        # form is tried too, since stripping an "s" from a typo ("spyglas") adds a second edit.
+        deletes = catalog["deletes"]
+        close = set()
+        for typed in {key, item_key(name, singular=False)}:
+            if len(typed) < FUZZY_MIN_LENGTH:
+                continue
+            close.update(deletes.get(typed, ()))
+            for deleted in _deletes(typed):
+                if deleted in catalog["keys"] and len(deleted) >= FUZZY_MIN_LENGTH:
+                    close.add(deleted)
+                close.update(deletes.get(deleted, ()))
+        matches = {catalog["keys"][match] for match in close}
+        if len(matches) == 1:
+            item_id = matches.pop()
+
+    return (item_id, catalog["items"][item_id]) if item_id is not None else None
+
+
+def add_item_alias(alias, item_name, db_path=DB_PATH):
+    """
+    Registers another name for an item (e.g. 'rum' for 'bottle of rum'), or moves an existing alias.
+    :param alias: (str) Name players may use for the item.
+    :param item_name: (str) Name of the item as stored in the 'items' table.
+    :param db_path: (str, optional) File path to the SQLite database. Defaults to 'inventory/inventory.sqlite3'.
+    :return: (bool) True if the alias was stored, False for an unknown item.
+    """
+    with transaction(db_path) as conn:
+        cursor = conn.execute("""
+            INSERT OR REPLACE INTO item_aliases (alias, item_id)
+            SELECT ?, id FROM items WHERE name = ?
+        """, (item_key(alias), item_name))
+        if not cursor.rowcount:
+            return False
+        version = bump_inventory_version(conn)
+        catalog_version = bump_catalog_version(conn)
+    _publish_inventory_version(db_path, version)
+    _publish_catalog_version(db_path, catalog_version)
+    return True
 
 
 #--------------------------------------------------------------------------------------
 # Retrieve the name and role of an entity by ID
 #--------------------------------------------------------------------------------------
 
-def get_entity_name(id, db_path="inventory/inventory.sqlite3"):
+def get_entity_name(id, db_path=DB_PATH):
     """
     Fetches the name of an entity from the database using its unique ID.
     :param id: (int) The identifier of the entity whose name should be retrieved.
     :param db_path: (str, optional) File path to the SQLite database. Defaults to 'inventory/inventory.sqlite3'.
     :return: Entity name if found, or a message indicating missing data or nonexistent entity.
     """
-    conn = sqlite3.connect(db_path)
-    cursor = conn.cursor()
+    cursor = get_connection(db_path).cursor()
 
     cursor.execute("""
         SELECT name FROM entities WHERE id = ?
     """, (id,))
     result = cursor.fetchone()
-    conn.close()
 
     if result and result[0]:
         return f"{result[0]}"
@@ -107,21 +366,19 @@ def get_entity_name(id, db_path="inventory/inventory.sqlite3"):
         return f"No entity with '{id}' found."
 
 
-def get_entity_role(id, db_path="inventory/inventory.sqlite3"):
+def get_entity_role(id, db_path=DB_PATH):
     """
     Retrieves the role of a specified entity from the database using its ID.
     :param id: (int) The identifier of the entity whose role should be retrieved.
     :param db_path: (str, optional) File path to the SQLite database. Defaults to 'inventory/inventory.sqlite3'.
     :return: Entity role if found, or a message indicating missing role or nonexistent entity.
     """
-    conn = sqlite3.connect(db_path)
-    cursor = conn.cursor()
+    cursor = get_connection(db_path).cursor()
 
     cursor.execute("""
         SELECT role FROM entities WHERE id = ?
     """, (id,))
     result = cursor.fetchone()
-    conn.close()
 
     if result and result[0]:
         return f"{result[0]}"
@@ -129,13 +386,56 @@ def get_entity_role(id, db_path="inventory/inventory.sqlite3"):
         return f"'{id}' has no specific role."
     else:
         return f"No entity with '{id}' found."
-    
+
+
+def get_unknown_entities(entity_ids, db_path=DB_PATH):
+    """
+    Returns the ids that have no row in the 'entities' table.
+    :param entity_ids: (list) Entity ids.
+    :param db_path: (str, optional) File path to the SQLite database. Defaults to 'inventory/inventory.sqlite3'.
+    :return: (list) Unknown ids as strings, in request order (empty if all exist).
+    """
+    entity_ids = [str(entity_id) for entity_id in dict.fromkeys(entity_ids)]
+    if not entity_ids:
+        return []
+    cursor = get_connection(db_path).cursor()
+    cursor.execute(f"""
+        SELECT id FROM entities WHERE id IN ({",".join("?" * len(entity_ids))})
+    """, entity_ids)
+    known = {str(row[0]) for row in cursor.fetchall()}
+    return [entity_id for entity_id in entity_ids if entity_id not in known]
+
+
+#--------------------------------------------------------------------------------------
+# Retrieve the unit price of an item by name
+#--------------------------------------------------------------------------------------
+
+def get_item_price(item_name, db_path=DB_PATH):
+    """
+    Looks up the price per unit of an item.
+    :param item_name: (str) Name of the item, resolved through the item catalog (see `resolve_item()`).
+    :param db_path: (str, optional) File path to the SQLite database. Defaults to 'inventory/inventory.sqlite3'.
+    :return: (float | None) Price per unit, 0 for items without a price, or None for unknown items.
+    """
+    match = resolve_item(item_name, db_path)
+    if match is None:
+        return None
+    cursor = get_connection(db_path).cursor()
+    cursor.execute("""
+        SELECT IFNULL(p.price, 0)
+        FROM items i
+        LEFT JOIN prices p ON p.item_id = i.id
+        WHERE i.id = ?
+    """, (match[0],))
+    row = cursor.fetchone()
+    return row[0] if row else None
+
 
 #--------------------------------------------------------------------------------------
 # Execute trade transaction (buy or sell) and update the database
 #--------------------------------------------------------------------------------------
 
-def execute_trade(trade_state, item_name, quantity, player_id=2, npc_id=1, db_path="inventory/inventory.sqlite3"):
+def execute_trade(trade_state, item_name, quantity, player_id=2, npc_id=1, db_path=DB_PATH):
     """
     Executes a trade transaction (buy or sell) between player and NPC,
     adjusting inventory quantities and returning a themed confirmation message.
@@ -147,120 +447,215 @@ def execute_trade(trade_state, item_name, quantity, player_id=2, npc_id=1, db_pa
     :param db_path: (str, optional) Path to the SQLite database file. Defaults to 'inventory/inventory.sqlite3'.
     :return: str: Pirate-style confirmation message describing the outcome of the trade.
     Notes:
-        - Uses helper functions `get_quantity()` and `update_inventory()` internally.
-        - Prevents negative stock and ensures minimum quantity is zero.
+        - A basket with a single line, see `execute_basket()`.
+        - Prevents negative stock.
         - Returns playful pirate slang for immersive feedback. Should be changed to neutral speech for multiple NPC.
     """
-    conn = sqlite3.connect(db_path)
-    cursor = conn.cursor()
-
-    # Get item id
-    cursor.execute("SELECT id FROM items WHERE name = ?", (item_name,))
-    item_row = cursor.fetchone()
-    if not item_row:
-        conn.close()
-        return f"Arrr, I ain't got no '{item_name}' in me ledgers!"
-    item_id = item_row[0]
-
-    # Get price
-    cursor.execute("SELECT price FROM prices WHERE item_id = ?", (item_id,))
-    price_row = cursor.fetchone()
-    price_per_unit = price_row[0] if price_row else 0
-    total_price = price_per_unit * quantity
-
-    # Helper: Inventory check
-    def get_quantity(entity_id):
-        cursor.execute("""
-            SELECT quantity FROM inventory WHERE entity_id = ? AND item_id = ?
-        """, (entity_id, item_id))
-        row = cursor.fetchone()
-        return row[0] if row else 0
-
-    # Helper: Inventory update
-    def update_inventory(entity_id, delta_qty):
-        current_qty = get_quantity(entity_id)
-        new_qty = current_qty + delta_qty
-        if current_qty is None:
-            cursor.execute("""
-                INSERT INTO inventory (entity_id, item_id, quantity)
-                VALUES (?, ?, ?)
-            """, (entity_id, item_id, max(new_qty, 0)))
-        else:
-            cursor.execute("""
-                UPDATE inventory SET quantity = ?
-                WHERE entity_id = ? AND item_id = ?
-            """, (max(new_qty, 0), entity_id, item_id))
-
-    # Trading logic
-    if trade_state == "buy":
-        npc_stock = get_quantity(npc_id)
-        if npc_stock < quantity:
-            conn.close()
-            return f"Arrr, I only got {npc_stock} {item_name}(s) in me stash! Pick somethin' else!"
-
-        update_inventory(npc_id, -quantity)
-        update_inventory(player_id, quantity)
-        conn.commit()
-        conn.close()
-        return f"Ye bought {quantity} {item_name}(s) for {total_price:.2f} gold. Pleasure doing business, matey!"
-
-    elif trade_state == "sell":
-        player_stock = get_quantity(player_id)
-        if player_stock < quantity:
-            conn.close()
-            return f"Ye trying to cheat me? Ye only got {player_stock} {item_name}(s)! Don’t play tricks on me!"
-
-        update_inventory(player_id, -quantity)
-        update_inventory(npc_id, quantity)
-        conn.commit()
-        conn.close()
-        return f"Sold {quantity} {item_name}(s) for {total_price:.2f} gold. Ye drive a hard bargain!"
+    line = {"trade_state": trade_state, "item": item_name, "quantity": quantity}
+    return execute_basket([line], player_id, npc_id, db_path)["lines"][0]["message"]
+
 
+def execute_basket(lines, player_id=2, npc_id=1, db_path=DB_PATH):
+    """
+    Executes several trade lines between player and NPC as one all-or-nothing trade.
+    All lines are validated against the stock first (two set-based queries); only if every
+    line is possible are all inventory changes written, in a single transaction.
+    :param lines: (list[dict]) Trade lines with 'trade_state' ('buy'/'sell'), 'item' and 'quantity',
+            as stored by `store_trade_results()`.
+    :param player_id: (int, optional): Database ID of the player entity. Defaults to 2.
+    :param npc_id: (int, optional) Database ID of the NPC entity. Defaults to 1.
+    :param db_path: (str, optional) Path to the SQLite database file. Defaults to 'inventory/inventory.sqlite3'.
+    :return: (dict) Result with:
+            - 'ok': True if the trade was executed, False if nothing was changed.
+            - 'lines': per line 'trade_state', 'item', 'quantity', 'ok', 'total_price' and 'message'.
+            - 'message': NPC text for the whole basket.
+            - 'unknown_entities': ids of player_id/npc_id that are not in the 'entities' table
+              (nothing is checked or changed then).
+    Notes:
+        - Lines are checked in order, so a later line may use stock an earlier line provides
+          (e.g. sell 2 apples, then buy them back).
+        - Missing inventory rows are inserted (e.g. the first item of a kind the NPC buys).
+        - Item names are resolved through the item catalog (plurals, aliases, typos), see `resolve_item()`;
+          the results carry the item name as stored.
+        - An executed trade is published as a 'trade' event (new stock of the changed rows), see inventory_events.py.
+    """
+    # Write lock is taken up front so stock checks and updates cannot interleave with other trades
+    with transaction(db_path) as conn:
+        # Inventory rows of unknown entities would fail the foreign key on insert
+        known = {row[0] for row in conn.execute("SELECT id FROM entities WHERE id IN (?, ?)", (player_id, npc_id))}
+        unknown = [entity_id for entity_id in dict.fromkeys((player_id, npc_id)) if entity_id not in known]
+        if unknown:
+            return {"ok": False, "lines": [], "unknown_entities": unknown,
+                    "message": "I don't know who ye be trading with, matey!"}
+        results, changes = _check_basket(conn.cursor(), lines, player_id, npc_id, db_path)
+        ok = bool(results) and all(result["ok"] for result in results)
+        if ok:
+            # Rows remember the version that changed them, so clients can ask for deltas
+            version = bump_inventory_version(conn)
+            conn.executemany("UPDATE inventory SET quantity = ?, version = ? WHERE entity_id = ? AND item_id = ?",
+                             [(qty, version, entity_id, item_id)
+                              for (entity_id, item_id), (qty, exists, _) in changes.items() if exists])
+            conn.executemany("INSERT INTO inventory (entity_id, item_id, quantity, version) VALUES (?, ?, ?, ?)",
+                             [(entity_id, item_id, qty, version)
+                              for (entity_id, item_id), (qty, exists, _) in changes.items() if not exists])
+
+    if ok:
+        _publish_inventory_version(db_path, version)
+        stock = {}
+        for (entity_id, _), (qty, _, item_name) in changes.items():
+            stock.setdefault(str(entity_id), []).append({"name": item_name, "quantity": qty})
+        publish_event({"type": "trade", "version": version, "entity_ids": [str(player_id), str(npc_id)],
+                       "inventories": stock, "lines": results})
+        message = "\n".join(result["message"] for result in results)
     else:
-        conn.close()
-        return "I don't understand if ye be buyin' or sellin', matey!"
+        failed = [result["message"] for result in results if not result["ok"]]
+        if len(results) > 1:
+            failed.append("So the whole deal be off, matey. Nothin' changed hands.")
+        message = "\n".join(failed) or "There be nothin' to trade, matey!"
+    return {"ok": ok, "lines": results, "message": message, "unknown_entities": []}
+
+
+def _check_basket(cursor, lines, player_id, npc_id, db_path=DB_PATH):
+    """
+    Validates trade lines on an open write transaction, simulating the stock line by line.
+    :return: (tuple) Per-line result dicts, and the final stock per (entity_id, item_id)
+            as (quantity, row exists, item name) for every inventory row the basket changes.
+    """
+    resolved = {}
+    for line in lines:
+        name = line.get("item")
+        if isinstance(name, str) and name not in resolved:
+            resolved[name] = resolve_item(name, db_path)
+    item_ids = sorted({match[0] for match in resolved.values() if match})
+    placeholders = ",".join("?" * len(item_ids))
+    cursor.execute(f"""
+        SELECT i.id, IFNULL((SELECT price FROM prices WHERE item_id = i.id LIMIT 1), 0)
+        FROM items i WHERE i.id IN ({placeholders})
+    """, item_ids)
+    prices = dict(cursor.fetchall())
+    # Name as sent -> (item id, name as stored, price)
+    items = {name: (match[0], match[1], prices[match[0]])
+             for name, match in resolved.items() if match and match[0] in prices}
+
+    stock = {}  # (entity_id, item_id) -> [quantity, row exists]
+    if items:
+        item_ids = sorted({item_id for item_id, _, _ in items.values()})
+        cursor.execute(f"""
+            SELECT entity_id, item_id, quantity FROM inventory
+            WHERE entity_id IN (?, ?) AND item_id IN ({",".join("?" * len(item_ids))})
+        """, [player_id, npc_id, *item_ids])
+        stock = {(entity_id, item_id): [quantity or 0, True] for entity_id, item_id, quantity in cursor.fetchall()}
+
+    results = []
+    changed = set()
+    for line in lines:
+        trade_state, item_name, quantity = line.get("trade_state"), line.get("item"), line.get("quantity")
+        result = {"trade_state": trade_state, "item": item_name, "quantity": quantity, "ok": False, "total_price": 0}
+        results.append(result)
+
+        if not isinstance(item_name, str) or item_name not in items:
+            result["message"] = f"Arrr, I ain't got no '{item_name}' in me ledgers!"
+            continue
+        if trade_state not in ("buy", "sell"):
+            result["message"] = "I don't understand if ye be buyin' or sellin', matey!"
+            continue
+        if not isinstance(quantity, int) or isinstance(quantity, bool) or quantity <= 0:
+            result["message"] = f"How many {item_name}(s) be that, matey? Give me a proper number!"
+            continue
+
+        item_id, item_name, price = items[item_name]
+        result["item"] = item_name
+        giver, taker = (npc_id, player_id) if trade_state == "buy" else (player_id, npc_id)
+        giver_stock = stock.setdefault((giver, item_id), [0, False])
+        taker_stock = stock.setdefault((taker, item_id), [0, False])
+        if giver_stock[0] < quantity:
+            if trade_state == "buy":
+                result["message"] = f"Arrr, I only got {giver_stock[0]} {item_name}(s) in me stash! Pick somethin' else!"
+            else:
+                result["message"] = f"Ye trying to cheat me? Ye only got {giver_stock[0]} {item_name}(s)! Don’t play tricks on me!"
+            continue
+
+        giver_stock[0] -= quantity
+        taker_stock[0] += quantity
+        changed.update({(giver, item_id), (taker, item_id)})
+        result["ok"] = True
+        result["total_price"] = round(price * quantity, 2)
+        if trade_state == "buy":
+            result["message"] = f"Ye bought {quantity} {item_name}(s) for {price * quantity:.2f} gold. Pleasure doing business, matey!"
+        else:
+            result["message"] = f"Sold {quantity} {item_name}(s) for {price * quantity:.2f} gold. Ye drive a hard bargain!"
+
+    names = {item_id: item_name for item_id, item_name, _ in items.values()}
+    return results, {key: (*stock[key], names[key[1]]) for key in changed}
 
 
 #--------------------------------------------------------------------------------------
 # Retrieve inventory for a given entity and return as JSON (used in API)
+# Responses carry the inventory version as ETag; clients that send it back in
+# If-None-Match get a 304 (see app.py), so polling an unchanged inventory costs
+# one PRAGMA and no JOIN or serialization.
 #--------------------------------------------------------------------------------------
 
-def get_inventory(entity_id, db_path="inventory/inventory.sqlite3"):
+def inventory_etag(version):
+    """
+    Returns the ETag of inventory responses for an inventory version.
+    :param version: (int) Inventory version, see `get_inventory_version()`.
+    :return: (str) Unquoted entity tag.
+    """
+    return f"inventory-{version}"
+
+
+def get_inventory(entity_id, db_path=DB_PATH):
     """
     Retrieves the inventory of a specific entity from the database and returns it
     as a structured JSON response, suitable for use in web APIs.
     :param entity_id: (int) Unique identifier of the entity whose inventory is requested.
     :param db_path: (str, optional) File path to the SQLite database. Defaults to 'inventory/inventory.sqlite3'.
-    :return: Flask-style `jsonify()` object containing the inventory details
+    :return: Flask-style `jsonify()` object containing the inventory details (with ETag)
             or an error message with HTTP status code 404 if no inventory is found.
+    Notes:
+        - The JSON body is serialized once per inventory version and entity.
     """
-    conn = sqlite3.connect(db_path)
-    cursor = conn.cursor()
+    entry = _load_inventory(entity_id, db_path)
 
-    cursor.execute("""
-        SELECT
-            i.name AS item_name,
-            inv.quantity,
-            IFNULL(p.price, 0) AS price
-        FROM inventory inv
-        JOIN entities e ON inv.entity_id = e.id
-        JOIN items i ON inv.item_id = i.id
-        LEFT JOIN prices p ON p.item_id = i.id
-        WHERE e.id = ?
-    """, (entity_id,))
-
-    rows = cursor.fetchall()
-    conn.close()
-
-    if not rows:
+    if not entry["rows"]:
         return jsonify({"error": "No inventory found for this entity."}), 404
 
-    inventory = []
-    for item_name, quantity, price in rows:
-        inventory.append({
-            "name": item_name,
-            "quantity": quantity,
-            "price": round(price, 2)
-        })
+    body = entry.get("json")
+    if body is None:
+        body = entry["json"] = json.dumps({"entity_id": entity_id, "inventory": entry["items"]})
+    response = Response(body, mimetype="application/json")
+    response.set_etag(inventory_etag(entry["version"]))
+    return response
 
-    return jsonify({"entity_id": entity_id, "inventory": inventory})
\ No newline at end of file
+
+def get_inventories(entity_ids, since=None, db_path=DB_PATH):
+    """
+    Returns the inventories of several entities at once, or only the rows changed since a version.
+    :param entity_ids: (list) Entity ids.
+    :param since: (int, optional) Version the client already has; only rows changed after it are returned.
+    :param db_path: (str, optional) File path to the SQLite database. Defaults to 'inventory/inventory.sqlite3'.
+    :return: (dict) 'version' (pass it as `since` next time), 'since' and 'inventories':
+            entity id (str) -> list of dicts with 'name', 'quantity' and 'price'.
+            With `since`, entities without changes are left out.
+    """
+    version = get_inventory_version(db_path)  # before reading, like _load_inventory()
+    entity_ids = [str(entity_id) for entity_id in dict.fromkeys(entity_ids)]
+    if since is None:
+        inventories = {entity_id: _load_inventory(entity_id, db_path)["items"] for entity_id in entity_ids}
+        return {"version": version, "since": None, "inventories": inventories}
+
+    inventories = {}
+    if since < version and entity_ids:
+        cursor = get_connection(db_path).cursor()
+        cursor.execute(f"""
+            SELECT inv.entity_id, i.name, inv.quantity, IFNULL(p.price, 0)
+            FROM inventory inv
+            JOIN items i ON inv.item_id = i.id
+            LEFT JOIN prices p ON p.item_id = i.id
+            WHERE inv.entity_id IN ({",".join("?" * len(entity_ids))}) AND IFNULL(inv.version, 0) > ?
+        """, [*entity_ids, since])
+        for entity_id, item_name, quantity, price in cursor.fetchall():
+            inventories.setdefault(str(entity_id), []).append(
+                {"name": item_name, "quantity": quantity, "price": round(price, 2)})
+    return {"version": version, "since": since, "inventories": inventories}
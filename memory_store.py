@@ -1,103 +1,106 @@
 #--------------------------------------------------------------------------------------
-# memory_store.py – Handles chat memory, summaries, and trade logging via SQLite and ChromaDB
+# memory_store.py – Handles chat memory, semantic recall and pending trades via SQLite
 #--------------------------------------------------------------------------------------
 
 import os
-import chromadb
-import json
-import sqlite3
-import uuid
 from datetime import datetime
-from openai import OpenAI
 from dotenv import load_dotenv
+from db import DB_PATH, DEFAULT_CONVERSATION_ID, get_connection, transaction
+from metrics import span
+from chat_summaries import schedule_summaries
+from vector_memory import index_new_messages, search_messages
+from memory_writer import write_row, pending_rows, add_commit_listener
+from trade_state import TRADE_TTL, is_trade_pending, propose_trade, reset_trade
 
 
 #--------------------------------------------------------------------------------------
-# Configuration and Clients
+# Configuration
 #--------------------------------------------------------------------------------------
 
 load_dotenv()
-client = OpenAI(api_key=os.getenv("OPENAI_API_KEY"))
-db_path = "inventory/inventory.sqlite3"
+db_path = DB_PATH
 
-# Uncomment this block if ChromaDB is enabled (semantic chat history, still in testing phase)
-"""
-client = chromadb.PersistentClient(path="vectordb")
-collection = client.get_or_create_collection(name="test3")
-"""
+# Semantic recall: results below this similarity are left out, and the newest messages of
+# each role are skipped because the prompt already shows them verbatim
+MEMORY_MIN_SCORE = float(os.getenv("NPC_MEMORY_MIN_SCORE", "0.3"))
+RECALL_SKIP_RECENT = 6
 
 
 #--------------------------------------------------------------------------------------
 # Store messages to chat history
 #--------------------------------------------------------------------------------------
 
-def add_memory(text, role, db_path="inventory/inventory.sqlite3"):
+def add_memory(text, role, conversation_id=DEFAULT_CONVERSATION_ID, db_path=DB_PATH):
     """
     Stores a message from the chat in the SQLite database, along with its role and timestamp.
     :param text: (str) Message content to store.
     :param role: (str) Sender role, typically 'user','assistant' or 'system'.
+    :param conversation_id: (str, optional) Conversation the message belongs to. Defaults to 'default'.
     :param db_path: (str, optional) Path to SQLite database file. Defaults to 'inventory/inventory.sqlite3'.
     :return: None
     Notes:
-        - Optional semantic storage via ChromaDB can be enabled (commented out).
-        - Timestamp is automatically assigned during insertion.
+        - The row is queued and committed with other rows by the memory writer (memory_writer.py)
+          within a few milliseconds; reads in this module and chat_context.py already include it.
+        - Timestamp is automatically assigned when the message is queued.
+        - Once committed, player and NPC messages are embedded into the semantic memory index
+          (vector_memory.py) and queue the conversation for background summarization (chat_summaries.py).
     """
-    # Uncomment this block if ChromaDB is enabled (semantic chat history, still in testing phase)
-    """
-    id = str(uuid.uuid4())
-    collection.add(
-        documents=[text],
-        metadatas=[{"created": str(datetime.now()), "role": f"{role}"}],
-        ids=[id]
-    )
-    """
-    conn = sqlite3.connect(db_path)
-    cursor = conn.cursor()
     timestamp = str(datetime.now())
+    with span("add_memory"):
+        write_row(timestamp, conversation_id, role, text, db_path=db_path)
 
-    try:
-        cursor.execute("""
-            INSERT INTO chat_history (timestamp, role, text)
-            VALUES (?, ?, ?)
-        """, (timestamp, role, text))
-        conn.commit()
-        conn.close()
-    except sqlite3.IntegrityError:
-        print("Error: Sqlite IntegrityError occurred.")
-        
     print(f"{role}: added to memory")
 
 
+def _after_commit(db_path, rows):
+    """
+    Runs on the memory writer thread after chat_history rows were committed.
+    """
+    conversations = {row["conversation_id"] for row in rows if row["role"] in ("user", "assistant")}
+    if conversations:
+        index_new_messages(db_path)
+    for conversation_id in conversations:
+        schedule_summaries(conversation_id, db_path)
+
+
+add_commit_listener(_after_commit)
+
+
 #--------------------------------------------------------------------------------------
 # Retrieve recent chat messages from DataBase
 #--------------------------------------------------------------------------------------
 
-def get_recent_chat_messages(limit=50, db_path="inventory/inventory.sqlite3"):
+def get_recent_chat_messages(limit=50, conversation_id=DEFAULT_CONVERSATION_ID, db_path=DB_PATH):
     """
-    Fetches the most recent chat exchanges between user and assistant,
+    Fetches the most recent chat exchanges between user and assistant of one conversation,
     sorted chronologically for conversational context reconstruction.
     :param limit: (int, optional) Number of chat messages to retrieve. Defaults to 50.
+    :param conversation_id: (str, optional) Conversation to read. Defaults to 'default'.
     :param db_path: (str, optional) Path to SQLite database file. Defaults to 'inventory/inventory.sqlite3'.
     :return: list[dict] | str: List of message dictionaries containing role and content,
             or a message string if no records are found.
     """
-    conn = sqlite3.connect(db_path)
-    cursor = conn.cursor()
+    pending = pending_rows(conversation_id, db_path)  # before the query, see memory_writer.py
+    cursor = get_connection(db_path).cursor()
 
     cursor.execute("""
-        SELECT role, text
+        SELECT id, role, text
         FROM (
-            SELECT role, text, timestamp
+            SELECT id, role, text
             FROM chat_history
-            WHERE role IN ('user', 'assistant') AND TRIM(text) <> ''
-            ORDER BY timestamp DESC
+            WHERE conversation_id = ? AND role IN ('user', 'assistant') AND TRIM(text) <> ''
+            ORDER BY id DESC
             LIMIT ?
         ) AS sub
-        ORDER BY timestamp ASC
-        """, (limit,))
+        ORDER BY id ASC
+        """, (conversation_id, limit))
     
     rows = cursor.fetchall()
-    conn.close()
+    stored_ids = {row[0] for row in rows}
+    rows = [(role, text) for _, role, text in rows]
+    rows += [(row["role"], row["text"]) for row in pending
+             if row["id"] not in stored_ids and row["role"] in ("user", "assistant") and row["text"].strip()]
+    rows = rows[-limit:]
 
     if not rows:
         return "No chat messages found."
@@ -106,199 +109,150 @@ def get_recent_chat_messages(limit=50, db_path="inventory/inventory.sqlite3"):
 
 
 #--------------------------------------------------------------------------------------
-# Status Flag for ongoing Trade
+# Status Flag for ongoing Trade (kept for callers of the old API; see trade_state.py)
 #--------------------------------------------------------------------------------------
 
-def get_status_flag(db_path="inventory/inventory.sqlite3"):
+def get_status_flag(conversation_id=DEFAULT_CONVERSATION_ID, db_path=DB_PATH):
     """
-    Retrieves the current trade status flag from the database.
+    Tells whether a trade of a conversation is waiting for the player's consent.
+    :param conversation_id: (str, optional) Conversation to check. Defaults to 'default'.
     :param db_path: (str, optional) Path to SQLite database file. Defaults to 'inventory/inventory.sqlite3'.
-    :return: bool | str: Returns True if a trade is ongoing (is_active == 1),
-            False if no active trade, or a message string if no flag record is found.
+    :return: bool: True if a trade is ongoing (state 'proposed'), False otherwise.
     """
-    conn = sqlite3.connect(db_path)
-    cursor = conn.cursor()
-
-    try:
-        cursor.execute("""
-                SELECT is_active FROM status_flag WHERE id = 1
-                """)
-    except sqlite3.IntegrityError:
-        print("Error: Sqlite IntegrityError occurred.")
-
-    row = cursor.fetchone()
-    conn.close()
+    return is_trade_pending(conversation_id, db_path)
 
-    if not row:
-        return "No status_flag found."
 
-    is_trade_ongoing = bool(row[0])
-    return is_trade_ongoing
-
-
-def set_status_flag_true(db_path="inventory/inventory.sqlite3"):
+def set_status_flag_true(conversation_id=DEFAULT_CONVERSATION_ID, db_path=DB_PATH):
     """
-    Activates the trade status flag in the database.
+    Marks a trade of a conversation as proposed.
+    :param conversation_id: (str, optional) Conversation to update. Defaults to 'default'.
     :param db_path: (str, optional) Path to SQLite database file. Defaults to 'inventory/inventory.sqlite3'.
     :return: None
     """
-    conn = sqlite3.connect(db_path)
-    cursor = conn.cursor()
+    propose_trade(conversation_id, db_path)
 
-    cursor.execute("""
-            UPDATE status_flag SET is_active = 1 WHERE id = 1
-            """)
-    conn.commit()
-    conn.close()
-    print("Status_flag set to True")
 
-
-def set_status_flag_false(db_path="inventory/inventory.sqlite3"):
+def set_status_flag_false(conversation_id=DEFAULT_CONVERSATION_ID, db_path=DB_PATH):
     """
-    Deactivates the trade status flag in the database.
+    Moves the trade state of a conversation back to idle.
+    :param conversation_id: (str, optional) Conversation to update. Defaults to 'default'.
     :param db_path: (str, optional) Path to SQLite database file. Defaults to 'inventory/inventory.sqlite3'.
     :return: None
     """
-    conn = sqlite3.connect(db_path)
-    cursor = conn.cursor()
-
-    cursor.execute("""
-            UPDATE status_flag SET is_active = 0 WHERE id = 1
-            """)
-    conn.commit()
-    conn.close()
-    print("Status_flag set to False")
+    reset_trade(conversation_id, db_path)
 
 
 #--------------------------------------------------------------------------------------
-# Store and retrieve last trade results for confirmation after tool call parse_trade_intent
+# Store and retrieve the pending trade (open basket) of a conversation for confirmation
+# after tool call parse_trade_intent. Kept in pending_trades / pending_trade_lines, not in chat_history.
 #--------------------------------------------------------------------------------------
 
-def store_trade_results(results, entity_id=1, db_path="inventory/inventory.sqlite3"):
+def store_trade_results(results, entity_id=1, conversation_id=DEFAULT_CONVERSATION_ID, db_path=DB_PATH):
     """
-    Stores parsed trade results in the chat_history table of the database.
-    The results are serialized as JSON and saved as a system message
-    associated with the given entity_id. This is used to log the output
-    of trade parsing operations and enable later retrieval for confirmation.
-    :param results: (list or dict) Parsed trade data, typically a list of trade dicts.
-    :param entity_id: (int) Identifier for the trade entity or user (default is 1).
+    Stores the parsed trade lines of a turn as the open basket of a conversation.
+    An open basket left over from an earlier turn is marked 'replaced'.
+    :param results: (list) Parsed trade dicts with 'trade_state', 'item' and 'quantity'.
+    :param entity_id: (int) Identifier of the NPC the trade is made with (default is 1).
+    :param conversation_id: (str, optional) Conversation the pending trade belongs to. Defaults to 'default'.
     :param db_path: (str, optional) Path to SQLite database file. Defaults to 'inventory/inventory.sqlite3'.
     :return: Confirmation message indicating successful storage.
+    Notes:
+        - Call it once per turn with all lines; the basket expires after NPC_TRADE_TTL seconds.
     """
-    conn = sqlite3.connect(db_path)
-    cursor = conn.cursor()
+    now = datetime.now()
+    with transaction(db_path) as conn:
+        conn.execute("""
+            UPDATE pending_trades SET status = 'replaced', resolved = ?
+            WHERE conversation_id = ? AND entity_id = ? AND status = 'open'
+        """, (str(now), conversation_id, entity_id))
+        cursor = conn.execute("""
+            INSERT INTO pending_trades (conversation_id, entity_id, created, expires_at)
+            VALUES (?, ?, ?, ?)
+        """, (conversation_id, entity_id, str(now), now.timestamp() + TRADE_TTL))
+        conn.executemany("""
+            INSERT INTO pending_trade_lines (trade_id, line_no, trade_state, item, quantity)
+            VALUES (?, ?, ?, ?, ?)
+        """, [(cursor.lastrowid, line_no, result["trade_state"], result["item"], result["quantity"])
+              for line_no, result in enumerate(results)])
 
-    cursor.execute("""
-        INSERT INTO chat_history (timestamp, entity_id, role, text)
-        VALUES (?, ?, ?, ?)
-    """, (datetime.now(), entity_id, "system", json.dumps(results)))
-
-    conn.commit()
-    conn.close()
     return "Results saved."
 
 
-def load_last_trade_results(entity_id=1, db_path="inventory/inventory.sqlite3"):
+def load_last_trade_results(entity_id=1, conversation_id=DEFAULT_CONVERSATION_ID, db_path=DB_PATH):
     """
-    Retrieves the most recent valid trade results from chat_history for a given entity.
-    :param entity_id: (int) Identifier for the trade entity or user (default is 1).
+    Retrieves the lines of the open, not yet expired basket of a conversation.
+    :param entity_id: (int) Identifier of the NPC the trade is made with (default is 1).
+    :param conversation_id: (str, optional) Conversation the pending trade belongs to. Defaults to 'default'.
     :param db_path: db_path: (str, optional) Path to SQLite database file. Defaults to 'inventory/inventory.sqlite3'.
-    :return: (list) Parsed trade results if found, otherwise an empty list.
+    :return: (list) Trade dicts with 'trade_state', 'item' and 'quantity', or an empty list.
     """
-    conn = sqlite3.connect(db_path)
-    cursor = conn.cursor()
-
+    cursor = get_connection(db_path).cursor()
     cursor.execute("""
-        SELECT text FROM chat_history
-        WHERE entity_id = ? AND role = 'system'
-        ORDER BY id DESC LIMIT 10
-    """, (entity_id,))
-    rows = cursor.fetchall()
-    conn.close()
-
-    for (text,) in rows:
-        try:
-            parsed = json.loads(text)
-            if isinstance(parsed, list) and all("trade_state" in r for r in parsed):
-                return parsed
-        except json.JSONDecodeError:
-            continue
-
-    return []
+        SELECT l.trade_state, l.item, l.quantity
+        FROM pending_trades t
+        JOIN pending_trade_lines l ON l.trade_id = t.id
+        WHERE t.conversation_id = ? AND t.entity_id = ? AND t.status = 'open' AND t.expires_at > ?
+        ORDER BY l.line_no
+    """, (conversation_id, entity_id, datetime.now().timestamp()))
 
+    return [{"trade_state": trade_state, "item": item, "quantity": quantity}
+            for trade_state, item, quantity in cursor.fetchall()]
 
-#--------------------------------------------------------------------------------------
-# Summarize chat history in chunks using OpenAI adn format into JSON with summaries
-
-# WORK IN PROGRESS!!
-#--------------------------------------------------------------------------------------
 
-def summarize_chat_history(chat_messages, summary_interval=5):
-    """
-    Summarizes chat messages in chunks of summary_interval.
+def close_pending_trade(status, entity_id=1, conversation_id=DEFAULT_CONVERSATION_ID, db_path=DB_PATH):
     """
-    summaries = []
-    
-    for i in range(0, len(chat_messages), summary_interval):
-        chunk = chat_messages[i:i+summary_interval]
-        texts = "\n".join([msg["content"] for msg in chunk])
-
-        response = client.responses.create(
-            model="gpt-4o",
-            input=[
-                {"role": "system", "content": "Summarize the following conversation. The merchant ('role': 'assistant') is an NPC in a role-playing game and the buyer ('role': 'user') is the player who is talking to the NPC. Consider this in the summary."},
-                {"role": "user", "content": texts}
-            ]
-        )
-        
-        summary = response.output_text
-        summaries.append({"summary": summary, "messages": chunk})
-
-    return summaries
-
-
-def format_chat_history_as_json(limit=20, summary_interval=5):
-    """
-    Returns chat history and summaries as JSON.
+    Closes the open basket of a conversation after the player answered.
+    :param status: (str) 'executed', 'failed' (refused by the inventory) or 'cancelled'.
+    :param entity_id: (int) Identifier of the NPC the trade is made with (default is 1).
+    :param conversation_id: (str, optional) Conversation the pending trade belongs to. Defaults to 'default'.
+    :param db_path: (str, optional) Path to SQLite database file. Defaults to 'inventory/inventory.sqlite3'.
+    :return: (bool) True if an open basket was closed.
     """
-    chat_messages = get_recent_chat_messages(limit)
-    #summarized_messages = summarize_chat_history(chat_messages, summary_interval)
-
-    chat_data = [
-        {"role": "system", "content": "You are a helpful assistant. Here's a summary of the recent conversation."},
-        *chat_messages
-    ]
-
-    return json.dumps(chat_data, indent=2)
+    with transaction(db_path) as conn:
+        cursor = conn.execute("""
+            UPDATE pending_trades SET status = ?, resolved = ?
+            WHERE conversation_id = ? AND entity_id = ? AND status = 'open'
+        """, (status, str(datetime.now()), conversation_id, entity_id))
+    return cursor.rowcount > 0
 
 
 #--------------------------------------------------------------------------------------
-# Retrieve semantic memories from ChromaDB (if enabled)
-
-# WORK IN PROGRESS!!
+# Retrieve semantic memories from the local vector index
 #--------------------------------------------------------------------------------------
 
-def get_memories_from_player(text):
+def get_memories_from_player(text, conversation_id=DEFAULT_CONVERSATION_ID, db_path=DB_PATH):
     """
-    Retrieves 3 most relevant player messages from vector DB.
+    Retrieves the 3 earlier player messages of a conversation most similar to a text.
+    :param text: (str) Text to compare with, usually the current player message.
+    :param conversation_id: (str, optional) Conversation to search. Defaults to 'default'.
+    :param db_path: (str, optional) Path to SQLite database file. Defaults to 'inventory/inventory.sqlite3'.
+    :return: (list[str]) Message texts, most similar first.
     """
-    results = collection.query(
-        query_texts=[text],
-        n_results=3,
-        where={"role": "user"}
-    )
-    return results["documents"][0]
+    return _recall(text, "user", conversation_id, db_path)
 
 
-def get_memories_from_npc(text):
+def get_memories_from_npc(text, conversation_id=DEFAULT_CONVERSATION_ID, db_path=DB_PATH):
     """
-    Retrieves 3 most relevant NPC replies from vector DB.
+    Retrieves the 3 earlier NPC replies of a conversation most similar to a text.
+    :param text: (str) Text to compare with, usually the current player message.
+    :param conversation_id: (str, optional) Conversation to search. Defaults to 'default'.
+    :param db_path: (str, optional) Path to SQLite database file. Defaults to 'inventory/inventory.sqlite3'.
+    :return: (list[str]) Message texts, most similar first.
     """
-    results = collection.query(
-        query_texts=[text],
-        n_results=3,
-        where={"role": "assistant"}
-    )
-    return results["documents"][0]
+    return _recall(text, "assistant", conversation_id, db_path)
+
+
+def _recall(text, role, conversation_id, db_path, k=3):
+    with span("memory_recall"):
+        hits = [(row_id, score) for row_id, score in search_messages(
+            text, k, role=role, conversation_id=conversation_id, skip_recent=RECALL_SKIP_RECENT, db_path=db_path)
+            if score >= MEMORY_MIN_SCORE]
+        if not hits:
+            return []
+        cursor = get_connection(db_path).cursor()
+        cursor.execute(f"SELECT id, text FROM chat_history WHERE id IN ({','.join('?' * len(hits))})",
+                       [row_id for row_id, _ in hits])
+        texts = dict(cursor.fetchall())
+    return [texts[row_id] for row_id, _ in hits if row_id in texts]
 
 
@@ -0,0 +1,209 @@
+#--------------------------------------------------------------------------------------
+# memory_writer.py – Write-behind queue for chat_history rows with group commit
+#--------------------------------------------------------------------------------------
+#
+# add_memory queues its rows here instead of committing one
+# transaction each. A writer thread commits everything queued within FLUSH_INTERVAL (or
+# as soon as FLUSH_ROWS are waiting) in one transaction per database, so concurrent
+# players share commits instead of queueing for SQLite's write lock one row at a time.
+#
+# Reads stay consistent: readers take `pending_rows()` *before* querying chat_history and
+# add the rows the query did not return (the writer sets row["id"] when it inserts a row
+# and removes rows from the queue only after the commit).
+
+import atexit
+import os
+import sqlite3
+import threading
+import time
+from db import DB_PATH, transaction
+from metrics import span
+
+
+#--------------------------------------------------------------------------------------
+# Configuration
+#--------------------------------------------------------------------------------------
+
+WRITE_BEHIND = os.getenv("NPC_MEMORY_WRITE_BEHIND", "1") != "0"
+FLUSH_INTERVAL = float(os.getenv("NPC_MEMORY_FLUSH_MS", "20")) / 1000
+FLUSH_ROWS = int(os.getenv("NPC_MEMORY_FLUSH_ROWS", "256"))
+RETRY_DELAY = 0.5  # seconds before a batch is retried after a database error
+
+_pending = []                         # queued row dicts, oldest first
+_pending_changed = threading.Condition()
+_flush_lock = threading.Lock()        # one batch at a time (writer thread or drain)
+_commit_listeners = []
+_writer = None
+
+
+#--------------------------------------------------------------------------------------
+# Queue rows
+#--------------------------------------------------------------------------------------
+
+def write_row(timestamp, conversation_id, role, text, entity_id=None, db_path=DB_PATH):
+    """
+    Queues one chat_history row for the next group commit (or commits it at once if
+    NPC_MEMORY_WRITE_BEHIND=0).
+    :param timestamp: (str) Time the message was created.
+    :param conversation_id: (str) Conversation the message belongs to.
+    :param role: (str) 'user', 'assistant' or 'system'.
+    :param text: (str) Message content.
+    :param entity_id: (int, optional) Entity the row belongs to.
+    :param db_path: (str, optional) Path to SQLite database file. Defaults to 'inventory/inventory.sqlite3'.
+    :return: (dict) The queued row; its 'id' is set once it is inserted.
+    """
+    row = {"timestamp": timestamp, "conversation_id": conversation_id, "role": role, "text": text,
+           "entity_id": entity_id, "db_path": db_path, "id": None}
+    with _pending_changed:
+        _pending.append(row)
+        if WRITE_BEHIND:
+            _start_writer()
+            _pending_changed.notify_all()
+            return row
+
+    with _flush_lock:
+        written = _write_batch([row])
+    if not written:
+        with _pending_changed:
+            _start_writer()  # retries in the background
+    return row
+
+
+def _start_writer():
+    global _writer
+    if _writer is None:
+        _writer = threading.Thread(target=_work, name="memory-writer", daemon=True)
+        _writer.start()
+
+
+def pending_rows(conversation_id, db_path=DB_PATH):
+    """
+    Returns the queued rows of a conversation that may not be committed yet, oldest first.
+    Call it before querying chat_history and skip rows whose id the query returned.
+    :param conversation_id: (str) Conversation to look up.
+    :param db_path: (str, optional) Path to SQLite database file. Defaults to 'inventory/inventory.sqlite3'.
+    :return: (list[dict]) Row dicts (timestamp, conversation_id, role, text, entity_id, id).
+    """
+    with _pending_changed:
+        return [row for row in _pending if row["conversation_id"] == conversation_id and row["db_path"] == db_path]
+
+
+def add_commit_listener(listener):
+    """
+    Registers a callback run on the writer thread after each commit.
+    :param listener: (callable) `listener(db_path, rows)` with the committed row dicts.
+    :return: None
+    """
+    _commit_listeners.append(listener)
+
+
+def flush(timeout=5.0):
+    """
+    Waits until every row queued before the call is committed.
+    :param timeout: (float, optional) Seconds to wait at most. Defaults to 5.
+    :return: (bool) True if the queue was written in time.
+    """
+    with _pending_changed:
+        waiting = set(map(id, _pending))
+        return _pending_changed.wait_for(lambda: waiting.isdisjoint(map(id, _pending)), timeout)
+
+
+@atexit.register
+def drain():
+    """
+    Writes all queued rows on the calling thread (server shutdown).
+    :return: None
+    """
+    while True:
+        with _pending_changed:
+            batch = list(_pending)
+        if not batch:
+            return
+        # A temporary database (tests, benchmarks) may be gone by now; its rows cannot be written
+        gone = [row for row in batch if not os.path.exists(row["db_path"])]
+        if gone:
+            print(f"Memory writer: dropping {len(gone)} queued rows of deleted databases")  # Debugging
+            _remove(gone)
+            continue
+        with _flush_lock:
+            if not _write_batch(batch):
+                print(f"Memory writer: {len(batch)} queued rows could not be written at shutdown")  # Debugging
+                return
+
+
+#--------------------------------------------------------------------------------------
+# Writer thread
+#--------------------------------------------------------------------------------------
+
+def _work():
+    """
+    Writer loop: waits for the first queued row, gives others FLUSH_INTERVAL to join,
+    then commits the batch.
+    """
+    while True:
+        with _pending_changed:
+            _pending_changed.wait_for(lambda: _pending)
+            deadline = time.monotonic() + FLUSH_INTERVAL
+            _pending_changed.wait_for(lambda: len(_pending) >= FLUSH_ROWS, max(deadline - time.monotonic(), 0))
+            batch = _pending[:FLUSH_ROWS * 4]
+        with _flush_lock:
+            written = _write_batch(batch)
+        if not written:
+            time.sleep(RETRY_DELAY)
+
+
+def _write_batch(batch):
+    """
+    Inserts a batch in one transaction per database and drops the committed rows from the queue.
+    Must be called with _flush_lock held.
+    :return: (bool) False if rows stay queued after a database error.
+    """
+    with _pending_changed:
+        queued = set(map(id, _pending))
+    by_db = {}
+    for row in batch:
+        if id(row) in queued:  # skips rows another flush wrote meanwhile
+            by_db.setdefault(row["db_path"], []).append(row)
+
+    written = True
+    for db_path, rows in by_db.items():
+        try:
+            with span("memory_flush"), transaction(db_path) as conn:
+                for row in rows:
+                    cursor = conn.execute("""
+                        INSERT INTO chat_history (timestamp, entity_id, conversation_id, role, text)
+                        VALUES (?, ?, ?, ?, ?)
+                    """, (row["timestamp"], row["entity_id"], row["conversation_id"], row["role"], row["text"]))
+                    row["id"] = cursor.lastrowid
+        except sqlite3.IntegrityError:
+            for row in rows:
+                row["id"] = None
+            if len(rows) > 1:
+                # Find the offending row: write the others one by one
+                for row in rows:
+                    written = _write_batch([row]) and written
+            else:
+                print("Error: Sqlite IntegrityError occurred.")
+                _remove(rows)
+            continue
+        except sqlite3.Error as e:
+            for row in rows:
+                row["id"] = None
+            print(f"Memory writer: commit of {len(rows)} rows failed, will retry: {e}")  # Debugging
+            written = False
+            continue
+
+        _remove(rows)
+        for listener in _commit_listeners:
+            try:
+                listener(db_path, rows)
+            except Exception as e:
+                print(f"Memory writer: commit listener failed: {e}")  # Debugging
+    return written
+
+
+def _remove(rows):
+    with _pending_changed:
+        done = set(map(id, rows))
+        _pending[:] = [row for row in _pending if id(row) not in done]
+        _pending_changed.notify_all()
@@ -0,0 +1,173 @@
+#--------------------------------------------------------------------------------------
+# metrics.py – Per-stage latency histograms, counters (Prometheus text format) and request traces
+#--------------------------------------------------------------------------------------
+
+import threading
+import time
+import uuid
+from contextlib import contextmanager
+from contextvars import ContextVar
+
+
+#--------------------------------------------------------------------------------------
+# Configuration
+#--------------------------------------------------------------------------------------
+
+# Bucket upper bounds: SQLite steps land in the low duration buckets, model calls in the high ones
+DURATION_BUCKETS = (0.001, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30)
+TOKEN_BUCKETS = (250, 500, 1000, 1500, 2000, 3000, 4000, 6000, 8000, 16000)
+
+# name -> (help text, label name, bucket bounds)
+HISTOGRAMS = {
+    "npc_stage_duration_seconds": ("Duration of one stage of a chat turn or speech job.", "stage", DURATION_BUCKETS),
+    "npc_request_duration_seconds": ("Duration of an HTTP request, by endpoint.", "endpoint", DURATION_BUCKETS),
+    "npc_llm_input_tokens": ("Input tokens of a model call, as reported by the API.", "call", TOKEN_BUCKETS),
+}
+
+# name -> (help text, label name); totals that only ever increase
+COUNTERS = {
+    "npc_response_cache_lookups_total": ("Response cache lookups, by result (hit, similar, miss).", "result"),
+    "npc_response_cache_saved_seconds_total": ("Model latency saved by response cache hits (estimated).", "npc"),
+}
+
+_histograms = {name: {} for name in HISTOGRAMS}  # name -> label value -> [bucket counts, sum, count]
+_counters = {name: {} for name in COUNTERS}      # name -> label value -> total
+_lock = threading.Lock()
+
+# Spans of the current request: (trace id, list of (stage, milliseconds)), or None outside a trace
+_trace = ContextVar("npc_trace", default=None)
+
+
+#--------------------------------------------------------------------------------------
+# Recording
+#--------------------------------------------------------------------------------------
+
+def observe(name, label, value):
+    """
+    Adds one observation to a histogram.
+    :param name: (str) Histogram name from HISTOGRAMS.
+    :param label: (str) Value of the histogram's label (stage, endpoint or call).
+    :param value: (float) Measured duration in seconds, or token count.
+    :return: None
+    """
+    buckets = HISTOGRAMS[name][2]
+    with _lock:
+        series = _histograms[name].get(label)
+        if series is None:
+            series = _histograms[name][label] = [[0] * len(buckets), 0.0, 0]
+        for i, bound in enumerate(buckets):
+            if value <= bound:
+                series[0][i] += 1
+        series[1] += value
+        series[2] += 1
+
+
+def increment(name, label, amount=1):
+    """
+    Adds to a counter.
+    :param name: (str) Counter name from COUNTERS.
+    :param label: (str) Value of the counter's label.
+    :param amount: (float, optional) Non-negative amount to add. Defaults to 1.
+    :return: None
+    """
+    with _lock:
+        _counters[name][label] = _counters[name].get(label, 0) + amount
+
+
+@contextmanager
+def span(stage):
+    """
+    Times the enclosed block as one stage: recorded in npc_stage_duration_seconds and,
+    inside a trace, in the trace of the current request.
+    :param stage: (str) Stage name, e.g. 'prompt_build' or 'llm_response'.
+    """
+    start = time.perf_counter()
+    try:
+        yield
+    finally:
+        seconds = time.perf_counter() - start
+        observe("npc_stage_duration_seconds", stage, seconds)
+        trace = _trace.get()
+        if trace is not None:
+            trace[1].append((stage, seconds * 1000))
+
+
+def record_input_tokens(call, response):
+    """
+    Records the input tokens of a Responses API call, if the response reports usage.
+    :param call: (str) Which call of the turn, e.g. 'llm_response' or 'llm_followup'.
+    :param response: Response object returned by `responses.create()`.
+    :return: (int | None) Input tokens, or None if unknown.
+    """
+    usage = getattr(response, "usage", None)
+    input_tokens = getattr(usage, "input_tokens", None)
+    if input_tokens is not None:
+        observe("npc_llm_input_tokens", call, input_tokens)
+    return input_tokens
+
+
+def start_trace():
+    """
+    Starts collecting the spans of the current request (thread or asyncio task).
+    Worker threads started with `asyncio.to_thread()` share the trace.
+    :return: (str) Trace id.
+    """
+    trace_id = uuid.uuid4().hex
+    _trace.set((trace_id, []))
+    return trace_id
+
+
+def end_trace():
+    """
+    Stops the current trace.
+    :return: (tuple | None) (trace id, list of (stage, milliseconds)), or None if no trace was active.
+    """
+    trace = _trace.get()
+    _trace.set(None)
+    return trace
+
+
+def server_timing(spans):
+    """
+    Formats trace spans as a 'Server-Timing' header value (shown by browser dev tools).
+    Repeated stages are numbered: llm_response, llm_response_2, ...
+    :param spans: (list) (stage, milliseconds) pairs from `end_trace()`.
+    :return: (str) Header value.
+    """
+    seen = {}
+    entries = []
+    for stage, ms in spans:
+        seen[stage] = seen.get(stage, 0) + 1
+        name = stage if seen[stage] == 1 else f"{stage}_{seen[stage]}"
+        entries.append(f"{name};dur={ms:.1f}")
+    return ", ".join(entries)
+
+
+#--------------------------------------------------------------------------------------
+# Export
+#--------------------------------------------------------------------------------------
+
+def render_metrics():
+    """
+    Renders all histograms and counters in the Prometheus text exposition format.
+    :return: (str) Body for GET /metrics.
+    Notes:
+        - Values are per process; with several server processes, scrape each of them.
+    """
+    lines = []
+    with _lock:
+        for name, (help_text, label_name, bounds) in HISTOGRAMS.items():
+            lines.append(f"# HELP {name} {help_text}")
+            lines.append(f"# TYPE {name} histogram")
+            for label, (buckets, total, count) in sorted(_histograms[name].items()):
+                for bound, bucket_count in zip(bounds, buckets):
+                    lines.append(f'{name}_bucket{{{label_name}="{label}",le="{bound}"}} {bucket_count}')
+                lines.append(f'{name}_bucket{{{label_name}="{label}",le="+Inf"}} {count}')
+                lines.append(f'{name}_sum{{{label_name}="{label}"}} {total:.6f}')
+                lines.append(f'{name}_count{{{label_name}="{label}"}} {count}')
+        for name, (help_text, label_name) in COUNTERS.items():
+            lines.append(f"# HELP {name} {help_text}")
+            lines.append(f"# TYPE {name} counter")
+            for label, total in sorted(_counters[name].items()):
+                lines.append(f'{name}{{{label_name}="{label}"}} {total:g}')
+    return "\n".join(lines) + "\n"
@@ -3,9 +3,17 @@
 #--------------------------------------------------------------------------------------
 
 import re
+from functools import partial
 from typing import List, Dict
-from inventory_store import get_all_items, get_entity_name, get_entity_role
-from memory_store import format_chat_history_as_json, get_recent_chat_messages
+from inventory_store import get_all_items, get_entity_name, get_entity_role, get_item_catalog, item_key
+from memory_store import get_recent_chat_messages, get_memories_from_player, get_memories_from_npc
+from chat_context import build_chat_context, render_turn
+from chat_summaries import build_conversation_context
+from db import DB_PATH, DEFAULT_CONVERSATION_ID
+
+# Token budgets of the chat history block in the turn prompt and in the short follow-up prompts
+PROMPT_HISTORY_TOKENS = 1200
+CONSENT_HISTORY_TOKENS = 250
 
 
 #--------------------------------------------------------------------------------------
@@ -41,7 +49,7 @@ def build_instructions(id=1): #can be changed to serve multiple NPC
 # Build initial prompt using chat history and inventory
 #--------------------------------------------------------------------------------------
 
-def build_prompt(player_input):
+def build_prompt(player_input, conversation_id=DEFAULT_CONVERSATION_ID, chat_history=None, inventory=None, memories=None):
     """
     Creates a dynamic prompt that includes recent chat history and current NPC inventory.
     This prompt establishes context for the NPC's response by:
@@ -49,25 +57,21 @@ def build_prompt(player_input):
     - Listing available items for trade
     - Embedding behavioral goals and tool usage instructions
     :param player_input: (str) The latest player message to be addressed.
+    :param conversation_id: (str, optional) Conversation whose history is used. Defaults to 'default'.
+    :param chat_history: (str, optional) Preloaded chat history block (see `prompt_context_loaders()`).
+    :param inventory: (str, optional) Preloaded NPC inventory text.
+    :param memories: (str, optional) Preloaded recall block (see `build_memory_block()`).
     :return: (str) Fully formatted prompt string for LLM input.
     """
-
-    # Uncomment this block if ChromaDB is enabled (semantic chat history, still in testing phase)
-    """
-    memories_player = get_memories_from_player(player_input)
-    memories_npc = get_memories_from_npc(player_input)
-
-    formatted_memories_player = "\n".join(f"- {m}" for m in memories_player)
-    formatted_memories_npc = "\n".join(f"- {m}" for m in memories_npc)
-    """
-
-    chat_history_json = format_chat_history_as_json(limit=50)
-    inventory_npc = get_all_items(1) # id hardcoded for now, will be changed to dynamic later
+    memories_text = memories if memories is not None else build_memory_block(player_input, conversation_id)
+    chat_history_text = chat_history if chat_history is not None else \
+        build_conversation_context(conversation_id, PROMPT_HISTORY_TOKENS)
+    inventory_npc = inventory if inventory is not None else get_all_items(1) # id hardcoded for now, will be changed to dynamic later
 
     prompt = f"""
-        This is your latest chat history with the player. Use this as memory and for context.
-        {chat_history_json}
-
+        This is your latest chat history with the player ('You' are your own replies). Use this as memory and for context.
+        {chat_history_text}
+        {memories_text}
         These are the items you currently have to sell:
         {inventory_npc}
 
@@ -89,20 +93,39 @@ def build_prompt(player_input):
     return prompt.strip()
 
 
+def build_memory_block(player_input, conversation_id=DEFAULT_CONVERSATION_ID):
+    """
+    Recalls earlier messages of the conversation that are similar to the player's message
+    (local vector index, see vector_memory.py).
+    :param player_input: (str) The latest player message.
+    :param conversation_id: (str, optional) Conversation to search. Defaults to 'default'.
+    :return: (str) Prompt section with the recalled lines, or '' if nothing relevant was found.
+    """
+    memories_player = get_memories_from_player(player_input, conversation_id)
+    memories_npc = get_memories_from_npc(player_input, conversation_id)
+    if not memories_player and not memories_npc:
+        return ""
+
+    lines = [f"- {render_turn('user', m)}" for m in memories_player]
+    lines += [f"- {render_turn('assistant', m)}" for m in memories_npc]
+    return "Earlier things said in this conversation that may matter now:\n" + "\n".join(lines) + "\n"
+
+
 #--------------------------------------------------------------------------------------
 # Build follow-up confirmation prompts after a trade tool call
 #--------------------------------------------------------------------------------------
 
-def build_followup_prompt(buy_items, sell_items):
+def build_followup_prompt(buy_items, sell_items, conversation_id=DEFAULT_CONVERSATION_ID):
     """
     Generates a follow-up prompt to confirm player trade intentions after parsing.
     The prompt adapts its confirmation questions based on the parsed buy/sell data
     and uses recent chat history for contextual awareness.
     :param buy_items: (list or str) Items the player intends to buy.
     :param sell_items: (list or str) Items the player intends to sell.
+    :param conversation_id: (str, optional) Conversation whose history is used. Defaults to 'default'.
     :return: (str) Prompt asking the player to confirm or revise the intended trade.
     """
-    chat_history_followup_json = format_chat_history_as_json(limit=6)
+    chat_history_followup = build_chat_context(conversation_id, CONSENT_HISTORY_TOKENS)
 
     prompt = f"""
         The player has expressed an intent to buy {buy_items} and sell {sell_items}.
@@ -110,7 +133,7 @@ def build_followup_prompt(buy_items, sell_items):
         If both are empty, do not ask for confirmation. If there are many items, ask for confirmation for each item.
 
         This is the recent conversation with the player. Use it to determine the context about what the player asked for.
-        {chat_history_followup_json}
+        {chat_history_followup}
 
         Make sure to:
         - Ask the question clearly, such as: 'Are you sure you want to buy 5 apples and sell 2 swords? Let's make a deal!'
@@ -118,7 +141,7 @@ def build_followup_prompt(buy_items, sell_items):
     return prompt.strip()
 
 
-def build_consent_or_reintent_prompt(player_input):
+def build_consent_or_reintent_prompt(player_input, conversation_id=DEFAULT_CONVERSATION_ID, chat_history=None):
     """
     Constructs a prompt to determine the appropriate system action based on the player's latest message.
     The decision tree enables the model to:
@@ -126,9 +149,12 @@ def build_consent_or_reintent_prompt(player_input):
     - Parse new trade intents via 'parse_trade_intent'
     - Ignore tool calls if the message is off-topic
     :param player_input: (str) The latest message from the player.
+    :param conversation_id: (str, optional) Conversation whose history is used. Defaults to 'default'.
+    :param chat_history: (str, optional) Preloaded chat history block (see `prompt_context_loaders()`).
     :return: (str) Contextual prompt guiding model behavior.
     """
-    chat_history = format_chat_history_as_json(limit=6)
+    if chat_history is None:
+        chat_history = build_chat_context(conversation_id, CONSENT_HISTORY_TOKENS)
 
     prompt = f"""
     This is your recent chat history with the player. Use it to understand the current intent and conversational flow.
@@ -146,51 +172,152 @@ def build_consent_or_reintent_prompt(player_input):
     return prompt.strip()
 
 
+#--------------------------------------------------------------------------------------
+# Independent reads behind a turn prompt, so async callers can run them concurrently
+#--------------------------------------------------------------------------------------
+
+def prompt_context_loaders(conversation_id=DEFAULT_CONVERSATION_ID, trade_ongoing=False, player_input=""):
+    """
+    Lists the database reads a turn needs before the model call. They do not depend on each
+    other, so they can run in parallel; the results are passed on as keyword arguments.
+    :param conversation_id: (str, optional) Conversation whose history is used. Defaults to 'default'.
+    :param trade_ongoing: (bool, optional) True if a trade is pending (consent/re-intent prompt).
+    :param player_input: (str, optional) The latest player message, used for semantic recall.
+    :return: (dict) Name -> zero-argument callable. 'instructions' is the system prompt; the other
+            entries are keyword arguments for `build_prompt()` or `build_consent_or_reintent_prompt()`.
+    """
+    if trade_ongoing:
+        return {
+            "instructions": build_instructions,
+            "chat_history": partial(build_chat_context, conversation_id, CONSENT_HISTORY_TOKENS),
+        }
+    return {
+        "instructions": build_instructions,
+        "chat_history": partial(build_conversation_context, conversation_id, PROMPT_HISTORY_TOKENS),
+        "inventory": partial(get_all_items, 1),
+        "memories": partial(build_memory_block, player_input, conversation_id),
+    }
+
+
 #--------------------------------------------------------------------------------------
 # Infer trade intent heuristically from recent chat messages (still in testing phase)
+# All catalog names are compiled into one regex per catalog version (trades keep it): the alternation is
+# built from a prefix tree ("apple|apricot" -> "ap(?:ple|ricot)"), so a scan does not get
+# slower with every item added. Message words are singularized like the catalog keys.
 
 #  WORK IN PROGRESS!!
 #--------------------------------------------------------------------------------------
 
-def infer_trade_items(inventory: Dict[str, int]) -> Dict[str, int]:
+# Quantity words in singularized form; None means "as many as there are"
+NUMBER_WORDS = {
+    "a": 1, "an": 1, "one": 1, "single": 1, "two": 2, "couple": 2, "a couple": 2, "pair": 2, "a pair": 2,
+    "three": 3, "four": 4, "five": 5, "six": 6, "half a dozen": 6, "seven": 7, "eight": 8, "nine": 9,
+    "ten": 10, "eleven": 11, "twelve": 12, "dozen": 12, "a dozen": 12, "thirteen": 13, "fourteen": 14,
+    "fifteen": 15, "sixteen": 16, "seventeen": 17, "eighteen": 18, "nineteen": 19, "twenty": 20,
+    "thirty": 30, "forty": 40, "fifty": 50, "hundred": 100, "a hundred": 100,
+    "all": None, "all of": None, "every": None,
+}
+EVERYTHING_WORDS = ("all", "everything", "whatever")
+_matchers = {}  # db_path -> {"version", "regex", "items"}
+
+
+def _alternation(words):
     """
-    Tries to infer desired trade items and quantities based on recent chat input.
-    Only returns items found in inventory.
+    Builds a regex matching any of the words, as a prefix tree so shared prefixes are tested once.
+    Longer words are preferred over their prefixes ("bottle of rum" over "bottle").
     """
-    chat_history = get_recent_chat_messages(limit=2)
-    inferred = {}
+    trie = {}
+    for word in words:
+        node = trie
+        for char in word:
+            node = node.setdefault(char, {})
+        node[""] = {}
 
-    # Use the last relevant sentence
-    lines = [line.strip().lower() for line in chat_history.strip().splitlines() if line.strip()]
-    if not lines:
-        return {}
+    def walk(node):
+        branches = [re.escape(char) + walk(child) for char, child in sorted(node.items()) if char]
+        if not branches:
+            return ""
+        pattern = branches[0] if len(branches) == 1 else "(?:" + "|".join(branches) + ")"
+        return f"(?:{pattern})?" if "" in node else pattern
 
-    last_player_line = ""
-    for line in reversed(lines):
-        if line.startswith("user:") or line.startswith("assistant:"):
-            last_player_line = line.split(":", 1)[-1].strip()
-            print(f"This is last PlayerLine: {last_player_line}")
-            break
+    return walk(trie)
 
-    # Keywords like "all", "everything", "some"
-    if any(word in last_player_line for word in ["all", "everything", "whatever"]):
-        return {item: quantity for item, quantity in inventory.items() if quantity > 0}
 
-    # Looking for quantities and items
-    for item in inventory:
-        # Allow variants like "5 apples", "five apples", "give me 2 apples"
-        pattern = rf"(\\d+)\\s+{item}"
-        match = re.search(pattern, last_player_line)
-        if match:
-            quantity = int(match.group(1))
-            available_quantity = inventory[item]
-            inferred[item] = min(quantity, available_quantity)
-
-    # If quantity is unclear but item is matched -> offer max item
-    if not inferred:
-        for item in inventory:
-            if item in last_player_line and inventory[item] > 0:
-                inferred[item] = inventory[item]
+def get_item_matcher(db_path=DB_PATH):
+    """
+    Returns the compiled item matcher, rebuilt when the item catalog changed.
+    :param db_path: (str, optional) Path to SQLite database file. Defaults to 'inventory/inventory.sqlite3'.
+    :return: (dict) 'version', compiled 'regex' and 'items' (catalog key -> item name).
+    """
+    catalog = get_item_catalog(db_path)
+    matcher = _matchers.get(db_path)
+    if matcher is not None and matcher["version"] == catalog["version"]:
+        return matcher
+
+    items = {key: catalog["items"][item_id] for key, item_id in catalog["keys"].items() if key}
+    quantity = "|".join(re.escape(word) for word in sorted(NUMBER_WORDS, key=len, reverse=True))
+    # Words are separated by single spaces after normalization, so (?<!\S)/(?!\S) are word boundaries
+    regex = re.compile(
+        rf"(?<!\S)(?:(?P<quantity>\d+|{quantity}) (?:of )?(?:(?:the|my|your|ye|yer|those|these) )?)?"
+        rf"(?P<item>{_alternation(items) or '(?!)'})(?!\S)"
+        rf"|(?<!\S)(?P<everything>{'|'.join(EVERYTHING_WORDS)})(?!\S)"
+    )
+    matcher = {"version": catalog["version"], "regex": regex, "items": items}
+    _matchers[db_path] = matcher
+    return matcher
+
+
+def match_trade_items(message, db_path=DB_PATH):
+    """
+    Finds the items a message mentions, with the quantity in front of each, in one scan.
+    :param message: (str) Player message.
+    :param db_path: (str, optional) Path to SQLite database file. Defaults to 'inventory/inventory.sqlite3'.
+    :return: (tuple) List of (item name, quantity) in message order, quantity None if not given
+            or "all"; and True if the message asks for everything.
+    """
+    matcher = get_item_matcher(db_path)
+    text = " ".join(filter(None, (item_key(word) for word in message.split())))
+    found, everything = [], False
+    for match in matcher["regex"].finditer(text):
+        if match.group("everything"):
+            everything = True
+            continue
+        quantity = match.group("quantity")
+        if quantity is not None:
+            quantity = int(quantity) if quantity.isdigit() else NUMBER_WORDS[quantity]
+        found.append((matcher["items"][match.group("item")], quantity))
+    return found, everything
+
+
+def infer_trade_items(inventory: Dict[str, int], player_message: str = None,
+                      conversation_id=DEFAULT_CONVERSATION_ID, db_path=DB_PATH) -> Dict[str, int]:
+    """
+    Tries to infer desired trade items and quantities based on recent chat input.
+    Only returns items found in inventory.
+    :param inventory: (dict) Item name as stored (see `get_inventory_items()`) -> available quantity.
+    :param player_message: (str, optional) Message to read; defaults to the last player message of the conversation.
+    :param conversation_id: (str, optional) Conversation to read the last player message from. Defaults to 'default'.
+    :param db_path: (str, optional) Path to SQLite database file. Defaults to 'inventory/inventory.sqlite3'.
+    :return: (dict) Item name -> quantity, capped at the available quantity.
+    """
+    if player_message is None:
+        chat_history = get_recent_chat_messages(limit=2, conversation_id=conversation_id, db_path=db_path)
+        if not isinstance(chat_history, list):
+            return {}
+        player_message = next((message["content"] for message in reversed(chat_history)
+                               if message["role"] == "user"), "")
+        print(f"This is last PlayerLine: {player_message}")  # Debugging
+
+    found, everything = match_trade_items(player_message, db_path)
+
+    # Keywords like "all", "everything", "whatever"
+    if everything and not found:
+        return {item: quantity for item, quantity in inventory.items() if quantity > 0}
 
+    inferred = {}
+    for item_name, quantity in found:
+        if inventory.get(item_name, 0) <= 0:
+            continue
+        # If quantity is unclear but item is matched -> offer max item
+        inferred[item_name] = inventory[item_name] if quantity is None else min(quantity, inventory[item_name])
     return inferred
-
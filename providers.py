@@ -0,0 +1,52 @@
+#--------------------------------------------------------------------------------------
+# providers.py – Selects the LLM/TTS client (OpenAI or the offline fake) for all modules
+#--------------------------------------------------------------------------------------
+
+import os
+from dotenv import load_dotenv
+from openai import OpenAI, AsyncOpenAI
+from fake_openai import FakeOpenAI, FakeAsyncOpenAI
+
+
+#--------------------------------------------------------------------------------------
+# Configuration
+#--------------------------------------------------------------------------------------
+
+load_dotenv()
+
+# name -> (blocking client class, async client class); both take api_key=...
+PROVIDERS = {
+    "openai": (OpenAI, AsyncOpenAI),
+    "fake": (FakeOpenAI, FakeAsyncOpenAI),
+}
+
+
+def register_provider(name, client_class, async_client_class):
+    """
+    Adds a provider that can then be selected with NPC_LLM_PROVIDER=<name>.
+    :param name: (str) Provider name.
+    :param client_class: Class with the OpenAI client interface used by app.py and chat_summaries.py.
+    :param async_client_class: Its async counterpart, used by asgi_app.py.
+    :return: None
+    """
+    PROVIDERS[name] = (client_class, async_client_class)
+
+
+def provider_name():
+    """
+    :return: (str) Provider configured by NPC_LLM_PROVIDER, default 'openai'.
+    """
+    return os.getenv("NPC_LLM_PROVIDER", "openai")
+
+
+def create_client(async_client=False):
+    """
+    Builds the LLM/TTS client of the configured provider.
+    :param async_client: (bool, optional) Return the async client instead. Defaults to False.
+    :return: Client instance (OpenAI, AsyncOpenAI, or a registered stand-in).
+    """
+    name = provider_name()
+    if name not in PROVIDERS:
+        raise ValueError(f"Unknown NPC_LLM_PROVIDER '{name}', expected one of {sorted(PROVIDERS)}")
+    client_class = PROVIDERS[name][1 if async_client else 0]
+    return client_class(api_key=os.getenv("OPENAI_API_KEY"))
@@ -0,0 +1,233 @@
+#--------------------------------------------------------------------------------------
+# response_cache.py – In-memory cache of model replies to repeated player questions
+#--------------------------------------------------------------------------------------
+#
+# "What do you sell?" or "how much is rum?" get the same answer as long as the NPC's stock
+# does not change. A reply is reused for the same normalized question to the same NPC at
+# the same inventory version. Every trade or new item bumps the version, and with it every
+# key, so old stock or prices are never served. Optionally, near-duplicates ("what do ye
+# sell") are found by embedding similarity. Only questions that mention the same items
+# are compared.
+# Prompts carry the conversation's history, summary and recalled memories, so a reply is
+# only shared between conversations if it was generated without them: for the opening
+# message of a conversation. Replies to later messages are reused within their own
+# conversation only.
+# Only standalone questions are cached. Messages whose answer depends on earlier turns are
+# left to the model: bare consent replies ("yes"), quantities ("2 apples"), trade requests
+# ("I'll take the rum"), back-references ("how much is it?", "what about bananas?") and
+# very short replies. Also never cached: replies with tool calls and turns with a pending trade.
+
+import os
+import re
+import threading
+import time
+from collections import OrderedDict
+from consent_classifier import classify_consent, normalize_message
+from db import DB_PATH, DEFAULT_CONVERSATION_ID
+from inventory_store import get_inventory_version
+from memory_store import get_recent_chat_messages
+from metrics import increment
+from prompt_generator import match_trade_items
+from vector_memory import EMBEDDER, EMBEDDERS
+
+
+#--------------------------------------------------------------------------------------
+# Configuration
+#--------------------------------------------------------------------------------------
+
+RESPONSE_CACHE_ENABLED = os.getenv("NPC_RESPONSE_CACHE", "1") != "0"
+RESPONSE_CACHE_SIZE = int(os.getenv("NPC_RESPONSE_CACHE_SIZE", "1000"))
+RESPONSE_CACHE_TTL = float(os.getenv("NPC_RESPONSE_CACHE_TTL", "600"))
+# Minimum cosine similarity for reusing the reply to a similar question (e.g. 0.9); 0 = exact matches only
+RESPONSE_CACHE_SIMILARITY = float(os.getenv("NPC_RESPONSE_CACHE_SIMILARITY", "0"))
+
+# Questions shorter than this ("why?", "rum?") usually continue the previous turn
+MIN_QUESTION_WORDS = 3
+# Messages that refer back to the conversation or continue it; matched on normalized text
+FOLLOWUP_WORDS = re.compile(
+    r"\d|^(and|but|so|then|also|or)\b|\b(it|its|that|thats|those|them|they|theyre|this|these|one|ones|"
+    r"more|another|other|else|instead|same|again|too|what about|how about)\b"
+)
+# First-person trade requests ("can I buy rum", "I'll take it", "sell me a sword")
+TRADE_REQUEST = re.compile(
+    r"\b(i|ill|id|im|ive|we|me|my|us|our)\b.*\b(buy|sell|trade|take|want|need|give|get|pay|offer|afford)\b"
+    r"|\b(give|sell|show) me\b|\bdeal\b"
+)
+
+_entries = OrderedDict()  # key -> {"text", "vector", "expires_at"}, least recently used first
+_groups = {}              # key[:5] (db, npc, version, conversation, items) -> keys searched for near-duplicates
+_latest_versions = {}     # db_path -> newest inventory version stored
+_stats = {"hits": 0, "similar_hits": 0, "misses": 0, "stores": 0, "rejected": 0, "evictions": 0,
+          "model_calls": 0, "model_ms_total": 0.0, "saved_ms_total": 0.0}
+_lock = threading.Lock()
+
+
+#--------------------------------------------------------------------------------------
+# Cache keys and lookups
+#--------------------------------------------------------------------------------------
+
+def response_cache_key(player_message, npc_id=1, conversation_id=DEFAULT_CONVERSATION_ID, db_path=DB_PATH):
+    """
+    Builds the cache key of a player message: NPC, inventory version, conversation scope,
+    mentioned items and normalized text.
+    :param player_message: (str) Latest message of the player, already added to the chat history.
+    :param npc_id: (int, optional) NPC the player talks to. Defaults to 1.
+    :param conversation_id: (str, optional) Conversation of the message. Defaults to 'default'.
+    :param db_path: (str, optional) Path to SQLite database file. Defaults to 'inventory/inventory.sqlite3'.
+    :return: (tuple | None) Key for `get_cached_response()` and `store_cached_response()`,
+            or None if the cache is off or the message must not be answered from it.
+    Notes:
+        - Only standalone questions get a key; follow-ups and trade requests return None
+          (see MIN_QUESTION_WORDS, FOLLOWUP_WORDS and TRADE_REQUEST).
+        - The opening message of a conversation gets a key shared by all conversations (its prompt
+          has no history, summary or recalled memories); later messages a key of their conversation.
+    """
+    if not RESPONSE_CACHE_ENABLED:
+        return None
+    text = normalize_message(player_message or "")
+    if (len(text.split()) < MIN_QUESTION_WORDS or classify_consent(text)[0]
+            or FOLLOWUP_WORDS.search(text) or TRADE_REQUEST.search(text)):
+        return None
+    found, everything = match_trade_items(text, db_path)
+    if everything or any(quantity is not None for _, quantity in found):
+        return None  # "all the rum", "a dozen apples"
+    history = get_recent_chat_messages(limit=2, conversation_id=conversation_id, db_path=db_path)
+    scope = None if not isinstance(history, list) or len(history) <= 1 else conversation_id
+    return db_path, npc_id, get_inventory_version(db_path), scope, frozenset(name for name, _ in found), text
+
+
+def get_cached_response(key):
+    """
+    Looks up the reply to a question, first exactly, then (if enabled) by similarity.
+    :param key: (tuple | None) Key from `response_cache_key()`.
+    :return: (str | None) Cached NPC text, or None on a miss.
+    Notes:
+        - Saved latency of a hit is estimated from the average of the model calls seen so far.
+    """
+    if key is None:
+        return None
+    started = time.perf_counter()
+    now = time.time()
+    with _lock:
+        entry = _entries.get(key)
+        if entry is not None and entry["expires_at"] <= now:
+            _remove(key)
+            entry = None
+        result = "hit"
+
+    if entry is None and RESPONSE_CACHE_SIMILARITY > 0:
+        query = _embed(key[5])
+        with _lock:
+            entry = _most_similar(key, query, now)
+        result = "similar"
+
+    with _lock:
+        if entry is None:
+            _stats["misses"] += 1
+            increment("npc_response_cache_lookups_total", "miss")
+            return None
+        if entry["key"] in _entries:
+            _entries.move_to_end(entry["key"])
+        _stats["hits" if result == "hit" else "similar_hits"] += 1
+        saved_ms = 0.0
+        if _stats["model_calls"]:
+            saved_ms = max(_stats["model_ms_total"] / _stats["model_calls"] - (time.perf_counter() - started) * 1000, 0.0)
+            _stats["saved_ms_total"] += saved_ms
+    increment("npc_response_cache_lookups_total", result)
+    increment("npc_response_cache_saved_seconds_total", str(key[1]), saved_ms / 1000)
+    print(f"\033[96mResponse cache: {result} for '{key[5]}', saved ~{saved_ms:.0f} ms\033[0m")  # Debugging
+    return entry["text"]
+
+
+def store_cached_response(key, response, model_seconds):
+    """
+    Stores the model reply to a question, unless it contains tool calls or no text.
+    :param key: (tuple | None) Key from `response_cache_key()`, built before the model call.
+    :param response: Response object returned by `responses.create()`.
+    :param model_seconds: (float) Duration of the model call, for the saved latency estimate.
+    :return: (bool) True if the reply was stored.
+    """
+    if key is None:
+        return False
+    text = getattr(response, "output_text", None) or ""
+    tool_calls = [item for item in getattr(response, "output", None) or [] if getattr(item, "type", None) == "function_call"]
+    with _lock:
+        _stats["model_calls"] += 1
+        _stats["model_ms_total"] += model_seconds * 1000
+        if tool_calls or not text.strip():
+            _stats["rejected"] += 1
+            return False
+
+    vector = _embed(key[5]) if RESPONSE_CACHE_SIMILARITY > 0 else None
+    db_path, version = key[0], key[2]
+    with _lock:
+        latest = _latest_versions.get(db_path, version)
+        if version < latest:
+            return False  # the inventory changed during the model call
+        if version > latest:
+            # Keys of older versions can never be looked up again
+            for old_key in [k for k in _entries if k[0] == db_path and k[2] < version]:
+                _remove(old_key)
+        _latest_versions[db_path] = version
+
+        _entries[key] = {"key": key, "text": text, "vector": vector, "expires_at": time.time() + RESPONSE_CACHE_TTL}
+        _entries.move_to_end(key)
+        _groups.setdefault(key[:5], set()).add(key)
+        _stats["stores"] += 1
+        while len(_entries) > RESPONSE_CACHE_SIZE:
+            _remove(next(iter(_entries)))
+            _stats["evictions"] += 1
+    return True
+
+
+def response_cache_stats():
+    """
+    Returns hit/miss counters, saved latency and the size of the response cache of this process.
+    :return: (dict) Counters plus 'hit_rate', 'avg_model_ms', 'entries' and 'max_entries'.
+    """
+    with _lock:
+        lookups = _stats["hits"] + _stats["similar_hits"] + _stats["misses"]
+        calls = _stats["model_calls"]
+        return {
+            **_stats,
+            "hit_rate": (_stats["hits"] + _stats["similar_hits"]) / lookups if lookups else 0.0,
+            "avg_model_ms": _stats["model_ms_total"] / calls if calls else 0.0,
+            "entries": len(_entries),
+            "max_entries": RESPONSE_CACHE_SIZE,
+        }
+
+
+#--------------------------------------------------------------------------------------
+# Internal helpers (callers hold _lock)
+#--------------------------------------------------------------------------------------
+
+def _embed(text):
+    return EMBEDDERS[EMBEDDER][0](text)
+
+
+def _remove(key):
+    _entries.pop(key, None)
+    group = _groups.get(key[:5])
+    if group is not None:
+        group.discard(key)
+        if not group:
+            del _groups[key[:5]]
+
+
+def _most_similar(key, query, now):
+    """
+    Finds the most similar stored question with the same NPC, inventory version, conversation scope and items.
+    :return: (dict | None) Its entry if the similarity reaches RESPONSE_CACHE_SIMILARITY.
+    """
+    best, best_score = None, RESPONSE_CACHE_SIMILARITY
+    for other in list(_groups.get(key[:5], ())):
+        entry = _entries[other]
+        if entry["expires_at"] <= now:
+            _remove(other)
+            continue
+        if entry["vector"] is None:
+            continue
+        score = float(entry["vector"] @ query)
+        if score >= best_score:
+            best, best_score = entry, score
+    return best
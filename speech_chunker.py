@@ -0,0 +1,97 @@
+#--------------------------------------------------------------------------------------
+# speech_chunker.py – Splits streamed NPC text into sentence chunks for incremental TTS
+#--------------------------------------------------------------------------------------
+
+import re
+
+
+#--------------------------------------------------------------------------------------
+# Configuration
+#--------------------------------------------------------------------------------------
+
+# A sentence ends at . ! ? or … (optionally followed by closing quotes/brackets) plus whitespace,
+# or at a line break. "2.00 gold" is not split because no whitespace follows the dot.
+SENTENCE_END = re.compile(r"(?<=[.!?…])[\"')\]]*\s+|\n+")
+CLAUSE_END = re.compile(r"(?<=[,;:—–])\s+")
+
+FIRST_CHUNK_MIN_CHARS = 12  # short first chunk: audio starts as early as possible
+CHUNK_MIN_CHARS = 40        # later chunks: merge very short sentences ("Arr!") with the next one
+CHUNK_MAX_CHARS = 220       # overlong sentences are split at a clause or word boundary
+
+
+#--------------------------------------------------------------------------------------
+# Sentence chunker
+#--------------------------------------------------------------------------------------
+
+class SentenceChunker:
+    """
+    Collects text deltas and hands out speakable chunks as soon as they are complete.
+    Usage: call `feed()` with every delta and `flush()` once the text has ended.
+    """
+
+    def __init__(self, first_min_chars=FIRST_CHUNK_MIN_CHARS, min_chars=CHUNK_MIN_CHARS, max_chars=CHUNK_MAX_CHARS):
+        self.first_min_chars = first_min_chars
+        self.min_chars = min_chars
+        self.max_chars = max_chars
+        self._buffer = ""
+        self._emitted = 0
+
+    def feed(self, delta):
+        """
+        Adds a text delta.
+        :param delta: (str) Next piece of the NPC reply.
+        :return: (list[str]) Chunks completed by this delta, in order (often empty).
+        """
+        self._buffer += delta
+        chunks = []
+        while True:
+            cut = self._find_cut()
+            if cut is None:
+                break
+            self._emit(self._buffer[:cut], chunks)
+            self._buffer = self._buffer[cut:]
+        return chunks
+
+    def flush(self):
+        """
+        Ends the text and returns whatever is left.
+        :return: (list[str]) The remaining chunk, if any.
+        """
+        chunks = []
+        self._emit(self._buffer, chunks)
+        self._buffer = ""
+        return chunks
+
+    def _emit(self, text, chunks):
+        text = text.strip()
+        if text:
+            chunks.append(text)
+            self._emitted += 1
+
+    def _find_cut(self):
+        """
+        Returns the buffer position after the next complete chunk, or None to wait for more text.
+        """
+        min_chars = self.min_chars if self._emitted else self.first_min_chars
+        for match in SENTENCE_END.finditer(self._buffer):
+            if len(self._buffer[:match.start()].strip()) >= min_chars:
+                return match.end()
+
+        if len(self._buffer) > self.max_chars:
+            window = self._buffer[:self.max_chars]
+            clauses = [m.end() for m in CLAUSE_END.finditer(window)]
+            if clauses:
+                return clauses[-1]
+            space = window.rfind(" ")
+            return space + 1 if space > 0 else self.max_chars
+        return None
+
+
+def split_into_chunks(text):
+    """
+    Splits a complete NPC reply into speakable chunks.
+    :param text: (str) Full reply text.
+    :return: (list[str]) Chunks in reading order.
+    """
+    chunker = SentenceChunker()
+    return chunker.feed(text) + chunker.flush()
@@ -0,0 +1,130 @@
+#--------------------------------------------------------------------------------------
+# trade_confirmation.py – Renders the trade confirmation question locally from templates
+#--------------------------------------------------------------------------------------
+
+import random
+from db import DB_PATH
+from inventory_store import get_item_price, get_inventory_items, get_item_catalog
+
+
+#--------------------------------------------------------------------------------------
+# Phrase templates per NPC (entity id); "default" is used for NPCs without their own set
+#--------------------------------------------------------------------------------------
+# Each entry is a format string or a list of variants, one of which is picked per turn.
+#   {buy} / {sell}  – joined item list, e.g. "5 apples for 5.00 gold and 1 pearl for 100.00 gold"
+#   item lines      – {quantity}, {name} (pluralized), {total} (price * quantity, 2 decimals)
+
+CONFIRMATION_TEMPLATES = {
+    "default": {
+        "buy_and_sell": "Are you sure you want to buy {buy} and sell {sell}? Let's make a deal!",
+        "buy": "Are you sure you want to buy {buy}?",
+        "sell": "Are you sure you want to sell {sell}?",
+        "item": "{quantity} {name} for {total} gold",
+        "unknown_item": "{quantity} {name}",
+        "short_stock": "I only have {stock} {name} left, though.",
+        "joiner": " and ",
+    },
+    1: {
+        "buy_and_sell": [
+            "So ye want {buy} and ye be sellin' me {sell}? Do we have a deal, matey?",
+            "Let me get this straight: ye get {buy}, and I get {sell}. Deal or no deal?",
+        ],
+        "buy": [
+            "{buy}, eh? Are ye sure ye want to buy that, matey?",
+            "Ye want {buy}? Say aye and it's yours!",
+            "Arr, {buy}. Do we have a deal?",
+        ],
+        "sell": [
+            "Ye be sellin' me {sell}? Are ye sure, matey?",
+            "{sell}, eh? Say aye and the gold is yours!",
+        ],
+        "item": "{quantity} {name} for {total} gold",
+        "unknown_item": "{quantity} {name}",
+        "short_stock": "Mind ye, I only got {stock} {name} in me stash!",
+        "joiner": " and ",
+    },
+}
+
+
+#--------------------------------------------------------------------------------------
+# Render the confirmation question
+#--------------------------------------------------------------------------------------
+
+def render_trade_confirmation(buy_items, sell_items, npc_id=1, db_path=DB_PATH):
+    """
+    Builds the question asking the player to confirm a parsed trade, without a model call.
+    :param buy_items: (list) Parsed trade dicts ('item', 'quantity') the player wants to buy.
+    :param sell_items: (list) Parsed trade dicts the player wants to sell.
+    :param npc_id: (int, optional) NPC whose phrase templates are used. Defaults to 1.
+    :param db_path: (str, optional) File path to the SQLite database. Defaults to 'inventory/inventory.sqlite3'.
+    :return: (str | None) Confirmation question, or None if there is nothing to confirm, a
+            quantity is missing, an item is not in the catalog or the NPC has none of an item
+            the player wants to buy (the caller then lets the model answer).
+    Notes:
+        - Prices come from the 'prices' table; if the NPC has less stock than asked for, the
+          question says so (the trade itself is still checked by `execute_trade()`).
+    """
+    if not buy_items and not sell_items:
+        return None
+    if any(not isinstance(trade["quantity"], int) or trade["quantity"] <= 0 for trade in buy_items + sell_items):
+        return None
+    known = set(get_item_catalog(db_path)["items"].values())
+    if any(trade["item"] not in known for trade in buy_items + sell_items):
+        return None
+    stock = {entry["name"]: entry["quantity"] for entry in get_inventory_items(npc_id, db_path)}
+    if any(stock.get(trade["item"], 0) <= 0 for trade in buy_items):
+        return None
+    templates = {**CONFIRMATION_TEMPLATES["default"], **CONFIRMATION_TEMPLATES.get(npc_id, {})}
+
+    buy = _render_items(buy_items, templates, db_path)
+    sell = _render_items(sell_items, templates, db_path)
+    if buy and sell:
+        text = _pick(templates["buy_and_sell"]).format(buy=buy, sell=sell)
+    elif buy:
+        text = _pick(templates["buy"]).format(buy=buy)
+    else:
+        text = _pick(templates["sell"]).format(sell=sell)
+    text = text[0].upper() + text[1:]
+
+    for trade in buy_items:
+        available = stock[trade["item"]]
+        if available < trade["quantity"]:
+            name = pluralize(trade["item"], available)
+            text += " " + _pick(templates["short_stock"]).format(stock=available, name=name)
+    return text
+
+
+def _render_items(trades, templates, db_path):
+    lines = []
+    for trade in trades:
+        quantity = trade["quantity"]
+        name = pluralize(trade["item"], quantity)
+        price = get_item_price(trade["item"], db_path)
+        if price is None:
+            lines.append(_pick(templates["unknown_item"]).format(quantity=quantity, name=name))
+        else:
+            lines.append(_pick(templates["item"]).format(quantity=quantity, name=name, total=f"{price * quantity:.2f}"))
+    return templates["joiner"].join(lines)
+
+
+def _pick(template):
+    return random.choice(template) if isinstance(template, list) else template
+
+
+def pluralize(name, quantity):
+    """
+    Returns the English plural of an item name for quantities other than 1.
+    :param name: (str) Singular item name, e.g. 'apple' or 'bottle of rum'.
+    :param quantity: (int) Number of items.
+    :return: (str) 'apple' / 'apples', 'bottle of rum' / 'bottles of rum'.
+    """
+    if quantity == 1 or not name:
+        return name
+    head, sep, tail = name.partition(" of ")
+    if head.endswith(("s", "x", "ch", "sh")):
+        head += "es"
+    elif head.endswith("y") and head[-2:-1] not in ("a", "e", "i", "o", "u"):
+        head = head[:-1] + "ies"
+    else:
+        head += "s"
+    return head + sep + tail
@@ -0,0 +1,234 @@
+#--------------------------------------------------------------------------------------
+# trade_state.py – Per-conversation trade state machine, held in memory with TTL expiry
+#--------------------------------------------------------------------------------------
+#
+#   idle ──propose──> proposed ──confirm──> confirmed
+#                        │  ↺ propose         (any state ──propose──> proposed)
+#                        ├──cancel───> cancelled
+#                        └──TTL──────> idle
+#
+# Every turn asks whether a trade is waiting for the player's consent. The answer comes
+# from this process's memory; the database is only read the first time a conversation is
+# seen (to pick up the state from before a restart). Changes are written behind: a
+# snapshot thread upserts changed conversations into trade_status every few hundred ms.
+# A conversation should stay on one server process (sticky sessions) while a trade is open.
+
+import atexit
+import os
+import threading
+import time
+from collections import OrderedDict
+from db import DB_PATH, DEFAULT_CONVERSATION_ID, get_connection, transaction
+
+
+#--------------------------------------------------------------------------------------
+# Configuration
+#--------------------------------------------------------------------------------------
+
+IDLE, PROPOSED, CONFIRMED, CANCELLED = "idle", "proposed", "confirmed", "cancelled"
+
+# Seconds a proposed trade waits for the player's consent (also the expiry of the stored basket)
+TRADE_TTL = float(os.getenv("NPC_TRADE_TTL", "600"))
+PERSIST = os.getenv("NPC_TRADE_STATE_PERSIST", "1") != "0"
+SNAPSHOT_INTERVAL = float(os.getenv("NPC_TRADE_STATE_FLUSH_MS", "200")) / 1000
+CACHED_STATES = 10000  # conversations kept in memory; only settled, already written ones are dropped
+
+_states = OrderedDict()  # (db_path, conversation_id) -> {"state", "expires_at"}, least recently used first
+_dirty = set()           # keys changed since the last snapshot
+_lock = threading.Lock()
+_snapshot_lock = threading.Lock()
+_snapshot_wanted = threading.Event()
+_snapshot_thread = None
+
+
+#--------------------------------------------------------------------------------------
+# Read and change the state of a conversation
+#--------------------------------------------------------------------------------------
+
+def get_trade_state(conversation_id=DEFAULT_CONVERSATION_ID, db_path=DB_PATH):
+    """
+    Returns the trade state of a conversation; a proposal older than TRADE_TTL is expired to idle.
+    :param conversation_id: (str, optional) Conversation to check. Defaults to 'default'.
+    :param db_path: (str, optional) Path to SQLite database file. Defaults to 'inventory/inventory.sqlite3'.
+    :return: (str) 'idle', 'proposed', 'confirmed' or 'cancelled'.
+    """
+    key = (db_path, conversation_id)
+    with _lock:
+        entry = _states.get(key)
+    if entry is None:
+        entry = _load(key)
+
+    with _lock:
+        entry = _states.setdefault(key, entry)
+        if entry["state"] == PROPOSED and entry["expires_at"] <= time.time():
+            print(f"Trade state {conversation_id}: proposal expired")  # Debugging
+            entry = _set(key, IDLE)
+        else:
+            _states.move_to_end(key)
+            _evict()
+        return entry["state"]
+
+
+def is_trade_pending(conversation_id=DEFAULT_CONVERSATION_ID, db_path=DB_PATH):
+    """
+    Tells whether a proposed trade is waiting for the player's consent.
+    :param conversation_id: (str, optional) Conversation to check. Defaults to 'default'.
+    :param db_path: (str, optional) Path to SQLite database file. Defaults to 'inventory/inventory.sqlite3'.
+    :return: (bool) True in state 'proposed'.
+    """
+    return get_trade_state(conversation_id, db_path) == PROPOSED
+
+
+def propose_trade(conversation_id=DEFAULT_CONVERSATION_ID, db_path=DB_PATH):
+    """
+    Moves a conversation to 'proposed' (a new proposal replaces an open one and restarts the TTL).
+    :param conversation_id: (str, optional) Conversation to update. Defaults to 'default'.
+    :param db_path: (str, optional) Path to SQLite database file. Defaults to 'inventory/inventory.sqlite3'.
+    :return: (bool) Always True.
+    """
+    return _transition(conversation_id, PROPOSED, None, db_path)
+
+
+def confirm_trade(conversation_id=DEFAULT_CONVERSATION_ID, db_path=DB_PATH):
+    """
+    Moves a proposed trade to 'confirmed'.
+    :param conversation_id: (str, optional) Conversation to update. Defaults to 'default'.
+    :param db_path: (str, optional) Path to SQLite database file. Defaults to 'inventory/inventory.sqlite3'.
+    :return: (bool) False if no trade was proposed (or the proposal expired).
+    """
+    return _transition(conversation_id, CONFIRMED, (PROPOSED,), db_path)
+
+
+def cancel_trade(conversation_id=DEFAULT_CONVERSATION_ID, db_path=DB_PATH):
+    """
+    Moves a proposed trade to 'cancelled'.
+    :param conversation_id: (str, optional) Conversation to update. Defaults to 'default'.
+    :param db_path: (str, optional) Path to SQLite database file. Defaults to 'inventory/inventory.sqlite3'.
+    :return: (bool) False if no trade was proposed (or the proposal expired).
+    """
+    return _transition(conversation_id, CANCELLED, (PROPOSED,), db_path)
+
+
+def reset_trade(conversation_id=DEFAULT_CONVERSATION_ID, db_path=DB_PATH):
+    """
+    Moves a conversation back to 'idle', dropping any proposal (e.g. when the chat page is reloaded).
+    :param conversation_id: (str, optional) Conversation to update. Defaults to 'default'.
+    :param db_path: (str, optional) Path to SQLite database file. Defaults to 'inventory/inventory.sqlite3'.
+    :return: (bool) Always True.
+    """
+    return _transition(conversation_id, IDLE, None, db_path)
+
+
+def _transition(conversation_id, state, allowed_from, db_path):
+    current = get_trade_state(conversation_id, db_path)  # applies TTL expiry first
+    if allowed_from is not None and current not in allowed_from:
+        print(f"Trade state {conversation_id}: {current} -> {state} not allowed")  # Debugging
+        return False
+    if current == state != PROPOSED:
+        return True  # nothing to write (e.g. resetting an idle conversation)
+    with _lock:
+        _set((db_path, conversation_id), state)
+    print(f"Trade state {conversation_id}: {current} -> {state}")  # Debugging
+    return True
+
+
+def _set(key, state):
+    """
+    Stores a new state and queues it for the next snapshot. Must be called with _lock held.
+    :return: (dict) The new entry.
+    """
+    entry = {"state": state, "expires_at": time.time() + TRADE_TTL if state == PROPOSED else 0}
+    _states[key] = entry
+    _states.move_to_end(key)
+    if PERSIST:
+        _dirty.add(key)
+        _start_snapshots()
+        _snapshot_wanted.set()
+    _evict()
+    return entry
+
+
+def _evict():
+    """
+    Drops least recently used conversations beyond CACHED_STATES, except open proposals and
+    states not written yet. Must be called with _lock held.
+    """
+    if len(_states) <= CACHED_STATES:
+        return
+    for key in list(_states):
+        if len(_states) <= CACHED_STATES:
+            break
+        if _states[key]["state"] != PROPOSED and key not in _dirty:
+            del _states[key]
+
+
+def _load(key):
+    """
+    Reads the last snapshot of a conversation not seen by this process yet (idle if there is none).
+    The caller inserts it; an entry another thread stored meanwhile wins.
+    """
+    if PERSIST:
+        db_path, conversation_id = key
+        row = get_connection(db_path).execute("""
+            SELECT state, expires_at FROM trade_status WHERE conversation_id = ?
+        """, (conversation_id,)).fetchone()
+        if row and row[0]:
+            return {"state": row[0], "expires_at": row[1] or 0}
+    return {"state": IDLE, "expires_at": 0}
+
+
+#--------------------------------------------------------------------------------------
+# Write-behind snapshot to trade_status
+#--------------------------------------------------------------------------------------
+
+def _start_snapshots():
+    global _snapshot_thread
+    if _snapshot_thread is None:
+        _snapshot_thread = threading.Thread(target=_snapshot_loop, name="trade-state-snapshot", daemon=True)
+        _snapshot_thread.start()
+
+
+def _snapshot_loop():
+    while True:
+        _snapshot_wanted.wait()
+        time.sleep(SNAPSHOT_INTERVAL)  # lets changes of other conversations join the same commit
+        _snapshot_wanted.clear()
+        write_snapshot()
+
+
+@atexit.register
+def write_snapshot():
+    """
+    Writes the states changed since the last snapshot to trade_status, one transaction per database.
+    :return: (int) Number of conversations written.
+    """
+    with _snapshot_lock:  # an older snapshot must not be written after a newer one
+        return _write_snapshot()
+
+
+def _write_snapshot():
+    with _lock:
+        changed = {key: dict(_states[key]) for key in _dirty if key in _states}
+        _dirty.clear()
+
+    by_db = {}
+    for (db_path, conversation_id), entry in changed.items():
+        by_db.setdefault(db_path, []).append(
+            (conversation_id, int(entry["state"] == PROPOSED), entry["state"], entry["expires_at"]))
+
+    written = 0
+    for db_path, rows in by_db.items():
+        try:
+            with transaction(db_path) as conn:
+                conn.executemany("""
+                    INSERT INTO trade_status (conversation_id, is_active, state, expires_at) VALUES (?, ?, ?, ?)
+                    ON CONFLICT (conversation_id) DO UPDATE SET
+                        is_active = excluded.is_active, state = excluded.state, expires_at = excluded.expires_at
+                """, rows)
+            written += len(rows)
+        except Exception as e:
+            print(f"Trade state snapshot of {len(rows)} conversations failed, will retry: {e}")  # Debugging
+            with _lock:
+                _dirty.update((db_path, row[0]) for row in rows)
+            _snapshot_wanted.set()
+    return written
@@ -0,0 +1,312 @@
+#--------------------------------------------------------------------------------------
+# vector_memory.py – Embedded semantic memory: memory-mapped embedding matrix over chat_history
+#--------------------------------------------------------------------------------------
+#
+# Every player and NPC message gets an embedding row in a float32 matrix stored next to the
+# database (inventory.sqlite3-vectors.f32) plus a metadata row (chat_history id, conversation,
+# entity, role) in inventory.sqlite3-vectors.meta. Both files are np.memmap arrays, so the
+# index opens instantly and grows by appending. Queries are one vectorized dot product over
+# the rows that pass the filters; above ANN_MIN_ROWS candidates an inverted-file index
+# (k-means lists) limits the dot product to the closest lists. The lists are trained in a
+# background thread (about a second at 100k rows); searches stay exact until it is ready.
+
+import os
+import re
+import threading
+import zlib
+import numpy as np
+from db import DB_PATH, get_connection
+
+
+#--------------------------------------------------------------------------------------
+# Configuration
+#--------------------------------------------------------------------------------------
+
+SEMANTIC_MEMORY_ENABLED = os.getenv("NPC_SEMANTIC_MEMORY", "1") != "0"
+EMBEDDER = os.getenv("NPC_EMBEDDER", "hash")
+
+INITIAL_CAPACITY = 1024   # rows; files double when full
+SYNC_BATCH = 2000         # chat_history rows embedded per read while catching up
+
+ANN_MIN_ROWS = int(os.getenv("NPC_MEMORY_ANN_ROWS", "50000"))  # candidates before the approximate search is used
+ANN_PROBES = 16           # lists searched per query (about 95% recall@3 at 100k rows)
+ANN_TRAIN_SAMPLE = 20000  # rows used to train the list centroids
+ANN_TRAIN_ROUNDS = 8
+
+ROLES = {"user": 0, "assistant": 1}
+META_DTYPE = np.dtype([("id", "<i8"), ("conversation", "<u8"), ("entity", "<i4"), ("role", "i1")])
+
+HASH_DIM = 512
+WORD = re.compile(r"[a-z0-9']+")
+STOP_WORDS = frozenset("""
+    a about an and any are at be but by can could did do does for from had has have how i if in is
+    it just like me much my of on or so some tell than that the then there this to want was we
+    what whatever when where which who will with would ye yer you your
+""".split())
+
+_indexes = {}  # db_path -> VectorIndex
+_indexes_lock = threading.Lock()
+
+
+#--------------------------------------------------------------------------------------
+# Embedders
+#--------------------------------------------------------------------------------------
+
+def hash_embedding(text):
+    """
+    Local embedding by signed feature hashing of words, word pairs and character trigrams.
+    Needs no model or network; similar wording (also plural/singular forms) scores high,
+    paraphrases with no shared words do not (register a model-based embedder for those).
+    :param text: (str) Message text.
+    :return: (np.ndarray) L2-normalized float32 vector of HASH_DIM values (all zero for empty text).
+    """
+    words = [w for w in WORD.findall(text.lower()) if w not in STOP_WORDS]
+    words = [w[:-1] if len(w) > 3 and w.endswith("s") and not w.endswith("ss") else w for w in words]
+    features = [(w, 1.0) for w in words]
+    features += [(f"{a} {b}", 0.5) for a, b in zip(words, words[1:])]
+    features += [(f"#{w}#"[i:i + 3], 0.25) for w in words for i in range(len(w))]
+
+    vector = np.zeros(HASH_DIM, dtype=np.float32)
+    for feature, weight in features:
+        h = zlib.crc32(feature.encode())
+        vector[h % HASH_DIM] += weight if h & 0x80000000 else -weight
+    norm = np.linalg.norm(vector)
+    return vector / norm if norm else vector
+
+
+# name -> (embed function text -> float32 vector, dimension)
+EMBEDDERS = {
+    "hash": (hash_embedding, HASH_DIM),
+}
+
+
+def register_embedder(name, embed, dim):
+    """
+    Adds an embedder that can then be selected with NPC_EMBEDDER=<name>, e.g. a local
+    sentence-transformer model. Each embedder keeps its own index files.
+    :param name: (str) Embedder name.
+    :param embed: (callable) `embed(text)` -> L2-normalized vector of `dim` floats.
+    :param dim: (int) Vector dimension.
+    :return: None
+    """
+    EMBEDDERS[name] = (embed, dim)
+
+
+def conversation_key(conversation_id):
+    """
+    Stable 64-bit key of a conversation id, as stored in the metadata file.
+    """
+    return zlib.crc32(conversation_id.encode()) << 32 | zlib.crc32(conversation_id[::-1].encode())
+
+
+#--------------------------------------------------------------------------------------
+# Index files
+#--------------------------------------------------------------------------------------
+
+class VectorIndex:
+    """
+    Embeddings of one database's chat messages, kept in two memory-mapped files.
+    :param db_path: (str) Database whose chat_history is indexed; the files are stored beside it.
+    :param embedder: (str) Name from EMBEDDERS.
+    """
+
+    def __init__(self, db_path, embedder=EMBEDDER):
+        self.db_path = db_path
+        self.embed, self.dim = EMBEDDERS[embedder]
+        suffix = "" if embedder == "hash" else f"-{embedder}"
+        self.vector_path = f"{db_path}-vectors{suffix}.f32"
+        self.meta_path = f"{db_path}-vectors{suffix}.meta"
+        self.lock = threading.Lock()
+        self.ann = None  # [centroids, list number of every row, rows at training] once the index is large
+        self.training = False
+        self._open(max(INITIAL_CAPACITY, self._stored_rows()))
+        # Rows are appended in id order and a row counts once its id is written
+        self.count = int(np.count_nonzero(self.meta["id"]))
+        self.last_id = int(self.meta["id"][self.count - 1]) if self.count else 0
+
+    def _stored_rows(self):
+        return os.path.getsize(self.meta_path) // META_DTYPE.itemsize if os.path.exists(self.meta_path) else 0
+
+    def _open(self, capacity):
+        for path, row_bytes in ((self.vector_path, self.dim * 4), (self.meta_path, META_DTYPE.itemsize)):
+            with open(path, "ab") as f:
+                if f.tell() < capacity * row_bytes:
+                    f.truncate(capacity * row_bytes)
+        self.vectors = np.memmap(self.vector_path, dtype=np.float32, mode="r+", shape=(capacity, self.dim))
+        self.meta = np.memmap(self.meta_path, dtype=META_DTYPE, mode="r+", shape=(capacity,))
+        self.capacity = capacity
+
+    def _append(self, rows):
+        """
+        Embeds and appends (id, role, entity_id, conversation_id, text) rows, in id order.
+        """
+        if self.count + len(rows) > self.capacity:
+            self.vectors.flush()
+            self.meta.flush()
+            self._open(max(self.capacity * 2, self.count + len(rows)))
+
+        start = self.count
+        end = start + len(rows)
+        self.vectors[start:end] = np.stack([self.embed(text) for _, _, _, _, text in rows])
+        # Metadata last: a row is only valid once its id is set
+        self.meta[start:end] = [
+            (0, conversation_key(conversation_id or ""), -1 if entity_id is None else entity_id, ROLES[role])
+            for _, role, entity_id, conversation_id, _ in rows
+        ]
+        self.meta["id"][start:end] = [row[0] for row in rows]
+        self.count = end
+        self.last_id = rows[-1][0]
+
+        if self.ann is not None:
+            self.ann[1] = np.concatenate([self.ann[1], self._assign(self.vectors[start:end], self.ann[0])])
+        if self.count >= ANN_MIN_ROWS and not self.training and (self.ann is None or self.count >= 2 * self.ann[2]):
+            # Not on this thread: it is a request or the memory-writer flush, and holds self.lock
+            self.training = True
+            threading.Thread(target=self._train_ann_in_background, name="memory-ann", daemon=True).start()
+
+    def sync(self):
+        """
+        Appends all chat messages stored since the last call (also by other server processes).
+        :return: (int) Number of rows added.
+        """
+        added = 0
+        cursor = get_connection(self.db_path).cursor()
+        while True:
+            cursor.execute("""
+                SELECT id, role, entity_id, conversation_id, text FROM chat_history
+                WHERE id > ? AND role IN ('user', 'assistant') AND TRIM(text) <> ''
+                ORDER BY id ASC LIMIT ?
+            """, (self.last_id, SYNC_BATCH))
+            rows = cursor.fetchall()
+            if not rows:
+                return added
+            self._append(rows)
+            added += len(rows)
+
+    #----------------------------------------------------------------------------------
+    # Approximate search for large indexes (inverted file over k-means lists)
+    #----------------------------------------------------------------------------------
+
+    def _train_ann_in_background(self):
+        try:
+            self._train_ann()
+        except Exception as e:
+            print(f"Training the approximate memory index failed: {e}")
+        finally:
+            self.training = False
+
+    def _train_ann(self):
+        """
+        Trains the lists on the rows stored so far and swaps them in; the previous lists (or the
+        exact search) keep serving queries meanwhile. Call without holding self.lock.
+        """
+        with self.lock:
+            count, vectors = self.count, self.vectors  # rows below count never change
+        lists = min(1024, int(np.sqrt(count)))
+        rng = np.random.default_rng(0)
+        sample = vectors[rng.choice(count, min(count, ANN_TRAIN_SAMPLE), replace=False)]
+        centroids = sample[rng.choice(len(sample), lists, replace=False)].copy()
+        for _ in range(ANN_TRAIN_ROUNDS):
+            assignment = self._assign(sample, centroids)
+            for k in range(lists):
+                members = sample[assignment == k]
+                if len(members):
+                    centroid = members.sum(axis=0)
+                    centroids[k] = centroid / (np.linalg.norm(centroid) or 1)
+        assignment = self._assign(vectors[:count], centroids)
+        with self.lock:
+            if self.count > count:  # rows appended during training
+                assignment = np.concatenate([assignment, self._assign(self.vectors[count:self.count], centroids)])
+            self.ann = [centroids, assignment, count]
+
+    @staticmethod
+    def _assign(vectors, centroids):
+        return np.concatenate([np.argmax(vectors[i:i + 8192] @ centroids.T, axis=1)
+                               for i in range(0, len(vectors), 8192)]).astype(np.int32)
+
+    #----------------------------------------------------------------------------------
+    # Query
+    #----------------------------------------------------------------------------------
+
+    def search(self, text, k=3, role=None, entity_id=None, conversation_id=None, skip_recent=0):
+        """
+        Returns the stored messages most similar to a text.
+        :param text: (str) Query text.
+        :param k: (int, optional) Number of results. Defaults to 3.
+        :param role: (str, optional) Only 'user' or only 'assistant' messages.
+        :param entity_id: (int, optional) Only messages stored with this entity id.
+        :param conversation_id: (str, optional) Only messages of this conversation.
+        :param skip_recent: (int, optional) Ignore the newest n matching messages (already in the prompt).
+        :return: (list) (chat_history id, score) pairs, best first.
+        """
+        query = self.embed(text)
+        meta = self.meta[:self.count]
+        mask = np.ones(self.count, dtype=bool)
+        if role is not None:
+            mask &= meta["role"] == ROLES[role]
+        if entity_id is not None:
+            mask &= meta["entity"] == entity_id
+        if conversation_id is not None:
+            mask &= meta["conversation"] == conversation_key(conversation_id)
+        candidates = np.flatnonzero(mask)
+        if skip_recent:
+            candidates = candidates[:-skip_recent]
+
+        if self.ann is not None and len(candidates) >= ANN_MIN_ROWS:
+            centroids, assignment, _ = self.ann
+            probes = np.argpartition(-(centroids @ query), min(ANN_PROBES, len(centroids) - 1))[:ANN_PROBES]
+            candidates = candidates[np.isin(assignment[candidates], probes)]
+        if not len(candidates):
+            return []
+
+        if len(candidates) * 4 > self.count:
+            scores = (self.vectors[:self.count] @ query)[candidates]  # one contiguous pass beats gathering rows
+        else:
+            scores = self.vectors[candidates] @ query
+        top = np.argpartition(-scores, min(k, len(scores)) - 1)[:k]
+        top = top[np.argsort(-scores[top])]
+        return [(int(meta["id"][candidates[i]]), float(scores[i])) for i in top]
+
+
+#--------------------------------------------------------------------------------------
+# Module interface (used by memory_store.py)
+#--------------------------------------------------------------------------------------
+
+def get_index(db_path=DB_PATH):
+    """
+    Returns the open index of a database, opening (and catching up) on first use.
+    :param db_path: (str, optional) Path to SQLite database file. Defaults to 'inventory/inventory.sqlite3'.
+    :return: (VectorIndex) Shared index; use its lock around sync/search.
+    """
+    with _indexes_lock:
+        index = _indexes.get(db_path)
+        if index is None:
+            index = _indexes[db_path] = VectorIndex(db_path)
+    return index
+
+
+def index_new_messages(db_path=DB_PATH):
+    """
+    Embeds the chat messages stored since the last call into the index.
+    :param db_path: (str, optional) Path to SQLite database file. Defaults to 'inventory/inventory.sqlite3'.
+    :return: (int) Number of messages added (0 if semantic memory is disabled).
+    """
+    if not SEMANTIC_MEMORY_ENABLED:
+        return 0
+    index = get_index(db_path)
+    with index.lock:
+        return index.sync()
+
+
+def search_messages(text, k=3, role=None, entity_id=None, conversation_id=None, skip_recent=0, db_path=DB_PATH):
+    """
+    Semantic search over stored chat messages; see `VectorIndex.search()` for the filters.
+    :param db_path: (str, optional) Path to SQLite database file. Defaults to 'inventory/inventory.sqlite3'.
+    :return: (list) (chat_history id, score) pairs, best first; empty if semantic memory is disabled.
+    """
+    if not SEMANTIC_MEMORY_ENABLED:
+        return []
+    index = get_index(db_path)
+    with index.lock:
+        index.sync()
+        return index.search(text, k, role, entity_id, conversation_id, skip_recent)